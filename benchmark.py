@@ -0,0 +1,906 @@
+"""
+Benchmarks for each stage of rendering (parsing, rendering, escaping and
+optionally compiling) over a generated markdown corpus.
+
+    python benchmark.py --sizes 1K,100K,10M -o results.json
+    python benchmark.py --baseline results.json --threshold 0.25
+    python benchmark.py --engine ./stub-xelatex
+    python benchmark.py --kinds bigtable --sizes 2M --table-backend longtable
+    python benchmark.py --kinds bigcode --sizes 1M --code-backend verbatim --engine xelatex
+    python benchmark.py --packages --sizes 1K,100K --engine xelatex
+    python benchmark.py --startup --engine xelatex --repeat 10
+    python benchmark.py --images ./screenshots --image-dpi 150
+    python benchmark.py --kinds mixed --sizes 50M --repeat 1 --memory
+    python benchmark.py --depths 100,1000,10000
+    python benchmark.py --paragraph-lines 10000,50000,100000
+    python benchmark.py --stdin-memory 20M
+
+The corpus is generated from a fixed seed, so the same document is
+produced on every run and results can be compared between commits. When
+a baseline is given, the run fails if any stage is slower than the
+baseline by more than the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+import mistletoe
+
+from unquietcode.tools.martek import LatexRenderer, parse_markdown, write_markdown
+from unquietcode.tools.martek.compiler import ENGINE, build_format, compile_pdf, precompiled_format, read_dump, render_pdf
+from unquietcode.tools.martek.escaping import escape_latex
+from unquietcode.tools.martek.elements import Block, Container, Span
+from unquietcode.tools.martek.latex_renderer import CODE_BACKENDS, TABLE_BACKENDS, merge_packages
+
+KINDS = ('lists', 'tables', 'code', 'inline', 'mixed', 'bigtable', 'bigcode', 'prose')
+DEFAULT_KINDS = KINDS[:5]
+STAGES = ('parse', 'render', 'escape', 'compile')
+UNITS = {'K': 1024, 'M': 1024 * 1024}
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua 50% #1 $5 a_b x^2 ~ & {}"
+).split()
+
+
+########################################################################
+# corpus
+
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def inline_text(rng, words=40):
+    parts = []
+
+    for _ in range(words):
+        word = rng.choice(WORDS)
+        style = rng.randrange(8)
+
+        if style == 0:
+            word = f"*{word}*"
+        elif style == 1:
+            word = f"**{word}**"
+        elif style == 2:
+            word = f"~~{word}~~"
+        elif style == 3:
+            word = f"`{word}`"
+        elif style == 4:
+            word = f"[{word}](https://example.com/{rng.randrange(1000)}?q={word})"
+        elif style == 5:
+            word = f"***{word}** and _{rng.choice(WORDS)}_*"
+
+        parts.append(word)
+
+    return ' '.join(parts)
+
+
+def nested_list(rng):
+    lines = []
+    depth = 0
+
+    for idx in range(rng.randrange(10, 40)):
+        # a list which starts indented would be an indented code block
+        depth = max(0, min(6, depth + rng.choice((-1, 0, 1)))) if idx else 0
+        marker = '-' if rng.randrange(2) else '1.'
+        lines.append(f"{'    ' * depth}{marker} {inline_text(rng, rng.randrange(3, 12))}")
+
+    return lines
+
+
+def table(rng):
+    columns = rng.randrange(2, 7)
+    lines = [
+        '| ' + ' | '.join(f"Column {i + 1}" for i in range(columns)) + ' |',
+        '|' + '|'.join(rng.choice((' --- ', ':---', '---:', ':---:')) for _ in range(columns)) + '|',
+    ]
+
+    for _ in range(rng.randrange(20, 200)):
+        lines.append('| ' + ' | '.join(inline_text(rng, rng.randrange(1, 5)) for _ in range(columns)) + ' |')
+
+    return lines
+
+
+def big_table(rng, size):
+    """
+    A single table of as many rows as fit in `size` bytes (about 50,000
+    rows for 2M), for testing tables which run over many pages.
+    """
+    lines = ["| # | Name | Description | Value |", "|---:|---|---|---:|"]
+    length = sum(len(line) + 1 for line in lines)
+
+    while length < size:
+        line = f"| {len(lines) - 1} | {inline_text(rng, 1)} | {sentence(rng, 3)} | {rng.randrange(100000) / 100} |"
+        lines.append(line)
+        length += len(line) + 1
+
+    return '\n'.join(lines)
+
+
+def big_code_fence(rng, size):
+    """
+    A single code fence of as many lines as fit in `size` bytes (about
+    20,000 lines for 1M), like a long log dump.
+    """
+    lines = ["```"]
+    length = 4
+
+    while length < size:
+        line = f"2024-01-01 00:00:{len(lines) % 60:02} [{rng.choice(('INFO', 'WARN', 'DEBUG'))}] {sentence(rng, 4)}"
+        lines.append(line)
+        length += len(line) + 1
+
+    lines.append("```")
+    return '\n'.join(lines)
+
+
+def code_fence(rng):
+    lines = ["```python"]
+
+    for i in range(rng.randrange(50, 500)):
+        indent = '    ' * rng.randrange(4)
+        lines.append(f"{indent}value_{i} = compute({rng.choice(WORDS)!r}, {rng.randrange(100)})  # {sentence(rng, 4)}")
+
+    lines.append("```")
+    return lines
+
+
+def paragraphs(rng):
+    lines = [f"{'#' * rng.randrange(1, 4)} {sentence(rng, 4)}", ""]
+
+    for _ in range(rng.randrange(2, 6)):
+        lines.append(inline_text(rng, rng.randrange(20, 80)))
+        lines.append("")
+
+    return lines
+
+
+def plain_paragraphs(rng):
+    """
+    Headings and paragraphs of plain text, which need no packages of
+    their own.
+    """
+    lines = [f"{'#' * rng.randrange(1, 4)} {sentence(rng, 4)}", ""]
+
+    for _ in range(rng.randrange(2, 6)):
+        lines.append(' '.join(sentence(rng) + '.' for _ in range(rng.randrange(2, 6))))
+        lines.append("")
+
+    return lines
+
+
+GENERATORS = {
+    'lists': (nested_list,),
+    'tables': (table,),
+    'code': (code_fence,),
+    'inline': (paragraphs,),
+    'mixed': (nested_list, table, code_fence, paragraphs),
+    'prose': (plain_paragraphs,),
+}
+
+
+def generate_corpus(size, kind='mixed', seed=0) -> str:
+    """
+    Generate a markdown document of roughly `size` bytes, made up of the
+    blocks for the given kind of corpus. The same arguments always produce
+    the same document.
+    """
+    rng = random.Random(f"{kind}:{seed}")
+
+    if kind == 'bigtable':
+        return big_table(rng, size)
+
+    if kind == 'bigcode':
+        return big_code_fence(rng, size)
+
+    generators = GENERATORS[kind]
+    lines = []
+    length = 0
+
+    while length < size:
+        for line in rng.choice(generators)(rng) + [""]:
+            lines.append(line)
+            length += len(line) + 1
+
+    return '\n'.join(lines)
+
+
+def parse_size(text) -> int:
+    text = text.strip().upper().rstrip('B')
+
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+
+    return int(text)
+
+
+def format_size(size) -> str:
+    for unit in ('M', 'K'):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f"{size // UNITS[unit]}{unit}"
+
+    return str(size)
+
+
+########################################################################
+# stages
+
+def timed(fn, repeat):
+    times = []
+    result = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+
+    return result, times
+
+
+def benchmark_document(text, repeat=3, engine=None, **options):
+    stages = {}
+
+    document, stages['parse'] = timed(lambda: parse_markdown(text), repeat)
+    tex, stages['render'] = timed(lambda: LatexRenderer(**options).render(document), repeat)
+
+    lines = text.splitlines()
+    _, stages['escape'] = timed(lambda: [escape_latex(line) for line in lines], repeat)
+
+    if engine:
+        with TemporaryDirectory() as tmp:
+            tex_file_path = f"{tmp}/data.tex"
+
+            with open(tex_file_path, 'w') as tex_file:
+                tex_file.write(tex)
+
+            compile = lambda: compile_pdf(tex_file_path, f"{tmp}/data.pdf", engine=engine, cache=False)
+            _, stages['compile'] = timed(compile, repeat)
+
+    return {
+        stage: {
+            'best': min(times),
+            'median': statistics.median(times),
+            'mb_per_second': len(text) / min(times) / UNITS['M'] if min(times) else None,
+        }
+        for stage, times in stages.items()
+    }
+
+
+class BaselineString:
+    """
+    A string, wrapped in an object as every string in the tree used to be.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+
+class BaselineContainer:
+    """
+    The containers of the element tree as they used to be, with their
+    attributes in a __dict__ rather than in slots.
+    """
+
+    def __init__(self, action=None):
+        self.action = action
+        self.elements = []
+
+
+class BaselineSpan(BaselineContainer):
+    pass
+
+
+class BaselineBlock(BaselineContainer):
+
+    def __init__(self, prefix=None, suffix=None, action=None, deindent=None):
+        super().__init__()
+        self.prefix = prefix
+        self.suffix = suffix
+        self.action = action
+        self.deindent = deindent
+
+
+def baseline_copy(element):
+    if type(element) is str:
+        return BaselineString(element)
+
+    if type(element) is Block:
+        return BaselineBlock(element.prefix, element.suffix, element.action, element.deindent)
+
+    if type(element) is Span:
+        return BaselineSpan(element.action)
+
+    return BaselineString(element.value)
+
+
+def baseline_tree(root):
+    """
+    A copy of an element tree in the representation it had before the
+    elements were slotted and held their text as plain strings.
+    """
+    copy = baseline_copy(root)
+    stack = [(root, copy)]
+
+    while stack:
+        container, container_copy = stack.pop()
+
+        for element in container.elements:
+            container_copy.elements.append(element_copy := baseline_copy(element))
+
+            if isinstance(element, Container):
+                stack.append((element, element_copy))
+
+    return copy
+
+
+def tree_memory(root):
+    """
+    The number of objects in an element tree, and the bytes they take up
+    (including the strings they hold).
+    """
+    seen = set()
+    objects = 0
+    size = 0
+    stack = [root]
+
+    while stack:
+        element = stack.pop()
+
+        if id(element) in seen:
+            continue
+
+        seen.add(id(element))
+        size += sys.getsizeof(element)
+
+        if type(element) is str:
+            continue
+
+        objects += 1
+
+        if hasattr(element, '__dict__'):
+            size += sys.getsizeof(element.__dict__)
+
+        for name in ('value', 'prefix', 'suffix'):
+            if type(value := getattr(element, name, None)) is str:
+                stack.append(value)
+
+        if (elements := getattr(element, 'elements', None)) is not None:
+            size += sys.getsizeof(elements)
+            stack.extend(elements)
+
+    return {'objects': objects, 'bytes': size}
+
+
+def element_memory(text, **options):
+    """
+    The size of the element tree of a rendered document, and of the same
+    tree in the baseline representation (every string wrapped in an
+    object, and every element with a __dict__).
+    """
+    renderer = LatexRenderer(**options)
+    renderer.render(parse_markdown(text))
+    root = renderer.stack[0]
+
+    return {**tree_memory(root), 'baseline': tree_memory(baseline_tree(root))}
+
+
+def run(sizes, kinds, repeat=3, engine=None, seed=0, verbose=True, memory=False, **options):
+    results = {}
+
+    for kind in kinds:
+        for size in sizes:
+            name = f"{kind}-{format_size(size)}"
+            text = generate_corpus(size, kind, seed)
+            results[name] = {'bytes': len(text.encode('utf-8')), 'stages': benchmark_document(text, repeat, engine, **options)}
+
+            if verbose:
+                timings = '  '.join(
+                    f"{stage} {timing['best'] * 1000:9.2f}ms"
+                    for stage, timing in results[name]['stages'].items()
+                )
+                print(f"{name:<14} {timings}", flush=True)
+
+            if memory:
+                results[name]['memory'] = element_memory(text, **options)
+
+                if verbose:
+                    usage = results[name]['memory']
+                    baseline = usage['baseline']
+                    print(
+                        f"{name:<14} {usage['objects']:,} elements, {usage['bytes'] / UNITS['M']:.1f}M "
+                        f"(baseline {baseline['objects']:,} elements, {baseline['bytes'] / UNITS['M']:.1f}M)",
+                        flush=True,
+                    )
+
+    return {
+        'python': platform.python_version(),
+        'mistletoe': mistletoe.__version__,
+        'platform': platform.platform(),
+        'seed': seed,
+        'repeat': repeat,
+        'options': options,
+        'results': results,
+    }
+
+
+########################################################################
+# packages
+
+def every_package(renderer):
+    """
+    The packages of every render method, which every document loaded
+    before each one was given only the packages it uses.
+    """
+    packages = {}
+
+    for render_function in renderer.render_map.values():
+        merge_packages(packages, getattr(render_function, 'packages', {}))
+
+    return dict(sorted(packages.items()))
+
+
+def benchmark_packages(sizes, engine=None, repeat=3, seed=0, verbose=True):
+    """
+    Compare plain prose rendered with every package in its preamble, as
+    all documents were before, and with only the packages it uses (none).
+    Reports the size of the LaTeX, the number of packages loaded and the
+    number of engine runs, and with an engine, the time taken to compile.
+    """
+    results = {}
+
+    for size in sizes:
+        name = f"prose-{format_size(size)}"
+        renderer = LatexRenderer()
+        used = renderer.render(parse_markdown(generate_corpus(size, 'prose', seed)))
+        preamble = renderer.preamble()
+        renderer.packages = every_package(renderer)
+        variants = {'every package': used.replace(preamble, renderer.preamble(), 1), 'used packages': used}
+        results[name] = {}
+
+        for label, tex in variants.items():
+            result = results[name][label] = {
+                'latex_bytes': len(tex.encode('utf-8')),
+                'packages': tex.count('\\usepackage'),
+                'runs': 1,
+            }
+
+            if engine:
+                with TemporaryDirectory() as tmp:
+                    tex_file_path = f"{tmp}/data.tex"
+
+                    with open(tex_file_path, 'w') as tex_file:
+                        tex_file.write(tex)
+
+                    compile = lambda: compile_pdf(tex_file_path, f"{tmp}/data.pdf", engine=engine, cache=False)
+                    _, times = timed(compile, repeat)
+                    result['compile'] = {'best': min(times), 'median': statistics.median(times)}
+
+            if verbose:
+                timing = f"  compile {result['compile']['best']:.3f}s" if 'compile' in result else ''
+                print(
+                    f"{name:<12} {label:<14} {result['packages']:>3} packages  {result['latex_bytes']:>10,} bytes  "
+                    f"{result['runs']} run{timing}",
+                    flush=True,
+                )
+
+    return results
+
+
+########################################################################
+# startup
+
+STARTUP_DOCUMENT = "# Startup\n\nA single paragraph, so that compiling it is mostly reading the preamble.\n"
+
+
+def benchmark_startup(engine=ENGINE, repeat=5, verbose=True):
+    """
+    Time compiling a document of a single paragraph, which is mostly the
+    engine starting up and reading the preamble, once reading the whole
+    preamble every time and once loading its fixed part from a format
+    precompiled with mylatexformat. Building the format is timed on its
+    own. When the format can't be built, only the first is timed.
+    """
+    results = {}
+
+    with TemporaryDirectory() as tmp:
+        tex_file_path = f"{tmp}/data.tex"
+
+        with open(tex_file_path, 'w') as tex_file:
+            write_markdown(STARTUP_DOCUMENT, tex_file)
+
+        start = time.perf_counter()
+
+        try:
+            build_format(read_dump(tex_file_path), 'startup', tmp, engine)
+        except (OSError, subprocess.CalledProcessError) as ex:
+            results['format'] = {'error': str(ex)}
+        else:
+            results['format'] = {'seconds': time.perf_counter() - start}
+
+        modes = [('plain', False)]
+
+        # built again in the cache, if it isn't there already, before being timed
+        if 'seconds' in results['format'] and precompiled_format(tex_file_path, engine):
+            modes.append(('precompiled', True))
+
+        for label, precompile in modes:
+            compile = lambda: compile_pdf(tex_file_path, f"{tmp}/data.pdf", engine=engine, precompile=precompile, cache=False)
+            _, times = timed(compile, repeat)
+            results[label] = {'best': min(times), 'median': statistics.median(times)}
+
+    if verbose:
+        if 'error' in results['format']:
+            print(f"format       could not be built: {results['format']['error']}")
+        else:
+            print(f"format       built in {results['format']['seconds']:.2f}s")
+
+        for label in ('plain', 'precompiled'):
+            if label in results:
+                print(f"{label:<12} best {results[label]['best']:.3f}s  median {results[label]['median']:.3f}s", flush=True)
+
+        if 'precompiled' in results:
+            print(f"startup is {results['plain']['best'] / results['precompiled']['best']:.1f}x faster with the format")
+
+    return results
+
+
+########################################################################
+# images
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+
+def benchmark_images(image_dir, dpi=150, engine=ENGINE, repeat=1):
+    """
+    Compile a document showing every image in a directory, once with the
+    original images and once with them scaled down to the given DPI, and
+    report the time taken and the size of the PDF for each.
+    """
+    names = sorted(name for name in os.listdir(image_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+    markdown = '\n\n'.join(f"![{name}]({name})" for name in names)
+    results = {}
+
+    with TemporaryDirectory() as tmp:
+        for label, image_dpi in (('original', None), (f"{dpi}dpi", dpi)):
+            pdf_file_path = f"{tmp}/{label}.pdf"
+            render = lambda: render_pdf(markdown, pdf_file_path, image_dir=image_dir, engine=engine, cache=False, image_dpi=image_dpi)
+            _, times = timed(render, repeat)
+            results[label] = {'seconds': min(times), 'pdf_bytes': os.path.getsize(pdf_file_path)}
+
+    return {'images': len(names), 'results': results}
+
+
+########################################################################
+# nesting
+
+# a generous estimate of the frames mistletoe takes to parse each level of nesting
+FRAMES_PER_LEVEL = 8
+
+
+def nested_quotes(depth, seed=0) -> str:
+    rng = random.Random(f"nesting:{seed}")
+    return f"{'>' * depth} {inline_text(rng, 20)}\n"
+
+
+def benchmark_nesting(depths, repeat=3, seed=0, verbose=True):
+    """
+    Time parsing and rendering quotes nested to each depth. Rendering
+    should take time in proportion to the depth, so the time per level
+    is reported as well.
+    """
+    results = {}
+
+    for depth in depths:
+        text = nested_quotes(depth, seed)
+        document, parse_times = timed(lambda: parse_markdown(text), repeat)
+        _, render_times = timed(lambda: LatexRenderer().render(document), repeat)
+
+        results[depth] = {
+            'parse': min(parse_times),
+            'render': min(render_times),
+            'render_per_level': min(render_times) / depth,
+        }
+
+        if verbose:
+            result = results[depth]
+            print(
+                f"depth {depth:<8} parse {result['parse'] * 1000:9.2f}ms  render {result['render'] * 1000:9.2f}ms  "
+                f"({result['render_per_level'] * 1e6:.2f}us per level)",
+                flush=True,
+            )
+
+    return results
+
+
+def find_nonlinear(results, factor, key='render_per_level', label='depth {}', per='level'):
+    """
+    Compare the render time per level (or per line) at each size with
+    that at the smallest size, returning a message for each one which is
+    more than `factor` times slower.
+    """
+    sizes = sorted(results)
+    base = results[sizes[0]][key]
+
+    return [
+        f"{label.format(size)}: {results[size][key] / base:.1f}x the time per {per} of {label.format(sizes[0])}"
+        for size in sizes[1:]
+        if results[size][key] > base * factor
+    ]
+
+
+########################################################################
+# paragraphs
+
+def prose_lines(count, seed=0) -> str:
+    """
+    A document of `count` lines of prose, in paragraphs of one to five
+    lines separated by blank lines.
+    """
+    rng = random.Random(f"paragraphs:{seed}")
+    lines = []
+
+    while len(lines) < count:
+        lines.extend(inline_text(rng, rng.randrange(5, 15)) for _ in range(rng.randrange(1, 6)))
+        lines.append("")
+
+    return '\n'.join(lines[:count]) + '\n'
+
+
+def benchmark_paragraphs(counts, repeat=3, seed=0, verbose=True):
+    """
+    Time parsing and rendering documents of prose with each number of
+    lines. Paragraph breaks are decided while rendering, so rendering
+    should take time in proportion to the number of lines, and the time
+    per line is reported as well.
+    """
+    results = {}
+
+    for count in counts:
+        text = prose_lines(count, seed)
+        document, parse_times = timed(lambda: parse_markdown(text), repeat)
+        _, render_times = timed(lambda: LatexRenderer().render(document), repeat)
+
+        results[count] = {
+            'parse': min(parse_times),
+            'render': min(render_times),
+            'render_per_line': min(render_times) / count,
+        }
+
+        if verbose:
+            result = results[count]
+            print(
+                f"{count:<8} lines  parse {result['parse'] * 1000:9.2f}ms  render {result['render'] * 1000:9.2f}ms  "
+                f"({result['render_per_line'] * 1e6:.2f}us per line)",
+                flush=True,
+            )
+
+    return results
+
+
+# renders standard input to LaTeX as `martek` does, then prints its peak RSS
+STDIN_MEMORY_SCRIPT = """
+import os, resource, sys
+from run import stdin_lines
+from unquietcode.tools.martek import write_markdown
+
+markdown = stdin_lines() if sys.argv[1] == 'stream' else sys.stdin.read()
+
+with open(os.devnull, 'w') as devnull:
+    write_markdown(markdown, devnull)
+
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def stdin_memory(size, kind='mixed', seed=0, verbose=True):
+    """
+    The peak memory of rendering a document piped in on standard input,
+    with the lines streamed into the parser (as `martek` reads them) and
+    with the whole input read into a string first. Each is run in a
+    process of its own, so that neither is measured with the other's
+    leftovers. Both parse the whole document into a tree (see
+    run.stdin_lines), so the difference is only the string of the input.
+    """
+    results = {}
+
+    with TemporaryDirectory() as tmp:
+        markdown_path = os.path.join(tmp, 'input.md')
+
+        with open(markdown_path, 'w') as markdown_file:
+            markdown_file.write(generate_corpus(size, kind, seed))
+
+        for mode in ('stream', 'read'):
+            with open(markdown_path, 'r') as markdown_file:
+                output = subprocess.check_output(
+                    [sys.executable, '-c', STDIN_MEMORY_SCRIPT, mode],
+                    stdin=markdown_file,
+                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                )
+
+            # kilobytes on Linux, bytes on macOS
+            peak = int(output.split()[-1]) * (1 if platform.system() == 'Darwin' else 1024)
+            results[mode] = {'peak_rss_bytes': peak}
+
+            if verbose:
+                print(f"{kind}-{format_size(size)} {mode:<7} peak RSS {peak / UNITS['M']:8.1f}M", flush=True)
+
+    return results
+
+
+########################################################################
+# regressions
+
+def find_regressions(current, baseline, thresholds, min_seconds=0.01):
+    """
+    Compare the best time of every stage with the baseline, returning a
+    message for each one which is slower by more than its threshold. Very
+    short stages are skipped, since their timings are mostly noise.
+    """
+    regressions = []
+
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+
+        for stage, timing in result['stages'].items():
+            previous = baseline['results'][name]['stages'].get(stage)
+
+            if previous is None or max(timing['best'], previous['best']) < min_seconds:
+                continue
+
+            change = timing['best'] / previous['best'] - 1
+
+            if change > thresholds[stage]:
+                regressions.append(
+                    f"{name} {stage}: {previous['best'] * 1000:.2f}ms -> {timing['best'] * 1000:.2f}ms "
+                    f"(+{change:.0%}, threshold {thresholds[stage]:.0%})"
+                )
+
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="benchmark parsing, rendering, escaping and compiling")
+    parser.add_argument('--sizes', default='1K,100K,1M', help="document sizes, from 1K up to 100M (default: 1K,100K,1M)")
+    parser.add_argument('--kinds', default=','.join(DEFAULT_KINDS), help=f"corpus kinds, out of {', '.join(KINDS)} (default: {','.join(DEFAULT_KINDS)})")
+    parser.add_argument('--repeat', type=int, default=3, help="runs of each stage, keeping the best (default: 3)")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the corpus generator (default: 0)")
+    parser.add_argument('--engine', help="also time compiling, with this engine (a stub works)")
+    parser.add_argument('--table-backend', default='tabular', choices=TABLE_BACKENDS, help="how tables are laid out (default: tabular)")
+    parser.add_argument('--code-backend', default='listings', choices=CODE_BACKENDS, help="how code is typeset (default: listings)")
+    parser.add_argument('-o', '--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="fail if a stage is slower than in this JSON file")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed slowdown, as a fraction (default: 0.25)")
+    parser.add_argument('--stage-threshold', action='append', default=[], metavar='STAGE=FRACTION', help="allowed slowdown for one stage")
+    parser.add_argument('--min-seconds', type=float, default=0.01, help="ignore stages faster than this (default: 0.01)")
+    parser.add_argument('--packages', action='store_true', help="compare plain prose with every package loaded and with only those it uses")
+    parser.add_argument('--startup', action='store_true', help="compare the startup time of the engine with and without a precompiled preamble")
+    parser.add_argument('--images', metavar='DIR', help="compare compiling the images in DIR before and after scaling them")
+    parser.add_argument('--image-dpi', type=int, default=150, help="resolution to scale images to (default: 150)")
+    parser.add_argument('--memory', action='store_true', help="also measure the size of the element tree, and of the same tree in the baseline representation")
+    parser.add_argument('--depths', help="time rendering quotes nested to these depths instead, e.g. 100,1000,10000")
+    parser.add_argument('--paragraph-lines', help="time rendering prose of these numbers of lines instead, e.g. 10000,50000,100000")
+    parser.add_argument('--linearity', type=float, default=3, help="allowed growth in the time per level of nesting, or per line (default: 3)")
+    parser.add_argument('--stdin-memory', metavar='SIZE', help="compare the peak memory of streaming and reading standard input, for a document of this size")
+    parser.add_argument('--print-corpus', metavar='KIND:SIZE', help="print one generated document and exit")
+    options = parser.parse_args(args)
+
+    if options.print_corpus:
+        kind, size = options.print_corpus.split(':')
+        sys.stdout.write(generate_corpus(parse_size(size), kind, options.seed))
+        return 0
+
+    if options.packages:
+        results = benchmark_packages([parse_size(size) for size in options.sizes.split(',')], options.engine, options.repeat, options.seed)
+
+        if options.output:
+            with open(options.output, 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+
+        return 0
+
+    if options.startup:
+        results = benchmark_startup(options.engine or ENGINE, options.repeat)
+
+        if options.output:
+            with open(options.output, 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+
+        return 0
+
+    if options.images:
+        report = benchmark_images(options.images, options.image_dpi, options.engine or ENGINE, options.repeat)
+
+        for label, result in report['results'].items():
+            print(f"{label:<10} {result['seconds']:8.2f}s  {result['pdf_bytes']:>12,} bytes")
+
+        if options.output:
+            with open(options.output, 'w') as output_file:
+                json.dump(report, output_file, indent=2)
+
+        return 0
+
+    if options.stdin_memory:
+        results = stdin_memory(parse_size(options.stdin_memory), 'mixed', options.seed)
+
+        if options.output:
+            with open(options.output, 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+
+        # streaming should never hold more than reading it all in does
+        return 1 if results['stream']['peak_rss_bytes'] > results['read']['peak_rss_bytes'] else 0
+
+    if options.depths:
+        depths = [int(depth) for depth in options.depths.split(',')]
+
+        # parse_markdown leaves the recursion limit alone, so make room for the deepest document here
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), max(depths) * FRAMES_PER_LEVEL + 1000))
+        results = benchmark_nesting(depths, options.repeat, options.seed)
+        nonlinear = find_nonlinear(results, options.linearity)
+
+        for message in nonlinear:
+            print(f"NONLINEAR  {message}")
+
+        return 1 if nonlinear else 0
+
+    if options.paragraph_lines:
+        counts = [parse_size(count) for count in options.paragraph_lines.split(',')]
+        results = benchmark_paragraphs(counts, options.repeat, options.seed)
+        nonlinear = find_nonlinear(results, options.linearity, 'render_per_line', '{} lines', 'line')
+
+        for message in nonlinear:
+            print(f"NONLINEAR  {message}")
+
+        return 1 if nonlinear else 0
+
+    thresholds = dict.fromkeys(STAGES, options.threshold)
+
+    for override in options.stage_threshold:
+        stage, fraction = override.split('=')
+
+        if stage not in thresholds:
+            parser.error(f"unknown stage '{stage}'")
+
+        thresholds[stage] = float(fraction)
+
+    kinds = options.kinds.split(',')
+
+    if unknown := set(kinds) - set(KINDS):
+        parser.error(f"unknown corpus kinds: {', '.join(sorted(unknown))}")
+
+    sizes = [parse_size(size) for size in options.sizes.split(',')]
+    current = run(
+        sizes, kinds, repeat=options.repeat, engine=options.engine, seed=options.seed, memory=options.memory,
+        table_backend=options.table_backend, code_backend=options.code_backend,
+    )
+
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump(current, output_file, indent=2)
+
+    if options.baseline:
+        with open(options.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = find_regressions(current, baseline, thresholds, options.min_seconds)
+
+        for regression in regressions:
+            print(f"REGRESSION  {regression}")
+
+        if regressions:
+            return 1
+
+        print("no regressions")
+
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
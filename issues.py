@@ -1,17 +1,18 @@
 #!/usr/bin/env python
 
 import errno
-import hashlib
 import json
 from optparse import OptionParser
 import os
-from os.path import dirname, exists, isdir, join, realpath, relpath, splitext
+from os.path import dirname, exists, isdir, join, realpath, relpath
 import re
 import requests
 import subprocess
 import sys
 import tempfile
 
+from unquietcode.tools.martek.images import ImageFetcher, find_image_urls, replace_images
+
 # This is a script that downloads all the GitHub issues in a
 # particular repository and generates a PDF for each one; the idea is
 # to produce easily printable versions of all the issues for a
@@ -40,44 +41,6 @@ def mkdir_p(d):
 mkdir_p(images_directory)
 mkdir_p(pdfs_directory)
 
-def replace_image(match, download=True):
-    """Rewrite an re match object that matched an image tag
-
-    Download the image and return a version of the tag rewritten
-    to refer to the local version.  The local version is named
-    after the MD5sum of the URL.
-    
-    >>> m = re.search(r'\!\[(.*?)\]\((.*?)\)',
-    ...               'an image coming up ![caption](http://blah/a/foo.png)')
-    >>> replace_image(m, download=False)
-    '![caption](github-print-issues/images/b62082dd8a02ea495f5e3c293eb6ee67.png)'
-    """
-
-    caption = match.group(1)
-    url = match.group(2)
-    hashed_url = hashlib.md5(url.encode('utf-8')).hexdigest()
-    extension = splitext(url)[1]
-    if not extension:
-        raise Exception("No extension at the end of {0}".format(url))
-    image_filename = join(images_directory, hashed_url) + extension
-    if download:
-        if not exists(image_filename):
-            r = requests.get(url)
-            with open(image_filename, 'w') as f:
-                f.write(r.content)
-    return "![{0}]({1})".format(caption, image_filename)
-
-def replace_images(md):
-    """Rewrite a Markdown string to replace any images with local versions
-
-    'md' should be a GitHub Markdown string; the return value is a version
-    of this where any references to images have been downloaded and replaced
-    by a reference to a local copy.
-    """
-
-    return re.sub(r'\!\[(.*?)\]\((.*?)\)', replace_image, md)
-
-
 def replace_checkboxes(file):
    with open(file, 'r') as file_:
       content = file_.read()
@@ -96,7 +59,50 @@ def replace_checkboxes(file):
    #return md
 
 
-def main(repo):
+def pdf_filename_for(issue):
+    return join(pdfs_directory, '{}.pdf'.format(issue['number']))
+
+
+def is_pull_request(issue):
+    return bool(issue.get('pull_request') and issue['pull_request'].get('html_url'))
+
+
+def fetch_comments(issues_json):
+    comments = {}
+
+    for issue in issues_json:
+        if issue['comments'] > 0:
+            comments_request = requests.get(issue['comments_url'],
+                                            headers=standard_headers)
+            comments[issue['number']] = comments_request.json()
+
+    return comments
+
+
+def prefetch_images(fetcher, issues_json, comments):
+    """Download every image in a page of issues and their comments at once
+
+    Returns the local paths of the images, keyed by URL.
+    """
+
+    urls = []
+
+    for issue in issues_json:
+        urls.extend(find_image_urls(issue['body'] or ''))
+
+        for comment in comments.get(issue['number'], []):
+            urls.extend(find_image_urls(comment['body'] or ''))
+
+    images, errors = fetcher.prefetch(urls)
+
+    for url, error in errors.items():
+        print("could not download {0}: {1}".format(url, error), file=sys.stderr)
+
+    return images
+
+
+def main(repo, revalidate=False):
+    fetcher = ImageFetcher(images_directory, revalidate=revalidate)
 
     page = 1
     while True:
@@ -111,40 +117,37 @@ def main(repo):
                 r.status_code,
                 issues_url))
 
-        issues_json = r.json()
+        # skip pull requests and issues which have already been printed
+        issues_json = [issue for issue in r.json()
+                       if not exists(pdf_filename_for(issue)) and not is_pull_request(issue)]
+
+        comments = fetch_comments(issues_json)
+        images = prefetch_images(fetcher, issues_json, comments)
+
         for issue in issues_json:
             number = issue['number']
-            pdf_filename = join(pdfs_directory,
-                                        '{}.pdf'.format(number))
-            if exists(pdf_filename):
-                continue
-        
+            pdf_filename = pdf_filename_for(issue)
             title = issue['title']
             body = issue['body']
 
             ntf = tempfile.NamedTemporaryFile(suffix='.md', delete=False)
             md_filename = ntf.name
 
-            if issue.get('pull_request') and issue['pull_request'].get('html_url'):
-                continue
-
             with open(md_filename, 'w') as f:
                 f.write("# {0} {1}\n\n".format(number, title))
                 f.write("### Reported by {0}\n\n".format(issue['user']['login']))
                 # Increase the indent level of any Markdown heading
                 body = re.sub(r'^(#+)', r'#\1', body)
-                body = replace_images(body)
+                body = replace_images(body, images)
                 #body = replace_checkboxes(body)
                 f.write(body)
                 f.write("\n\n")
                 if issue['comments'] > 0:
-                    comments_request = requests.get(issue['comments_url'],
-                                                    headers=standard_headers)
-                    for comment in comments_request.json():
+                    for comment in comments[number]:
                         f.write("### Comment from {0}\n\n".format(comment['user']['login']))
                         comment_body = comment['body']
                         comment_body = re.sub(r'^(#+)', r'###\1', comment_body)
-                        comment_body = replace_images(comment_body)
+                        comment_body = replace_images(comment_body, images)
                         f.write(comment_body)
                         f.write("\n\n")
 
@@ -174,10 +177,13 @@ parser = OptionParser(usage=usage)
 parser.add_option("-t", "--test",
                   action="store_true", dest="test", default=False,
                   help="Run doctests")
+parser.add_option("-r", "--revalidate",
+                  action="store_true", dest="revalidate", default=False,
+                  help="Check downloaded images for changes")
 
 (options, args) = parser.parse_args()
 
 if len(args) != 1:
     parser.print_help()
 else:
-    main(args[0])
+    main(args[0], revalidate=options.revalidate)
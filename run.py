@@ -1,34 +1,158 @@
 import os
 import sys
+import json
+import time
 import subprocess
 import select
-from tempfile import TemporaryDirectory
+import itertools
 
-import mistletoe
+from unquietcode.tools.martek.batch import main as batch
+from unquietcode.tools.martek.compiler import render_pdf
+from unquietcode.tools.martek.latex_renderer import CODE_BACKENDS, TABLE_BACKENDS
+from unquietcode.tools.martek.profiling import RenderProfile
+from unquietcode.tools.martek.sections import render_sectioned_pdf
+from unquietcode.tools.martek.server import main as serve
 
-from unquietcode.tools.martek import LatexRenderer
+# output path which sends the PDF to standard out
+STDOUT = '-'
 
+# printed with the usage, since sections change the layout of the document
+SECTIONS_HELP = (
+    "  --sections[=build-dir]  compile each top-level section into a build directory, recompiling only those\n"
+    "                          which change; each section is pulled in with \\include, which forces a page\n"
+    "                          break at every level-1 heading"
+)
 
-def main():
 
-    # read from standard in (note that select() only works for unix systems)
-    stdin = ""
+def pop_flag(args, flag):
+    if flag in args:
+        args.remove(flag)
+        return True
+    
+    return False
+
 
-    while sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
-        data = sys.stdin.read()
+def pop_option(args, option):
+    """
+    Removes a flag which may also be given a value, as in `--option=value`.
+    Returns the value, True for the bare flag, or None if it is missing.
+    """
+    for arg in args:
+        if arg == option:
+            args.remove(arg)
+            return True
         
-        if data:
-            stdin += data
+        if arg.startswith(option + '='):
+            args.remove(arg)
+            return arg[len(option) + 1:]
+    
+    return None
+
+
+def stdin_lines():
+    """
+    Returns an iterator over the lines of standard input, or None if there
+    is nothing but whitespace. The input is read in chunks as the parser
+    consumes it, rather than being collected into one string up front.
+    
+    This does not bound the memory of the parse: mistletoe's Document
+    takes every line into a list before it parses any of them (and
+    parse_markdown does the same, to measure the nesting), then builds
+    the whole syntax tree. What is saved is the copy of the input as one
+    string, alongside its lines. Only rendering streams its output.
+    """
+    for line in sys.stdin:
+        if line.strip():
+            return itertools.chain([line], sys.stdin)
+    
+    return None
+
+
+def file_lines(file_path):
+    with open(file_path, 'r') as file:
+        yield from file
+
+
+def write_profile(profile, profile_path):
+    """
+    Writes the rendering profile as JSON, to standard error when no file
+    was given with `--profile=<report.json>`.
+    """
+    report = json.dumps(profile.report(), indent=2)
+    
+    if profile_path is True:
+        print(report, file=sys.stderr)
+    else:
+        with open(profile_path, 'w') as report_file:
+            report_file.write(report)
+
+
+def render_sections(markdown_data, pdf_file, build_dir, log, **options):
+    """
+    Renders the PDF from a build directory of sections, reporting how long
+    each section took to compile, or that it was unchanged.
+    """
+    for section in render_sectioned_pdf(markdown_data, pdf_file, build_dir, **options):
+        if section.seconds is None:
+            timing = "unchanged"
         else:
-            break
+            timing = f"{section.seconds:.2f}s"
+        
+        print(f"{section.name}  {timing:>9}  {section.pages:>4} pages  {section.title}", file=log)
+
+
+def main():
+    args = sys.argv[1:]
+    
+    # render many documents at once
+    if args and args[0] == 'batch':
+        exit(batch(args[1:]))
+    
+    # render documents sent over HTTP
+    if args and args[0] == 'serve':
+        exit(serve(args[1:]))
+    
+    use_cache = not pop_flag(args, '--no-cache')
+    
+    # load the fixed part of the preamble from a format built with mylatexformat
+    precompile = pop_flag(args, '--precompile')
+    profile_path = pop_option(args, '--profile')
+    profile = RenderProfile() if profile_path else None
+    image_dpi = pop_option(args, '--image-dpi')
+    
+    if image_dpi is True or (image_dpi is not None and not image_dpi.isdigit()):
+        print("usage: --image-dpi=<dots per inch>")
+        exit(4)
+    
+    table_backend = pop_option(args, '--table-backend') or 'tabular'
+    
+    if table_backend not in TABLE_BACKENDS:
+        print(f"usage: --table-backend=({' | '.join(TABLE_BACKENDS)})")
+        exit(4)
+    
+    code_backend = pop_option(args, '--code-backend') or 'listings'
+    
+    if code_backend not in CODE_BACKENDS:
+        print(f"usage: --code-backend=({' | '.join(CODE_BACKENDS)})")
+        exit(4)
+    
+    # keep one .tex file per top-level section in a build directory, recompiling only those which change
+    sections_dir = pop_option(args, '--sections')
+
+    # read from standard in (note that select() only works for unix systems)
+    stdin = None
+
+    if sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
+        stdin = stdin_lines()
     
     # reading from stdin
-    if stdin := stdin.strip():
-        if len(sys.argv) > 2:
-            print("usage: cat markdown.md | martek <output.pdf>")
+    if stdin is not None:
+        if len(args) > 1:
+            print("usage: cat markdown.md | martek [--no-cache] [--precompile] [--profile[=report.json]] [--image-dpi=N] [--table-backend=longtable] [--code-backend=verbatim] [--sections[=build-dir]] <output.pdf | ->")
+            print(SECTIONS_HELP)
             exit(1)
-        elif len(sys.argv) == 2:
-            pdf_file_path = sys.argv[1]
+        elif len(args) == 1:
+            pdf_file_path = args[0]
         else:
             pdf_file_path = os.path.join(os.getcwd(), 'output.pdf')
         
@@ -36,12 +160,13 @@ def main():
     
     # reading file paths passed as arguments
     else:
-        if len(sys.argv) > 3 or len(sys.argv) < 2:
-            print("usage: martek <input.md> (output.pdf)")
+        if len(args) > 2 or len(args) < 1:
+            print("usage: martek [--no-cache] [--precompile] [--profile[=report.json]] [--image-dpi=N] [--table-backend=longtable] [--code-backend=verbatim] [--sections[=build-dir]] <input.md> (output.pdf | -)")
+            print(SECTIONS_HELP)
             exit(2)
-        elif len(sys.argv) == 3:
-            file_path_1 = sys.argv[1]
-            file_path_2 = sys.argv[2]
+        elif len(args) == 2:
+            file_path_1 = args[0]
+            file_path_2 = args[1]
             
             if file_path_1.lower().endswith(".md"):
                 md_file = file_path_1
@@ -50,13 +175,14 @@ def main():
                 md_file = file_path_2
                 pdf_file_path = file_path_1
             else:
-                print("usage: martek <input.md> (output.pdf)")
+                print("usage: martek [--no-cache] [--precompile] [--profile[=report.json]] [--image-dpi=N] [--table-backend=longtable] [--code-backend=verbatim] [--sections[=build-dir]] <input.md> (output.pdf | -)")
+                print(SECTIONS_HELP)
                 exit(3)
             
-            if not pdf_file_path.lower().endswith(".pdf"):
+            if pdf_file_path != STDOUT and not pdf_file_path.lower().endswith(".pdf"):
                 pdf_file_path += ".pdf"
         else:
-            md_file = sys.argv[1]
+            md_file = args[0]
             path_parts = os.path.split(md_file)
             file_name = path_parts[-1]
             base_dir = md_file[0:-1*(len(file_name))]
@@ -66,42 +192,53 @@ def main():
         if md_file.endswith(".pdf"):
             raise Exception("markdown file is missing, did you mean to send it over stdin?")
         
-        with open(md_file, 'r') as markdown_file:
-            markdown_data = markdown_file.read()
+        markdown_data = file_lines(md_file)
+    
+    if sections_dir is True:
+        if pdf_file_path == STDOUT:
+            print("usage: --sections=<build-dir> is needed when writing to standard out")
+            print(SECTIONS_HELP)
+            exit(4)
         
-    # render the markdown file to LaTeX
-    rendered = mistletoe.markdown(markdown_data, LatexRenderer)
+        sections_dir = os.path.splitext(pdf_file_path)[0] + '.build'
+    
+    # when the PDF itself is written to standard out, everything else goes to standard error
+    if pdf_file_path == STDOUT:
+        pdf_file = sys.stdout.buffer
+        log = sys.stderr
+    else:
+        pdf_file = pdf_file_path
+        log = sys.stdout
+    
+    # render the markdown to a PDF
+    try:
+        start = time.perf_counter()
         
-    with TemporaryDirectory() as tmp:
-
-        # write out the Tex file
-        tex_file_path = f"{tmp}/data.tex"
-        tmp_pdf_path = f"{tmp}/data.pdf"
-
-        with open(tex_file_path, 'w') as tex_file:
-            tex_file.write(rendered)
-            
-        # process the Tex file into a PDF
-        try:
-            result = subprocess.check_output(['xelatex', 'data.tex'], cwd=tmp)
-            print(result)
-        except subprocess.CalledProcessError as ex:
-            if ex.stdout:
-                print(ex.stdout.decode("utf-8"))
-            
-            if ex.stderr:
-                print(ex.stderr.decode("utf-8"))
-            
-            raise
+        if sections_dir:
+            render_sections(markdown_data, pdf_file, sections_dir, log, precompile=precompile, profile=profile, image_dpi=image_dpi and int(image_dpi), table_backend=table_backend, code_backend=code_backend)
+            return
         
-        # write the PDF content to the correct location
-        umask_original = os.umask(0o000)
-
-        with open(tmp_pdf_path, 'rb') as tmp_pdf_file:
-            with os.fdopen(os.open(pdf_file_path, os.O_WRONLY | os.O_CREAT, 0o666), 'wb') as pdf_file:
-                pdf_file.write(tmp_pdf_file.read())
-
-        os.umask(umask_original)
+        result = render_pdf(markdown_data, pdf_file, cache=use_cache, precompile=precompile, profile=profile, image_dpi=image_dpi and int(image_dpi), table_backend=table_backend, code_backend=code_backend)
+        
+        if result is None:
+            print("PDF is unchanged, using the cached copy", file=log)
+        else:
+            print(result, file=log)
+        
+        if image_dpi and pdf_file_path != STDOUT:
+            print(f"images scaled to {image_dpi} dpi: rendered in {time.perf_counter() - start:.2f}s, PDF is {os.path.getsize(pdf_file_path)} bytes", file=log)
+    except subprocess.CalledProcessError as ex:
+        if ex.stdout:
+            print(ex.stdout.decode("utf-8"), file=log)
+        
+        if ex.stderr:
+            print(ex.stderr.decode("utf-8"), file=log)
+        
+        raise
+    
+    finally:
+        if profile is not None:
+            write_profile(profile, profile_path)
 
 
 if __name__ == '__main__':
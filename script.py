@@ -1,28 +1,29 @@
-import hashlib
 import json
+import multiprocessing
 import os
+import queue
 import re
 import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from optparse import OptionParser
-from os.path import dirname, exists, join, realpath, relpath, splitext
+from os.path import dirname, join, realpath, relpath
 
-import mistletoe
 import requests
-from mistletoe.ast_renderer import ASTRenderer
-from unquietcode.tools.martek import LatexRenderer
+from requests.adapters import HTTPAdapter
+from unquietcode.tools.martek.compiler import render_combined_pdf, render_pdf
+from unquietcode.tools.martek.github import API_URL, IssueStore, IssueSync
+from unquietcode.tools.martek.images import ImageFetcher, find_image_urls, replace_images
 
 # This is a script that downloads all the GitHub issues in a
 # particular repository and generates a PDF for each one; the idea is
 # to produce easily printable versions of all the issues for a
 # repository.
 
-with open(join(os.environ['HOME'], '.github-oauth-token.json')) as f:
-    token = json.load(f)['token']
-
-standard_headers = {'User-Agent': 'github-issues-printer/1.0',
-                    'Authorization': 'bearer {0}'.format(token)}
-
 cwd = os.getcwd()
 repo_directory = realpath(join(dirname(__file__)))
 tex_directory = relpath(join(repo_directory, 'tex'), cwd)
@@ -35,44 +36,17 @@ def mkdir(d):
     except FileExistsError:
         pass
 
-mkdir(tex_directory)
-mkdir(images_directory)
-mkdir(pdfs_directory)
-
-def replace_image(match, download=True):
-    """Rewrite an re match object that matched an image tag
-    Download the image and return a version of the tag rewritten
-    to refer to the local version.  The local version is named
-    after the MD5sum of the URL.
-    
-    >>> m = re.search(r'\!\[(.*?)\]\((.*?)\)',
-    ...               'an image coming up ![caption](http://blah/a/foo.png)')
-    >>> replace_image(m, download=False)
-    '![caption](github-print-issues/images/b62082dd8a02ea495f5e3c293eb6ee67.png)'
+def standard_headers():
+    """Read the OAuth token, and make the headers sent with every API request
+    This is done from main rather than on import, since the compile workers
+    are spawned, and import this module again.
     """
 
-    caption = match.group(1)
-    url = match.group(2)
-    hashed_url = hashlib.md5(url.encode('utf-8')).hexdigest()
-    extension = splitext(url)[1]
-    if not extension:
-        raise Exception("No extension at the end of {0}".format(url))
-    image_filename = join(images_directory, hashed_url) + extension
-    if download:
-        if not exists(image_filename):
-            r = requests.get(url)
-            with open(image_filename, 'wb') as f:
-                f.write(r.content)
-    return "![{0}]({1})".format(caption, image_filename)
-
-def replace_images(md):
-    """Rewrite a Markdown string to replace any images with local versions
-    'md' should be a GitHub Markdown string; the return value is a version
-    of this where any references to images have been downloaded and replaced
-    by a reference to a local copy.
-    """
+    with open(join(os.environ['HOME'], '.github-oauth-token.json')) as f:
+        token = json.load(f)['token']
 
-    return re.sub(r'\!\[(.*?)\]\((.*?)\)', replace_image, md)
+    return {'User-Agent': 'github-issues-printer/1.0',
+            'Authorization': 'bearer {0}'.format(token)}
 
 def make_markdown_quote(to_quote):
     return '>' + to_quote #latex handles the newlines for us so it's ok to just put everything in one block quote line
@@ -82,97 +56,244 @@ def make_markdown_quote(to_quote):
 def encode(to_encode):
     return to_encode.encode('utf-8')
 
-def main(repo):
-
-    page = 1
-    while True:
-        issues_url = 'https://api.github.com/repos/{0}/issues'.format(repo)
-        r = requests.get(issues_url,
-                         params={'per_page': '100',
-                                 'page': str(page),
-                                 'state': 'open'},
-                         headers=standard_headers)
-        if r.status_code != 200:
-            raise Exception("HTTP status {0} on fetching {1}".format(
-                r.status_code,
-                issues_url))
-
-        issues_json = r.json()
-        for issue in issues_json:
-            number = issue['number']
-            title = issue['title']
-            body = issue['body']
-
-            # if number != 14:
-            #     continue
-
-            # TODO use temp file instead of writing .tex file
-            # ntf = tempfile.NamedTemporaryFile(suffix='.tex', delete=True)
-            # md_filename = ntf.name
-
-            md_content = ""
-            md_content += "# #{0} – {1}\n".format(number, title)
-            md_content += "**Reported by @{0}**\n".format(issue['user']['login'])
-            
-            if issue['milestone']:
-                md_content += '**Milestone: {0}**\n'.format(issue['milestone']['title'])
-           
-            md_content += "\n"
-            
-            # Increase the indent level of any Markdown heading
-            body = re.sub(r'^(#+)', r'#\1', body)
-            body = replace_images(body)
-            
-            md_content += body
-            md_content += "\n\n"
-            if issue['comments'] > 0:
-                comments_request = requests.get(issue['comments_url'],
-                                                headers=standard_headers)
-                for comment in comments_request.json():
-                    #print(json.dumps(comment, indent=2)) 
-                    USER = comment['user']['login']
-                    RAW_DATETIME = comment['created_at']
-                    DATETIME_OBJ = datetime.strptime(RAW_DATETIME, '%Y-%m-%dT%H:%M:%SZ')
-                    DATE = DATETIME_OBJ.date() #2021-01-09T20:41:02Z
-                    DATE_WORDS = DATE.strftime('%A %d %B %Y')
-                    md_content += ("\n### @{0} wrote on {1}".format(USER, DATE_WORDS))
-                    md_content += '\n\n'
-                    comment_body = comment['body']
-                    comment_body = re.sub(r'^(#+)', r'###\1', comment_body)
-                    comment_body = replace_images(comment_body)
-                    md_content += comment_body
-                    md_content += "\n\n"
-
-            # render to .tex file
-            md_file_path = "./pdfs/issue_{}.md".format(number)
-            file = open(md_file_path, "w")
-            file.write(md_content)
-            file.close()
-
-            tex_file_path = "./tex/issue_{}.tex".format(number)
-
-            with open(md_file_path, 'r') as fin:
-                data = fin.read()
-                rendered = mistletoe.markdown(data, LatexRenderer)
-                ast = mistletoe.markdown(data, ASTRenderer)
-
-                f = open(tex_file_path, "w")
-                f.write(rendered)
-                f.close()
-
-            subprocess.check_call(['xelatex', '-output-directory=./pdfs', tex_file_path])
-
-        page += 1
-        if 'Link' not in r.headers:
-            break
+def prefetch_images(fetcher, issues):
+    """Download every image in a page of issues and their comments at once
+    Returns the local paths of the images, keyed by URL.
+    """
+
+    urls = []
+
+    for issue, comments, _ in issues:
+        urls.extend(find_image_urls(issue['body'] or ''))
+
+        for comment in comments:
+            urls.extend(find_image_urls(comment['body'] or ''))
+
+    images, errors = fetcher.prefetch(urls)
+
+    for url, error in errors.items():
+        print("could not download {0}: {1}".format(url, error), file=sys.stderr)
+
+    return images
+
+def issue_markdown(issue, comments, images):
+    number = issue['number']
+    title = issue['title']
+    body = issue['body'] or ''
+
+    md_content = ""
+    md_content += "# #{0} – {1}\n".format(number, title)
+    md_content += "**Reported by @{0}**\n".format(issue['user']['login'])
+    
+    if issue['milestone']:
+        md_content += '**Milestone: {0}**\n'.format(issue['milestone']['title'])
+   
+    md_content += "\n"
+    
+    # Increase the indent level of any Markdown heading
+    body = re.sub(r'^(#+)', r'#\1', body)
+    body = replace_images(body, images)
+    
+    md_content += body
+    md_content += "\n\n"
+    for comment in comments:
+        USER = comment['user']['login']
+        RAW_DATETIME = comment['created_at']
+        DATETIME_OBJ = datetime.strptime(RAW_DATETIME, '%Y-%m-%dT%H:%M:%SZ')
+        DATE = DATETIME_OBJ.date() #2021-01-09T20:41:02Z
+        DATE_WORDS = DATE.strftime('%A %d %B %Y')
+        md_content += ("\n### @{0} wrote on {1}".format(USER, DATE_WORDS))
+        md_content += '\n\n'
+        comment_body = comment['body'] or ''
+        comment_body = re.sub(r'^(#+)', r'###\1', comment_body)
+        comment_body = replace_images(comment_body, images)
+        md_content += comment_body
+        md_content += "\n\n"
+
+    return md_content
+
+def fetch_stage(sync, fetcher, fetched):
+    """Fetch issues, comments and images, handing each issue to the next stage
+    Runs in a thread of its own, so that the network is in use while earlier
+    issues are being compiled. The queue is bounded, so fetching pauses when
+    compiling falls behind.
+    """
+
+    try:
+        for issues in sync.pages():
+            images = prefetch_images(fetcher, issues)
+
+            for issue, comments, content_hash in issues:
+                fetched.put((issue, comments, content_hash, images))
+    except BaseException as ex:
+        fetched.put(ex)
+    else:
+        fetched.put(None)
+
+def fetched_issues(fetched):
+    while (item := fetched.get()) is not None:
+        if isinstance(item, BaseException):
+            raise item
+
+        yield item
+
+def export_separately(sync, issues, jobs):
+    """Compile each issue into a PDF of its own, several at a time
+    Returns the number of issues exported and the number which failed.
+    """
+
+    exported = 0
+    failed = 0
+    compiling = {}
+
+    def finish_compiles(return_when):
+        nonlocal exported, failed
+        done, _ = wait(compiling, return_when=return_when)
+
+        for future in done:
+            issue, comments, content_hash = compiling.pop(future)
+
+            try:
+                future.result()
+            except subprocess.CalledProcessError as ex:
+                failed += 1
+                print("FAILED  #{0}: {1} exited with status {2}".format(issue['number'], ex.cmd[0], ex.returncode), file=sys.stderr)
+                continue
+            except Exception as ex:
+                failed += 1
+                print("FAILED  #{0}: {1}: {2}".format(issue['number'], type(ex).__name__, ex), file=sys.stderr)
+                continue
+
+            sync.rendered(issue, comments, content_hash)
+            exported += 1
+            print("ok      #{0} {1}".format(issue['number'], issue['title']))
+
+    # each issue is parsed and compiled once, in a worker process, straight from memory
+    # (the workers are spawned rather than forked, since the fetch thread is running)
+    def start_compilers():
+        return ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'))
+
+    compilers = start_compilers()
+
+    try:
+        for issue, comments, content_hash, images in issues:
+            markdown = issue_markdown(issue, comments, images)
+            pdf_file_path = join(pdfs_directory, "issue_{}.pdf".format(issue['number']))
+
+            # bound the number of documents waiting for a compiler
+            if len(compiling) >= jobs * 2:
+                finish_compiles(FIRST_COMPLETED)
+
+            try:
+                future = compilers.submit(render_pdf, markdown, pdf_file_path, image_dir=cwd)
+            except BrokenProcessPool:
+                # a worker died, failing every job on the pool, so carry on with a new one
+                finish_compiles(ALL_COMPLETED)
+                compilers.shutdown(wait=False)
+                compilers = start_compilers()
+                future = compilers.submit(render_pdf, markdown, pdf_file_path, image_dir=cwd)
+
+            compiling[future] = (issue, comments, content_hash)
+
+        if compiling:
+            finish_compiles(ALL_COMPLETED)
+    finally:
+        compilers.shutdown()
+
+    return exported, failed
+
+def export_combined(sync, issues, pdf_file_path, toc=False):
+    """Compile every issue into a single PDF, one issue per page
+    The preamble and fonts are loaded once for the lot, instead of once per issue.
+    Returns the number of issues exported and the number which failed.
+    """
+
+    exported = []
+    documents = []
+
+    for issue, comments, content_hash, images in issues:
+        title = "#{0} {1}".format(issue['number'], issue['title'])
+        documents.append((title, issue_markdown(issue, comments, images)))
+        exported.append((issue, comments, content_hash))
+
+    if not documents:
+        return 0, 0
+
+    try:
+        render_combined_pdf(documents, pdf_file_path, image_dir=cwd, toc=toc)
+    except subprocess.CalledProcessError as ex:
+        print("FAILED  {0}: {1} exited with status {2}".format(pdf_file_path, ex.cmd[0], ex.returncode), file=sys.stderr)
+        return 0, len(documents)
+    except Exception as ex:
+        print("FAILED  {0}: {1}: {2}".format(pdf_file_path, type(ex).__name__, ex), file=sys.stderr)
+        return 0, len(documents)
+
+    for issue, comments, content_hash in exported:
+        sync.rendered(issue, comments, content_hash)
+
+    print("ok      {0} ({1} issues)".format(pdf_file_path, len(documents)))
+    return len(documents), 0
+
+def main(repo, revalidate=False, state=None, api_url=API_URL, workers=8, jobs=None, combined=None, toc=False):
+    start = time.perf_counter()
+    headers = standard_headers()
+
+    mkdir(tex_directory)
+    mkdir(images_directory)
+    mkdir(pdfs_directory)
+
+    fetcher = ImageFetcher(images_directory, workers=workers, revalidate=revalidate)
+
+    session = requests.Session()
+    session.headers.update(headers)
+    session.mount('https://', HTTPAdapter(pool_maxsize=workers))
+    session.mount('http://', HTTPAdapter(pool_maxsize=workers))
+
+    # with a state file, only issues which changed since the last run are exported
+    store = IssueStore(state) if state else None
+    sync = IssueSync(repo, store=store, session=session, api_url=api_url, workers=workers)
+
+    jobs = jobs or os.cpu_count()
+    fetched = queue.Queue(maxsize=jobs * 2)
+    fetch_thread = threading.Thread(target=fetch_stage, args=(sync, fetcher, fetched), daemon=True)
+    fetch_thread.start()
+
+    if combined:
+        exported, failed = export_combined(sync, fetched_issues(fetched), combined, toc)
+    else:
+        exported, failed = export_separately(sync, fetched_issues(fetched), jobs)
+
+    # a failed issue must be listed again by the next sync
+    if not failed:
+        sync.finish()
+
+    minutes = (time.perf_counter() - start) / 60
+
+    print("exported {0} issues in {1:.1f}s ({2:.1f} issues/min), {3} failed, {4} unchanged, {5} requests, {6} not modified".format(
+        exported, minutes * 60, exported / minutes if minutes else 0, failed, sync.skipped, sync.requests, sync.not_modified))
+
+    return 1 if failed else 0
 
 usage = """Usage: %prog [options] REPOSITORY
 Repository should be username/repository from GitHub, e.g. mysociety/pombola"""
-parser = OptionParser(usage=usage)
-parser.add_option("-t", "--test", action="store_true", dest="test", default=False, help="Run doctests")
-(options, args) = parser.parse_args()
-
-if len(args) != 1:
-    parser.print_help()
-else:
-    main(args[0])
+
+if __name__ == '__main__':
+    parser = OptionParser(usage=usage)
+    parser.add_option("-t", "--test", action="store_true", dest="test", default=False, help="Run doctests")
+    parser.add_option("-r", "--revalidate", action="store_true", dest="revalidate", default=False, help="Check downloaded images for changes")
+    parser.add_option("-s", "--state", dest="state", default=None, help="SQLite file for incremental syncs; only new or changed issues are exported")
+    parser.add_option("--api-url", dest="api_url", default=API_URL, help="Base URL of the GitHub API")
+    parser.add_option("-w", "--workers", type="int", dest="workers", default=8, help="Concurrent downloads (default: 8)")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=None, help="Concurrent compiles (default: one per core)")
+    parser.add_option("-c", "--combined", dest="combined", default=None, metavar="PDF", help="Export every issue into this one PDF, with a single compile")
+    parser.add_option("--toc", action="store_true", dest="toc", default=False, help="Start the combined PDF with a table of contents")
+    (options, args) = parser.parse_args()
+
+    if options.combined and options.state:
+        parser.error("--combined exports every issue into one PDF, so it can't be used with --state")
+
+    if len(args) != 1:
+        parser.print_help()
+    else:
+        exit(main(args[0], revalidate=options.revalidate, state=options.state, api_url=options.api_url,
+                  workers=options.workers, jobs=options.jobs, combined=options.combined, toc=options.toc))
@@ -0,0 +1,108 @@
+"""
+Checks that each kind of generated benchmark corpus parses into the blocks
+it is meant to measure, that the baseline copy of an element tree holds the
+same text, and that rendering prose takes time in proportion to its length.
+
+    python -m pytest test_benchmark.py
+    python test_benchmark.py
+"""
+from unquietcode.tools.martek import LatexRenderer, parse_markdown
+from unquietcode.tools.martek.elements import Container
+
+from benchmark import baseline_tree, benchmark_packages, benchmark_paragraphs, element_memory, find_nonlinear, generate_corpus, parse_size, prose_lines
+
+
+SIZES = ('1K', '100K')
+
+
+def block_types(kind, size):
+    with LatexRenderer():
+        document = parse_markdown(generate_corpus(parse_size(size), kind))
+
+    return {type(block).__name__ for block in document.children}
+
+
+def test_lists_are_lists():
+    for size in SIZES:
+        assert block_types('lists', size) == {'List'}, size
+
+
+def test_tables_are_tables():
+    for size in SIZES:
+        assert block_types('tables', size) == {'Table'}, size
+
+
+def test_code_is_fenced():
+    for size in SIZES:
+        assert block_types('code', size) == {'CodeFence'}, size
+
+
+def test_inline_is_paragraphs():
+    for size in SIZES:
+        assert block_types('inline', size) <= {'Paragraph', 'Heading'}, size
+
+
+def test_mixed_has_no_indented_code():
+    for size in SIZES:
+        assert block_types('mixed', size) <= {'List', 'Table', 'CodeFence', 'Paragraph', 'Heading'}, size
+
+
+def test_prose_is_paragraphs():
+    with LatexRenderer():
+        document = parse_markdown(prose_lines(1000))
+
+    assert {type(block).__name__ for block in document.children} == {'Paragraph'}
+
+
+def test_plain_prose_needs_no_packages():
+    for size in SIZES:
+        assert block_types('prose', size) <= {'Paragraph', 'Heading'}, size
+
+    results = benchmark_packages([parse_size('10K')], verbose=False)['prose-10K']
+    assert results['used packages']['packages'] < results['every package']['packages']
+    assert results['used packages']['latex_bytes'] < results['every package']['latex_bytes']
+    assert results['used packages']['runs'] == results['every package']['runs'] == 1
+
+
+def test_baseline_tree_is_larger():
+    text = generate_corpus(parse_size('10K'), 'mixed')
+    renderer = LatexRenderer()
+    renderer.render(parse_markdown(text))
+    root = renderer.stack[0]
+
+    # the copy renders the same, string for string
+    copy = baseline_tree(root)
+    stack = [(root, copy)]
+
+    while stack:
+        element, element_copy = stack.pop()
+
+        if type(element) is str:
+            assert element_copy.value == element
+        elif isinstance(element, Container):
+            assert len(element.elements) == len(element_copy.elements)
+            stack.extend(zip(element.elements, element_copy.elements))
+        else:
+            assert element_copy.value == element.value
+
+    memory = element_memory(text)
+    assert memory['baseline']['objects'] > memory['objects']
+    assert memory['baseline']['bytes'] > memory['bytes']
+
+
+def test_paragraphs_render_in_linear_time():
+    results = benchmark_paragraphs([5000, 50000], repeat=1, verbose=False)
+    assert find_nonlinear(results, 3, 'render_per_line', '{} lines', 'line') == []
+
+
+if __name__ == '__main__':
+    test_lists_are_lists()
+    test_tables_are_tables()
+    test_code_is_fenced()
+    test_inline_is_paragraphs()
+    test_mixed_has_no_indented_code()
+    test_prose_is_paragraphs()
+    test_plain_prose_needs_no_packages()
+    test_baseline_tree_is_larger()
+    test_paragraphs_render_in_linear_time()
+    print("benchmark corpus: ok")
@@ -0,0 +1,83 @@
+"""
+Checks that re-rendering a long document with one block edited reuses
+every other block from the render cache, in memory and on disk.
+
+    python -m pytest test_cache.py
+    python test_cache.py
+"""
+import os
+import time
+from tempfile import TemporaryDirectory
+
+from unquietcode.tools.martek import DiskRenderCache, LatexRenderer, RenderCache, parse_markdown
+
+
+BLOCKS = 5000
+
+
+def document(edited=None):
+    paragraphs = [f"Paragraph {idx} with some *text* and 50% of a `value`." for idx in range(BLOCKS)]
+
+    if edited is not None:
+        paragraphs[edited] += " Edited."
+
+    return '\n\n'.join(paragraphs) + '\n'
+
+
+def render(markdown, cache):
+    with LatexRenderer(cache=cache) as renderer:
+        return renderer.render(parse_markdown(markdown))
+
+
+def assert_edit_reuses_blocks(cache):
+    render(document(), cache)
+    assert (cache.hits, cache.misses) == (0, BLOCKS)
+
+    edited = render(document(edited=BLOCKS // 2), cache)
+    assert (cache.hits, cache.misses) == (BLOCKS - 1, BLOCKS + 1)
+    assert edited == render(document(edited=BLOCKS // 2), None)
+
+
+def test_memory_cache_reuses_unedited_blocks():
+    assert_edit_reuses_blocks(RenderCache())
+
+
+def test_disk_cache_reuses_unedited_blocks():
+    with TemporaryDirectory() as directory:
+        assert_edit_reuses_blocks(DiskRenderCache(directory))
+
+        # a second run starts from the files left by the first
+        cache = DiskRenderCache(directory)
+        render(document(), cache)
+        assert (cache.hits, cache.misses) == (BLOCKS, 0)
+
+
+def test_disk_cache_evicts_least_recently_used():
+    with TemporaryDirectory() as directory:
+        cache = DiskRenderCache(directory, max_size=3)
+
+        for key in 'abc':
+            cache.put(key, [key])
+
+        assert cache.get('a') == ['a']
+        cache.put('d', ['d'])
+
+        assert sorted(os.listdir(directory)) == ['a.json', 'c.json', 'd.json']
+        assert len(cache) == 3
+
+        # recency is seeded from the files when the cache is opened again
+        now = time.time()
+
+        for age, key in enumerate('dca'):
+            os.utime(cache.path(key), (now - age, now - age))
+
+        cache = DiskRenderCache(directory, max_size=3)
+        cache.put('e', ['e'])
+        assert sorted(os.listdir(directory)) == ['c.json', 'd.json', 'e.json']
+
+
+if __name__ == '__main__':
+    test_memory_cache_reuses_unedited_blocks()
+    test_disk_cache_reuses_unedited_blocks()
+    test_disk_cache_evicts_least_recently_used()
+    print("cache: ok")
@@ -0,0 +1,83 @@
+"""
+Checks that ordinary code blocks are typeset as a single environment, that
+only very long ones are split, and that the cap on indentation in deeply
+nested documents leaves their code as it is.
+
+    python -m pytest test_code.py
+    python test_code.py
+"""
+from unquietcode.tools.martek import elements, render_markdown
+from unquietcode.tools.martek.latex_renderer import CODE_BACKENDS, CODE_CHUNK_LINES, LatexRenderer
+from unquietcode.tools.martek.helpers import parse_markdown
+
+
+ENVIRONMENTS = {'listings': '\\begin{lstlisting}', 'verbatim': '\\begin{Verbatim}'}
+
+
+def fence(lines):
+    return "```\n" + ''.join(f"line {idx}\n" for idx in range(lines)) + "```\n"
+
+
+def environments(markdown, code_backend):
+    with LatexRenderer(code_backend=code_backend) as renderer:
+        latex = renderer.render(parse_markdown(markdown))
+
+    return latex.count(ENVIRONMENTS[code_backend])
+
+
+def test_ordinary_code_is_not_split():
+    for code_backend in CODE_BACKENDS:
+        for lines in (1, 60, 500, CODE_CHUNK_LINES):
+            assert environments(fence(lines), code_backend) == 1, (code_backend, lines)
+
+
+def test_very_long_code_is_split():
+    for code_backend in CODE_BACKENDS:
+        assert environments(fence(CODE_CHUNK_LINES + 1), code_backend) == 2, code_backend
+        assert environments(fence(CODE_CHUNK_LINES * 3), code_backend) == 3, code_backend
+
+
+def test_split_code_keeps_every_line():
+    latex = render_markdown(fence(CODE_CHUNK_LINES * 2 + 7))
+
+    for idx in (0, CODE_CHUNK_LINES - 1, CODE_CHUNK_LINES, CODE_CHUNK_LINES * 2 + 6):
+        assert f"line {idx}\n" in latex
+
+
+def code_lines(latex, code_backend):
+    lines = latex.splitlines()
+    start = next(idx for idx, line in enumerate(lines) if ENVIRONMENTS[code_backend] in line)
+    end = next(idx for idx, line in enumerate(lines) if line.lstrip().startswith('\\end{'))
+
+    return lines[start], lines[start + 1:end]
+
+
+def test_deep_code_is_not_capped():
+    depth = elements.MAX_INDENT + 8
+    code = ['```', '    indented = 1', '  two', '\tthree', '```']
+    markdown = ''.join('> ' * depth + line + '\n' for line in code)
+
+    for code_backend in CODE_BACKENDS:
+        with LatexRenderer(code_backend=code_backend) as renderer:
+            begin, lines = code_lines(renderer.render(parse_markdown(markdown)), code_backend)
+
+        max_indent, elements.MAX_INDENT = elements.MAX_INDENT, depth * 2
+
+        try:
+            with LatexRenderer(code_backend=code_backend) as renderer:
+                _, uncapped = code_lines(renderer.render(parse_markdown(markdown)), code_backend)
+        finally:
+            elements.MAX_INDENT = max_indent
+
+        # the environment is indented as far as the cap, but the code as if there were none
+        assert begin.startswith('  ' * elements.MAX_INDENT + '\\begin'), code_backend
+        assert lines == uncapped, code_backend
+        assert lines[1:3] == ['  two', '\tthree'], code_backend
+
+
+if __name__ == '__main__':
+    test_ordinary_code_is_not_split()
+    test_very_long_code_is_split()
+    test_split_code_keeps_every_line()
+    test_deep_code_is_not_capped()
+    print("code: ok")
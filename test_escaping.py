@@ -0,0 +1,99 @@
+"""
+Checks escape_latex against the four-pass escaper it replaced, on random
+strings heavy in special characters and backslashes.
+
+    python -m pytest test_escaping.py
+    python test_escaping.py [--benchmark]
+"""
+import random
+import re
+import sys
+import time
+
+from unquietcode.tools.martek.escaping import escape_latex
+
+
+ALPHABET = 'ab \n\\\\\\#$%&_{}~^'
+SEED = 1
+
+
+def old_escape_latex(text):
+    text = re.sub(r'((?<!\\)[#$%&_{}\\])', r'\\\1', text)
+    text = re.sub(r'((?<!\\)~)', r'\\textasciitilde{}', text)
+    text = re.sub(r'((?<!\\)\^)', r'\\textasciicircum{}', text)
+    text = re.sub(r'(\\\\)', r'\\textbackslash{}', text)
+    return text
+
+
+def random_strings(count, max_length=24, seed=SEED):
+    rng = random.Random(seed)
+
+    for _ in range(count):
+        yield ''.join(rng.choice(ALPHABET) for _ in range(rng.randrange(max_length)))
+
+
+def test_plain_text_is_unchanged():
+    text = "plain text, with punctuation (and brackets) but nothing special."
+    assert escape_latex(text) is text
+
+
+def test_examples():
+    assert escape_latex('50% of $5 & #1') == '50\\% of \\$5 \\& \\#1'
+    assert escape_latex('a_b {x}') == 'a\\_b \\{x\\}'
+    assert escape_latex('~^') == '\\textasciitilde{}\\textasciicircum{}'
+    assert escape_latex('a\\b') == 'a\\textbackslash{}b'
+
+    # as before, a character after a backslash counts as escaped already
+    assert escape_latex('\\#') == '\\textbackslash{}#'
+
+
+def test_matches_old_escaper():
+    for text in random_strings(100_000):
+        assert escape_latex(text) == old_escape_latex(text), repr(text)
+
+
+def test_matches_old_escaper_on_long_strings():
+    for text in random_strings(2_000, max_length=2_000, seed=SEED + 1):
+        assert escape_latex(text) == old_escape_latex(text), repr(text)
+
+
+def benchmark(repeat=5):
+    """
+    Time both escapers over about 5M of prose and 5M of text full of
+    special characters, keeping the best of `repeat` runs.
+    """
+    rng = random.Random(SEED)
+    words = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".split()
+    prose = [' '.join(rng.choice(words) for _ in range(12)) for _ in range(60_000)]
+    mixed = [' '.join(rng.choice(words + ['50%', '#1', '$5', 'a_b', 'x^2', '~', '&', '{}', '\\\\']) for _ in range(12)) for _ in range(60_000)]
+
+    for name, lines in (('prose', prose), ('mixed', mixed)):
+        times = {}
+
+        for escaper in (old_escape_latex, escape_latex):
+            best = None
+
+            for _ in range(repeat):
+                start = time.perf_counter()
+
+                for line in lines:
+                    escaper(line)
+
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            times[escaper.__name__] = best
+
+        old, new = times['old_escape_latex'], times['escape_latex']
+        print(f"{name:>6}: four passes {old * 1000:.1f}ms, one pass {new * 1000:.1f}ms ({old / new:.1f}x)")
+
+
+if __name__ == '__main__':
+    test_plain_text_is_unchanged()
+    test_examples()
+    test_matches_old_escaper()
+    test_matches_old_escaper_on_long_strings()
+    print("escaping: ok")
+
+    if '--benchmark' in sys.argv[1:]:
+        benchmark()
@@ -0,0 +1,101 @@
+"""
+Checks that the fixed part of the preamble is precompiled into one format
+shared by every document, and only when asked for, using a stand-in
+engine which records how it was run.
+
+    python -m pytest test_format.py
+    python test_format.py
+"""
+import os
+import sys
+from tempfile import TemporaryDirectory
+
+from unquietcode.tools.martek import render_markdown
+from unquietcode.tools.martek.compiler import DUMP_MARKER, compile_latex, read_dump
+
+
+ENGINE = f"""#!{sys.executable}
+import os, sys
+if sys.argv[1] == '--version':
+    print('stub engine')
+    sys.exit(0)
+with open(os.environ['STUB_LOG'], 'a') as log:
+    log.write(' '.join(sys.argv[1:]) + '\\n')
+if sys.argv[1] == '-ini':
+    name = sys.argv[2][len('-jobname='):]
+    open(name + '.fmt', 'w').write('format')
+else:
+    name = sys.argv[-1][:-len('.tex')]
+    open(name + '.pdf', 'w').write('%PDF-stub')
+"""
+
+PLAIN = "Just a paragraph.\n"
+FEATURES = "A [link](https://example.com) and an ![image](picture.png).\n\n```\ncode\n```\n"
+
+
+def write_tex(directory, name, markdown):
+    tex_file_path = os.path.join(directory, f"{name}.tex")
+
+    with open(tex_file_path, 'w') as tex_file:
+        tex_file.write(render_markdown(markdown))
+
+    return tex_file_path
+
+
+def test_marker_is_documented_form():
+    assert DUMP_MARKER == '\\csname endofdump\\endcsname'
+    assert f"\n{DUMP_MARKER}\n" in render_markdown(PLAIN)
+
+
+def test_packages_are_not_dumped():
+    with TemporaryDirectory() as tmp:
+        plain = read_dump(write_tex(tmp, 'plain', PLAIN))
+        features = read_dump(write_tex(tmp, 'features', FEATURES))
+
+    assert plain is not None
+    assert plain == features
+
+    for package in ('listings', 'hyperref', 'graphicx'):
+        assert package not in plain
+
+
+def test_precompile_is_opt_in():
+    with TemporaryDirectory() as tmp:
+        engine = os.path.join(tmp, 'stub-engine')
+
+        with open(engine, 'w') as engine_file:
+            engine_file.write(ENGINE)
+
+        os.chmod(engine, 0o755)
+        log_path = os.path.join(tmp, 'engine.log')
+        environ = dict(os.environ)
+        os.environ.update(STUB_LOG=log_path, XDG_CACHE_HOME=os.path.join(tmp, 'cache'))
+
+        try:
+            compile_latex(write_tex(tmp, 'default', PLAIN), engine=engine)
+            compile_latex(write_tex(tmp, 'plain', PLAIN), engine=engine, precompile=True)
+            compile_latex(write_tex(tmp, 'features', FEATURES), engine=engine, precompile=True)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+        with open(log_path) as log_file:
+            runs = log_file.read().splitlines()
+
+        formats = os.listdir(os.path.join(tmp, 'cache', 'martek', 'formats'))
+
+    # the format is built once, and used by both documents
+    assert runs[0] == 'default.tex'
+    assert runs[1].startswith('-ini ') and 'mylatexformat.ltx' in runs[1]
+    assert runs[2].startswith('-fmt=') and runs[2].endswith(' plain.tex')
+    assert runs[3].startswith('-fmt=') and runs[3].endswith(' features.tex')
+    assert len(runs) == 4
+
+    assert formats == [runs[2].split()[0][len('-fmt='):] + '.fmt']
+
+
+if __name__ == '__main__':
+    test_marker_is_documented_form()
+    test_packages_are_not_dumped()
+    test_precompile_is_opt_in()
+    print("format: ok")
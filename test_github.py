@@ -0,0 +1,235 @@
+"""
+Checks the incremental sync of GitHub issues against a mock of the API on
+localhost: unchanged issues are skipped by their content hash, listings
+start from the last sync with `since`, requests are made conditional on
+earlier ETags, and a sync which is not finished is started over.
+
+    python -m pytest test_github.py
+    python test_github.py
+"""
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
+from urllib.parse import parse_qs, urlsplit
+
+from unquietcode.tools.martek.github import IssueStore, IssueSync
+
+
+REPO = 'owner/repo'
+
+
+class MockApi(ThreadingHTTPServer):
+    """
+    Serves the open issues of REPO and their comments, filtered by `since`
+    and with an ETag for each response, which makes a matching request a
+    304. Every request is logged as (path, query, If-None-Match).
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ApiHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.requests = []
+        self.comments = {2: [comment('reviewer', 'Seen it too.')]}
+        self.issues = [
+            issue(self, 1, 'First', 'The first body.', '2024-01-01T00:00:00Z'),
+            issue(self, 2, 'Second', 'The second body.', '2024-01-02T00:00:00Z'),
+        ]
+
+    def update(self, number, updated_at, **changes):
+        for issue in self.issues:
+            if issue['number'] == number:
+                issue.update(changes, updated_at=updated_at)
+
+
+def issue(api, number, title, body, updated_at):
+    return {
+        'number': number,
+        'title': title,
+        'body': body,
+        'user': {'login': 'author'},
+        'milestone': None,
+        'labels': [],
+        'updated_at': updated_at,
+        'comments': len(api.comments.get(number, [])),
+        'comments_url': f"{api.url}/repos/{REPO}/issues/{number}/comments",
+    }
+
+
+def comment(login, body):
+    return {'user': {'login': login}, 'created_at': '2024-01-01T12:00:00Z', 'body': body}
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        api = self.server
+        url = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        api.requests.append((url.path, query, self.headers.get('If-None-Match')))
+
+        if url.path == f"/repos/{REPO}/issues":
+            since = query.get('since', '')
+            content = [issue for issue in api.issues if issue['updated_at'] >= since]
+        else:
+            number = int(url.path.split('/')[-2])
+            content = api.comments.get(number, [])
+
+        content = json.dumps(content).encode('utf-8')
+        etag = '"{0}"'.format(hashlib.md5(content).hexdigest())
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            content = b''
+        else:
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Type', 'application/json')
+
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def mock_api():
+    api = MockApi()
+    thread = threading.Thread(target=api.serve_forever, daemon=True)
+    thread.start()
+
+    with TemporaryDirectory() as tmp:
+        store = IssueStore(os.path.join(tmp, 'state.sqlite'))
+
+        try:
+            yield api, store
+        finally:
+            store.close()
+            api.shutdown()
+            api.server_close()
+
+
+def sync(api, store, render=lambda issue: True, finish=True):
+    """
+    Run a sync the way script.py does, rendering the issues for which
+    `render` is true, and finishing only if every issue was rendered.
+    Returns the numbers of the issues listed as changed, and the sync.
+    """
+    api.requests.clear()
+    issue_sync = IssueSync(REPO, store=store, api_url=api.url, workers=2)
+    changed = []
+    failed = False
+
+    for page in issue_sync.pages():
+        for issue, comments, hash in page:
+            changed.append(issue['number'])
+
+            if render(issue):
+                issue_sync.rendered(issue, comments, hash)
+            else:
+                failed = True
+
+    if finish and not failed:
+        issue_sync.finish()
+
+    return changed, issue_sync
+
+
+def test_first_sync_lists_every_issue():
+    with mock_api() as (api, store):
+        changed, issue_sync = sync(api, store)
+        since = store.get_state(f"since:{REPO}")
+
+    assert changed == [1, 2]
+    assert since == '2024-01-02T00:00:00Z'
+    assert [(path, query.get('since'), etag) for path, query, etag in api.requests] == [
+        (f"/repos/{REPO}/issues", None, None),
+        (f"/repos/{REPO}/issues/2/comments", None, None),
+    ]
+    assert (issue_sync.requests, issue_sync.not_modified, issue_sync.skipped) == (2, 0, 0)
+
+
+def test_unchanged_issues_are_skipped():
+    with mock_api() as (api, store):
+        sync(api, store)
+        changed, issue_sync = sync(api, store)
+
+    # `since` is inclusive, so the last issue is listed again, but skipped
+    assert changed == []
+    assert [(path, query['since'], etag) for path, query, etag in api.requests] == [
+        (f"/repos/{REPO}/issues", '2024-01-02T00:00:00Z', None),
+    ]
+    assert (issue_sync.requests, issue_sync.not_modified, issue_sync.skipped) == (1, 0, 1)
+
+
+def test_unchanged_listing_is_not_modified():
+    with mock_api() as (api, store):
+        sync(api, store)
+        sync(api, store)
+        changed, issue_sync = sync(api, store)
+
+    # the same listing as the last sync, so the request is conditional on its ETag
+    assert changed == []
+    assert len(api.requests) == 1
+    path, query, etag = api.requests[0]
+    assert query['since'] == '2024-01-02T00:00:00Z'
+    assert etag is not None
+    assert (issue_sync.requests, issue_sync.not_modified) == (1, 1)
+
+
+def test_unrendered_changes_are_skipped_by_hash():
+    with mock_api() as (api, store):
+        sync(api, store)
+        sync(api, store)
+        api.update(2, '2024-01-03T00:00:00Z', labels=[{'name': 'bug'}])
+        changed, issue_sync = sync(api, store)
+
+    # a new label changes the listing but not the PDF, and the comments are revalidated
+    assert changed == []
+    assert [(path, etag is not None) for path, _, etag in api.requests] == [
+        (f"/repos/{REPO}/issues", True),
+        (f"/repos/{REPO}/issues/2/comments", True),
+    ]
+    assert (issue_sync.requests, issue_sync.not_modified, issue_sync.skipped) == (2, 1, 1)
+
+
+def test_changed_issues_are_listed():
+    with mock_api() as (api, store):
+        sync(api, store)
+        api.update(1, '2024-01-03T00:00:00Z', body='An edited body.')
+        changed, _ = sync(api, store)
+        since = store.get_state(f"since:{REPO}")
+
+    assert changed == [1]
+    assert since == '2024-01-03T00:00:00Z'
+
+
+def test_failed_sync_is_not_finished():
+    with mock_api() as (api, store):
+        changed, _ = sync(api, store, render=lambda issue: issue['number'] != 2)
+        since = store.get_state(f"since:{REPO}")
+
+        # the next sync lists every issue again, unconditionally, but only the failed one is changed
+        retried, issue_sync = sync(api, store)
+
+    assert changed == [1, 2]
+    assert since is None
+    assert retried == [2]
+    assert [(path, query.get('since'), etag) for path, query, etag in api.requests][0] == (f"/repos/{REPO}/issues", None, None)
+    assert issue_sync.skipped == 1
+
+
+if __name__ == '__main__':
+    test_first_sync_lists_every_issue()
+    test_unchanged_issues_are_skipped()
+    test_unchanged_listing_is_not_modified()
+    test_unrendered_changes_are_skipped_by_hash()
+    test_changed_issues_are_listed()
+    test_failed_sync_is_not_finished()
+    print("github: ok")
@@ -0,0 +1,171 @@
+"""
+Checks that ImageFetcher downloads images concurrently, reuses those it
+already has, revalidates them with their ETag, and reports the images it
+could not fetch, against a small HTTP server on localhost.
+
+    python -m pytest test_images.py
+    python test_images.py
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
+
+import requests
+
+from unquietcode.tools.martek.images import ImageFetcher, image_filename
+
+
+class ImageServer(ThreadingHTTPServer):
+    """
+    Serves /<name>.png as the bytes of its name, with an ETag, taking
+    `delay` seconds over each response. Paths starting with /missing/ are
+    a 404 and those starting with /broken/ a 500. Every request is logged
+    with its If-None-Match header.
+    """
+    daemon_threads = True
+
+    def __init__(self, delay=0):
+        super().__init__(('127.0.0.1', 0), ImageHandler)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.requests = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+
+        with server.lock:
+            server.requests.append((self.path, self.headers.get('If-None-Match')))
+            server.in_flight += 1
+            server.most_in_flight = max(server.most_in_flight, server.in_flight)
+
+        try:
+            time.sleep(server.delay)
+            content = self.path.encode('utf-8')
+            etag = f'"{len(content)}"'
+
+            if self.path.startswith('/missing/'):
+                self.send_response(404)
+                content = b''
+            elif self.path.startswith('/broken/'):
+                self.send_response(500)
+                content = b''
+            elif self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                content = b''
+            else:
+                self.send_response(200)
+                self.send_header('ETag', etag)
+
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def image_server(delay=0):
+    server = ImageServer(delay)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_prefetch_is_concurrent():
+    with image_server(delay=0.2) as server, TemporaryDirectory() as tmp:
+        urls = [server.url(f"/image-{number}.png") for number in range(8)]
+
+        with ImageFetcher(tmp, workers=4) as fetcher:
+            paths, errors = fetcher.prefetch(urls + urls[:2])
+
+        assert errors == {}
+        assert list(paths) == urls
+
+        for url, path in paths.items():
+            assert path == image_filename(url, tmp)
+
+            with open(path, 'rb') as image_file:
+                assert image_file.read() == url[url.index('/', len('http://')):].encode('utf-8')
+
+    # each URL is fetched once, four at a time
+    assert len(server.requests) == 8
+    assert server.most_in_flight == 4
+
+
+def test_cached_images_are_reused():
+    with image_server() as server, TemporaryDirectory() as tmp:
+        url = server.url('/cached.png')
+
+        with ImageFetcher(tmp) as fetcher:
+            first = fetcher.fetch(url)
+
+        with ImageFetcher(tmp) as fetcher:
+            second = fetcher.fetch(url)
+
+    assert first == second
+    assert server.requests == [('/cached.png', None)]
+
+
+def test_revalidation_uses_etag():
+    with image_server() as server, TemporaryDirectory() as tmp:
+        url = server.url('/revalidated.png')
+
+        with ImageFetcher(tmp, revalidate=True) as fetcher:
+            path = fetcher.fetch(url)
+            modified = os.path.getmtime(path)
+            time.sleep(0.05)
+
+            # a 304 keeps the image which is already there
+            assert fetcher.fetch(url) == path
+            assert os.path.getmtime(path) == modified
+
+    etag = f'"{len(b"/revalidated.png")}"'
+    assert server.requests == [('/revalidated.png', None), ('/revalidated.png', etag)]
+
+
+def test_errors_are_reported():
+    with image_server() as server, TemporaryDirectory() as tmp:
+        good, missing, broken = server.url('/good.png'), server.url('/missing/image.png'), server.url('/broken/image.png')
+
+        with ImageFetcher(tmp, retries=1, backoff=0) as fetcher:
+            paths, errors = fetcher.prefetch([good, missing, broken])
+
+        files = os.listdir(tmp)
+
+    assert list(paths) == [good]
+    assert set(errors) == {missing, broken}
+    assert all(isinstance(error, requests.HTTPError) for error in errors.values())
+    assert errors[missing].response.status_code == 404
+    assert errors[broken].response.status_code == 500
+
+    # nothing is left behind for the failed images, and only a 500 is retried
+    assert sorted(files) == sorted([os.path.basename(paths[good]), os.path.basename(paths[good]) + '.json'])
+    assert sorted(path for path, _ in server.requests) == ['/broken/image.png', '/broken/image.png', '/good.png', '/missing/image.png']
+
+
+if __name__ == '__main__':
+    test_prefetch_is_concurrent()
+    test_cached_images_are_reused()
+    test_revalidation_uses_etag()
+    test_errors_are_reported()
+    print("images: ok")
@@ -0,0 +1,80 @@
+"""
+Checks that ImageOptimizer scales images down to the size they will have
+on the page at the given DPI, and leaves images which are already small
+enough as they are.
+
+    python -m pytest test_imaging.py
+    python test_imaging.py
+"""
+import io
+import os
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from unquietcode.tools.martek.imaging import CACHE_DIRECTORY, TEXT_HEIGHT_INCHES, TEXT_WIDTH_INCHES, ImageOptimizer
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def write_image(directory, name, size, image_format='PNG'):
+    image = Image.new('RGB', size, (200, 40, 40))
+    data = io.BytesIO()
+    image.save(data, format=image_format, optimize=True)
+
+    with open(os.path.join(directory, name), 'wb') as image_file:
+        image_file.write(data.getvalue())
+
+    return data.getvalue()
+
+
+def test_large_images_are_scaled_down():
+    with TemporaryDirectory() as tmp:
+        write_image(tmp, 'large.png', (2000, 1000))
+        optimizer = ImageOptimizer(tmp, dpi=72)
+        path = optimizer.optimize('large.png')
+
+        with Image.open(path) as image:
+            size = image.size
+
+    # as wide as the text at 72 dpi, keeping the aspect ratio
+    assert os.path.dirname(path) == os.path.join(tmp, CACHE_DIRECTORY)
+    assert size == (round(72 * TEXT_WIDTH_INCHES), round(72 * TEXT_WIDTH_INCHES) // 2)
+    assert size[1] <= round(72 * TEXT_HEIGHT_INCHES)
+
+    metrics = optimizer.metrics()
+    assert metrics['images'] == 1
+    assert metrics['optimized_bytes'] < metrics['original_bytes']
+
+
+def test_small_images_are_kept():
+    with TemporaryDirectory() as tmp:
+        data = write_image(tmp, 'small.png', (100, 50))
+        optimizer = ImageOptimizer(tmp, dpi=150)
+        path = optimizer.optimize('small.png')
+
+        with open(path, 'rb') as image_file:
+            copy = image_file.read()
+
+        # and the copy is reused
+        assert optimizer.optimize('small.png') == path
+
+    assert copy == data
+    assert optimizer.metrics() == {'images': 2, 'original_bytes': 2 * len(data), 'optimized_bytes': 2 * len(data)}
+
+
+def test_unoptimizable_images_are_passed_through():
+    with TemporaryDirectory() as tmp:
+        optimizer = ImageOptimizer(tmp, dpi=150)
+
+        assert optimizer.optimize('https://example.com/image.png') is None
+        assert optimizer.optimize('figure.pdf') is None
+        assert optimizer.optimize('missing.png') is None
+        assert optimizer.metrics()['images'] == 0
+
+
+if __name__ == '__main__':
+    test_large_images_are_scaled_down()
+    test_small_images_are_kept()
+    test_unoptimizable_images_are_passed_through()
+    print("imaging: ok")
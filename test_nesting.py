@@ -0,0 +1,51 @@
+"""
+Checks that parsing a deeply nested document never changes the recursion
+limit or thread stack size of the process, refusing documents deeper than
+the limit allows, and that they parse and render once an application
+raises it.
+
+    python -m pytest test_nesting.py
+    python test_nesting.py
+"""
+import sys
+import threading
+
+import pytest
+
+from unquietcode.tools.martek import LatexRenderer, parse_markdown
+
+
+def nested_quotes(depth):
+    return '>' * depth + ' quoted\n'
+
+
+def test_limits_are_unchanged():
+    recursion_limit = sys.getrecursionlimit()
+    stack_size = threading.stack_size()
+    parse_markdown(nested_quotes(200))
+
+    with pytest.raises(ValueError):
+        parse_markdown(nested_quotes(recursion_limit * 2))
+
+    assert sys.getrecursionlimit() == recursion_limit
+    assert threading.stack_size() == stack_size
+
+
+def test_deep_documents_parse_within_a_raised_limit():
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(20000)
+
+    try:
+        document = parse_markdown(nested_quotes(2000))
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+
+    latex = LatexRenderer().render(document)
+    assert latex.count('\\begin{leftbar}') == 2000
+    assert 'quoted' in latex
+
+
+if __name__ == '__main__':
+    test_limits_are_unchanged()
+    test_deep_documents_parse_within_a_raised_limit()
+    print("nesting: ok")
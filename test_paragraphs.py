@@ -0,0 +1,126 @@
+"""
+Paragraph breaks, before and after they were decided while rendering.
+
+The renderer used to add its breaks afterwards, with a regex over the whole
+LaTeX document. Each sample here gives the body of a document as that regex
+broke it, and as it is broken now. The old output is also reproduced, by
+taking the breaks out of the new output and running the old regex over it.
+Where the regex broke the text correctly, the layout is unchanged: only the
+number of blank lines (which TeX reads as one) differs.
+
+    python -m pytest test_paragraphs.py
+    python test_paragraphs.py
+"""
+import re
+
+from unquietcode.tools.martek import render_markdown
+from unquietcode.tools.martek.latex_renderer import PARAGRAPH_BREAK
+
+
+# (markdown, body before, body after)
+SAMPLES = [
+    # the top of the page is left blank, as before
+    (
+        'First paragraph.\n\nSecond paragraph.\n',
+        '\\mbox{}\\\\\n\nFirst paragraph.\\mbox{}\\\\\n\nSecond paragraph.',
+        '\\mbox{}\\\\\n\n\nFirst paragraph.\\mbox{}\\\\\n\nSecond paragraph.',
+    ),
+    (
+        '# Title\n\nText.\n',
+        '\\mbox{}\\\\\n\n{\\section*{Title}}\nText.',
+        '\\mbox{}\\\\\n\n\n{\\section*{Title}}\nText.',
+    ),
+    # text after a listing, a list or a rule is set apart from it, as before
+    (
+        '```\ncode\n```\n\nText after code.\n',
+        '\\mbox{}\\\\\n\n\n\\begin{lstlisting}[backgroundcolor = \\color{gray!10}]\ncode\n\n\\end{lstlisting}\\mbox{}\\\\\n\nText after code.',
+        '\\mbox{}\\\\\n\n\n\\begin{lstlisting}[backgroundcolor = \\color{gray!10}]\ncode\n\n\\end{lstlisting}\\mbox{}\\\\\n\nText after code.',
+    ),
+    (
+        '* one\n* two\n\nText after list.\n',
+        '\\mbox{}\\\\\n\n\n\\begin{itemize}\n  \\item one\n  \\item two\n\\end{itemize}\\mbox{}\\\\\n\nText after list.',
+        '\\mbox{}\\\\\n\n\n\n\\begin{itemize}\n  \\item one\n  \\item two\n\\end{itemize}\\mbox{}\\\\\n\nText after list.',
+    ),
+    (
+        'Before.\n\n---\n\nText after rule.\n',
+        '\\mbox{}\\\\\n\nBefore.\n\n\\mbox{}\n\\hrulefill\n\\mbox{}\\mbox{}\\\\\n\nText after rule.',
+        '\\mbox{}\\\\\n\n\nBefore.\n\n\\mbox{}\n\\hrulefill\n\\mbox{}\\mbox{}\\\\\n\nText after rule.',
+    ),
+    # and after a table, or before a heading, but not after a quote
+    (
+        '| a |\n|---|\n| 1 |\n\nText after table.\n',
+        '\\mbox{}\\\\\n\n\n\\begin{tabular}{l}\n  a \\\\\n  \\hline\n  1 \\\\\n\\end{tabular}\\mbox{}\\\\\n\nText after table.',
+        '\\mbox{}\\\\\n\n\n\\begin{tabular}{l}\n  a \\\\\n  \\hline\n  1 \\\\\n\\end{tabular}\\mbox{}\\\\\n\nText after table.',
+    ),
+    (
+        'Text before code.\n\n```\ncode\n```\n\n# After\n',
+        '\\mbox{}\\\\\n\nText before code.\n\n\\begin{lstlisting}[backgroundcolor = \\color{gray!10}]\ncode\n\n\\end{lstlisting}\\mbox{}\\\\\n\n{\\section*{After}}',
+        '\\mbox{}\\\\\n\n\nText before code.\n\n\\begin{lstlisting}[backgroundcolor = \\color{gray!10}]\ncode\n\n\\end{lstlisting}\\mbox{}\\\\\n\n{\\section*{After}}',
+    ),
+    (
+        '> quoted\n\nText after quote.\n',
+        '\\mbox{}\\\\\n\n\n\\begin{leftbar}{\\color{gray}\n  quoted\n  \n}\\end{leftbar}\nText after quote.',
+        '\\mbox{}\\\\\n\n\n\\begin{leftbar}{\\color{gray}\n  quoted\n  \n}\\end{leftbar}\nText after quote.',
+    ),
+    # the regex never matched indented paragraphs inside a quote
+    (
+        '> First quoted.\n>\n> Second quoted.\n',
+        '\\mbox{}\\\\\n\n\n\\begin{leftbar}{\\color{gray}\n  First quoted.\n  \n  Second quoted.\n  \n}\\end{leftbar}',
+        '\\mbox{}\\\\\n\n\n\\begin{leftbar}{\\color{gray}\n  First quoted.\\mbox{}\\\\\n  \n  Second quoted.\n  \n}\\end{leftbar}',
+    ),
+    # the regex needed at least two characters on the second line
+    (
+        'x\n\nNext.\n',
+        '\\mbox{}\\\\\n\n\nx\n\nNext.',
+        '\\mbox{}\\\\\n\n\nx\\mbox{}\\\\\n\nNext.',
+    ),
+    # the regex skipped paragraphs starting with a backslash
+    (
+        'First.\n\n*Emphasis* starts this one.\n',
+        '\\mbox{}\\\\\n\nFirst.\n\n\\textit{Emphasis}\n starts this one.',
+        '\\mbox{}\\\\\n\n\nFirst.\\mbox{}\\\\\n\n\\textit{Emphasis}\n starts this one.',
+    ),
+    (
+        'First.\n\n`code` starts this one.\n',
+        '\\mbox{}\\\\\n\nFirst.\n\n\\colorbox{code-background}{\\texttt{code}}\n starts this one.',
+        '\\mbox{}\\\\\n\n\nFirst.\\mbox{}\\\\\n\n\\colorbox{code-background}{\\texttt{code}}\n starts this one.',
+    ),
+]
+
+# samples whose layout is the same as before, differing only in blank lines
+SAME_LAYOUT = SAMPLES[:8]
+
+
+def old_newlines(text):
+    return re.sub(r'(\S+)\n{2,}(\s*[^\\]\S+)', r'\1\\mbox{}\\\\\n\n\2', text, flags=re.MULTILINE)
+
+
+def body(latex):
+    return latex.split('\\definecolor{code-background}{gray}{.95}', 1)[1].replace('\\end{document}', '').strip()
+
+
+def test_breaks_after():
+    for markdown, _, after in SAMPLES:
+        assert body(render_markdown(markdown)) == after, markdown
+
+
+def blank_lines(latex):
+    return re.sub(r'\n{2,}', '\n\n', latex)
+
+
+def test_layout_kept():
+    for markdown, before, after in SAME_LAYOUT:
+        assert blank_lines(before) == blank_lines(after), markdown
+
+
+def test_breaks_before():
+    for markdown, before, _ in SAMPLES:
+        unbroken = render_markdown(markdown).replace(PARAGRAPH_BREAK, '')
+        assert body(old_newlines(unbroken)) == before, markdown
+
+
+if __name__ == '__main__':
+    test_breaks_after()
+    test_layout_kept()
+    test_breaks_before()
+    print("paragraphs: ok")
@@ -0,0 +1,86 @@
+"""
+Stress test for RendererPool: many threads rendering through a few pooled
+renderers must produce exactly what a single-threaded render does.
+
+    python -m pytest test_pool.py
+    python test_pool.py
+"""
+import io
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from unquietcode.tools.martek import LatexRenderer, RenderCache, RendererPool, parse_markdown
+
+
+RENDERS = 2000
+THREADS = 16
+POOL_SIZE = 4
+
+
+def documents(count=40, seed=0):
+    """
+    Small documents which differ from one another in every kind of block,
+    including reference links, which mistletoe resolves through a global.
+    """
+    rng = random.Random(seed)
+    result = []
+
+    for idx in range(count):
+        parts = [
+            f"# Document {idx}",
+            f"Text with *emphasis*, a [reference][ref{idx}] and {rng.randrange(100)}% of $5.",
+            "\n".join(f"* item {item}" for item in range(rng.randrange(1, 5))),
+            f"```\ncode {idx} {{}}\n```",
+            f"| a | b |\n|---|---|\n| {idx} | {rng.randrange(10)} |",
+            f"> quote {idx}",
+            f"[ref{idx}]: https://example.com/{idx}",
+        ]
+        rng.shuffle(parts)
+        result.append('\n\n'.join(parts) + '\n')
+
+    return result
+
+
+def single_threaded(markdown):
+    with LatexRenderer() as renderer:
+        return renderer.render(parse_markdown(markdown))
+
+
+def stress(pool):
+    corpus = documents()
+    expected = [single_threaded(markdown) for markdown in corpus]
+
+    def render(job):
+        idx = job % len(corpus)
+
+        # mix strings and lines, and returned and streamed output
+        markdown = corpus[idx] if job % 2 else corpus[idx].splitlines(keepends=True)
+
+        if job % 3:
+            return idx, pool.render(markdown)
+
+        stream = io.StringIO()
+        pool.write(markdown, stream)
+        return idx, stream.getvalue()
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        for idx, rendered in executor.map(render, range(RENDERS)):
+            assert rendered == expected[idx], f"document {idx} differs"
+
+    assert pool.created <= POOL_SIZE
+
+
+def test_pool():
+    stress(RendererPool(size=POOL_SIZE))
+
+
+def test_pool_with_shared_cache():
+    cache = RenderCache()
+    stress(RendererPool(size=POOL_SIZE, cache=cache))
+    assert cache.hits > 0
+
+
+if __name__ == '__main__':
+    test_pool()
+    test_pool_with_shared_cache()
+    print("pool: ok")
@@ -0,0 +1,205 @@
+"""
+Checks that the compile scheduler runs no more than its number of workers
+at once, passes failures on, and can be shut down with jobs still queued.
+Some of the checks use a stand-in engine which takes a moment over each
+document, and others a fake compile which waits to be let go.
+
+    python -m pytest test_scheduler.py
+    python test_scheduler.py
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from tempfile import TemporaryDirectory
+
+from unquietcode.tools.martek import scheduler as scheduler_module
+from unquietcode.tools.martek.batch import render_batch
+from unquietcode.tools.martek.scheduler import CompileScheduler
+
+
+ENGINE = f"""#!{sys.executable}
+import sys, time
+time.sleep(0.2)
+name = sys.argv[-1][:-len('.tex')]
+open(name + '.pdf', 'w').write('%PDF-stub')
+"""
+
+
+def stub_engine(directory):
+    path = os.path.join(directory, 'stub-engine')
+
+    with open(path, 'w') as engine_file:
+        engine_file.write(ENGINE)
+
+    os.chmod(path, 0o755)
+    return path
+
+
+class BlockingCompile:
+    """
+    Stands in for compile_pdf, holding every compile until released and
+    keeping count of how many run at once. Documents containing FAIL
+    fail as the engine would.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.released = threading.Event()
+        self.running = 0
+        self.most_running = 0
+
+    def __call__(self, tex_file_path, pdf_file_path, **options):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+
+        try:
+            self.released.wait(10)
+
+            with open(tex_file_path) as tex_file:
+                if 'FAIL' in tex_file.read():
+                    raise subprocess.CalledProcessError(1, ['stub-engine'], output=b'! failed')
+
+            with open(pdf_file_path, 'w') as pdf_file:
+                pdf_file.write('%PDF-stub')
+
+            return b'compiled'
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+@contextmanager
+def blocking_compile():
+    fake = BlockingCompile()
+    scheduler_module.compile_pdf, compile_pdf = fake, scheduler_module.compile_pdf
+
+    try:
+        yield fake
+    finally:
+        fake.released.set()
+        scheduler_module.compile_pdf = compile_pdf
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_concurrency_is_bounded():
+    with TemporaryDirectory() as tmp, blocking_compile() as fake:
+        scheduler = CompileScheduler(max_workers=3, cache=False)
+        futures = [scheduler.submit(f"document {idx}", os.path.join(tmp, f"{idx}.pdf")) for idx in range(10)]
+
+        wait_for(lambda: fake.running == 3)
+        time.sleep(0.2)
+
+        assert fake.most_running == 3
+        assert scheduler.metrics()['running'] == 3
+        assert scheduler.metrics()['queued'] == 7
+
+        fake.released.set()
+        results = [future.result() for future in futures]
+        scheduler.shutdown()
+
+    assert fake.most_running == 3
+    assert [result.log for result in results] == ['compiled'] * 10
+    assert scheduler.metrics() == {'max_workers': 3, 'queued': 0, 'running': 0, 'completed': 10, 'failed': 0}
+
+
+def test_pending_jobs_are_cancelled():
+    with TemporaryDirectory() as tmp, blocking_compile() as fake:
+        scheduler = CompileScheduler(max_workers=2, cache=False)
+        futures = [scheduler.submit(f"document {idx}", os.path.join(tmp, f"{idx}.pdf")) for idx in range(6)]
+
+        wait_for(lambda: fake.running == 2)
+        scheduler.shutdown(wait=False, cancel_pending=True)
+
+        # the two running jobs finish, and the other four never start
+        assert [future.cancelled() for future in futures] == [False, False, True, True, True, True]
+
+        fake.released.set()
+        assert [future.result().log for future in futures[:2]] == ['compiled', 'compiled']
+        scheduler.shutdown()
+
+    assert fake.most_running == 2
+    assert scheduler.metrics()['queued'] == 0
+    assert scheduler.metrics()['completed'] == 2
+
+
+def test_failures_are_passed_on():
+    with TemporaryDirectory() as tmp, blocking_compile() as fake:
+        fake.released.set()
+
+        with CompileScheduler(max_workers=2, cache=False) as scheduler:
+            futures = [scheduler.submit(tex, os.path.join(tmp, f"{idx}.pdf")) for idx, tex in enumerate(['ok', 'FAIL', 'ok'])]
+
+            try:
+                futures[1].result()
+            except subprocess.CalledProcessError as ex:
+                assert ex.output == b'! failed'
+            else:
+                assert False, "the failure was not raised"
+
+            assert futures[0].result().log == futures[2].result().log == 'compiled'
+
+    assert scheduler.metrics()['completed'] == 2
+    assert scheduler.metrics()['failed'] == 1
+
+
+def test_batch_compiles_through_scheduler():
+    with TemporaryDirectory() as tmp, blocking_compile() as fake:
+        inputs = []
+
+        for idx, text in enumerate(['one', 'FAIL', 'three', 'four', 'five']):
+            inputs.append(os.path.join(tmp, f"{idx}.md"))
+
+            with open(inputs[-1], 'w') as markdown_file:
+                markdown_file.write(f"# Document\n\n{text}\n")
+
+        threading.Timer(0.2, fake.released.set).start()
+        results = {os.path.basename(result.input_path): result for result in render_batch(inputs, workers=2, cache=False)}
+
+    assert fake.most_running == 2
+    assert sorted(results) == ['0.md', '1.md', '2.md', '3.md', '4.md']
+    assert [name for name, result in sorted(results.items()) if not result.ok] == ['1.md']
+    assert results['1.md'].error == "stub-engine exited with status 1"
+    assert results['1.md'].log == '! failed'
+
+
+def test_shutdown_cancels_pending_jobs():
+    with TemporaryDirectory() as tmp:
+        scheduler = CompileScheduler(max_workers=1, engine=stub_engine(tmp), precompile=False, cache=False)
+        futures = [scheduler.submit(f"document {idx}", os.path.join(tmp, f"{idx}.pdf")) for idx in range(5)]
+
+        scheduler.shutdown(cancel_pending=True)
+
+        assert sum(future.cancelled() for future in futures) >= 3
+        assert all(future.done() for future in futures)
+        assert scheduler.metrics()['queued'] == 0
+        assert scheduler.pending == set()
+
+
+def test_context_manager():
+    with TemporaryDirectory() as tmp:
+        with CompileScheduler(max_workers=2, engine=stub_engine(tmp), precompile=False, cache=False) as scheduler:
+            results = list(scheduler.map((f"document {idx}", os.path.join(tmp, f"{idx}.pdf")) for idx in range(3)))
+
+        assert [os.path.basename(result.pdf_file_path) for result in results] == ['0.pdf', '1.pdf', '2.pdf']
+        assert scheduler.metrics()['completed'] == 3
+
+
+if __name__ == '__main__':
+    test_concurrency_is_bounded()
+    test_pending_jobs_are_cancelled()
+    test_failures_are_passed_on()
+    test_batch_compiles_through_scheduler()
+    test_shutdown_cancels_pending_jobs()
+    test_context_manager()
+    print("scheduler: ok")
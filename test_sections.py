@@ -0,0 +1,223 @@
+"""
+Checks that a sectioned build only compiles the sections which need it,
+using a stand-in engine which typesets every PAGE in a section as a page
+of its own, numbered as TeX would number it, and records which sections
+each run included. It fails on sections containing FAILME, or named in a
+file called `failing`.
+
+    python -m pytest test_sections.py
+    python test_sections.py
+"""
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from unquietcode.tools.martek import sections
+from unquietcode.tools.martek.sections import SectionBuild
+
+
+ENGINE = f"""#!{sys.executable}
+import os, re, sys
+if sys.argv[1] == '--version':
+    print('stub engine')
+    sys.exit(0)
+with open(sys.argv[-1]) as tex_file:
+    tex = tex_file.read()
+def read(path):
+    with open(path) as source:
+        return source.read()
+def write(path, text):
+    with open(path, 'w') as target:
+        target.write(text)
+if sys.argv[-1] == 'merge.tex':
+    pages = []
+    for first, last, path in re.findall(r'\\\\includepdf\\[pages=\\{{(\\d+)-(\\d+)\\}}\\]\\{{([^}}]*)\\}}', tex):
+        pages += read(path).splitlines()[int(first) - 1:int(last)]
+    write('merge.pdf', ''.join(page + '\\n' for page in pages))
+    sys.exit(0)
+failing = read('failing').split() if os.path.exists('failing') else []
+included = re.search(r'\\\\includeonly\\{{([^}}]*)\\}}', tex).group(1).split(',')
+with open('engine.log', 'a') as log:
+    log.write(' '.join(included) + '\\n')
+page = 1
+pages = []
+for name in re.findall(r'\\\\include\\{{([^}}]*)\\}}', tex):
+    if name not in included:
+        page = int(re.findall(r'\\\\setcounter\\{{page\\}}\\{{(-?\\d+)\\}}', read(name + '.aux'))[-1])
+        continue
+    print('martek-section:' + name, flush=True)
+    body = read(name + '.tex')
+    if 'FAILME' in body or name in failing:
+        print('! stub error')
+        sys.exit(1)
+    for _ in range(max(1, body.count('PAGE'))):
+        pages.append(f'{{name}} page {{page}}')
+        page += 1
+    write(name + '.aux', '\\\\setcounter{{page}}{{' + str(page) + '}}\\n')
+write('main.pdf', ''.join(page + '\\n' for page in pages))
+"""
+
+TITLES = ('One', 'Two', 'Three', 'Four')
+
+
+def markdown(**bodies):
+    """
+    A document with a section for each title, each of a single page unless
+    its body is given.
+    """
+    return ''.join(f"# {title}\n\n{bodies.get(title, 'PAGE')}\n\n" for title in TITLES if bodies.get(title) != '')
+
+
+@contextmanager
+def section_build():
+    """
+    A build with the stand-in engine, which also puts the pages together
+    (rather than pypdf, which needs real PDFs). Yields a function which
+    builds a document and returns the results, the sections included by
+    each engine run, and the pages of the PDF.
+    """
+    pdf_writer, sections.PdfWriter = sections.PdfWriter, None
+
+    try:
+        with TemporaryDirectory() as tmp:
+            engine = os.path.join(tmp, 'stub-engine')
+
+            with open(engine, 'w') as engine_file:
+                engine_file.write(ENGINE)
+
+            os.chmod(engine, 0o755)
+            build = SectionBuild(os.path.join(tmp, 'build'), engine=engine)
+            log_path = build.path('engine.log')
+            pdf_file_path = os.path.join(tmp, 'document.pdf')
+
+            def run(text):
+                if os.path.exists(log_path):
+                    os.remove(log_path)
+
+                results = build.build(text, pdf_file_path)
+                runs = []
+
+                if os.path.exists(log_path):
+                    with open(log_path) as log_file:
+                        runs = [line.split() for line in log_file.read().splitlines()]
+
+                with open(pdf_file_path) as pdf_file:
+                    pages = pdf_file.read().splitlines()
+
+                return results, runs, pages
+
+            run.build = build
+            yield run
+    finally:
+        sections.PdfWriter = pdf_writer
+
+
+def numbered(*names):
+    return [f"{name} page {page}" for page, name in enumerate(names, 1)]
+
+
+def test_only_changed_sections_are_compiled():
+    with section_build() as run:
+        results, runs, pages = run(markdown())
+
+        assert runs == [['section-000', 'section-001', 'section-002', 'section-003']]
+        assert pages == numbered('section-000', 'section-001', 'section-002', 'section-003')
+        assert [result.pages for result in results] == [1, 1, 1, 1]
+        assert all(result.seconds is not None for result in results)
+
+        # nothing has changed
+        results, runs, pages = run(markdown())
+
+        assert runs == []
+        assert pages == numbered('section-000', 'section-001', 'section-002', 'section-003')
+        assert all(result.seconds is None for result in results)
+
+        # the same number of pages, so the rest are left as they are
+        results, runs, pages = run(markdown(Two='PAGE, edited'))
+
+        assert runs == [['section-001']]
+        assert pages == numbered('section-000', 'section-001', 'section-002', 'section-003')
+        assert [result.seconds is not None for result in results] == [False, True, False, False]
+
+
+def test_page_count_change_recompiles_later_sections():
+    with section_build() as run:
+        run(markdown())
+        results, runs, pages = run(markdown(Two='PAGE PAGE'))
+
+    # the second pass gives the sections after it their new page numbers
+    assert runs == [['section-001'], ['section-002', 'section-003']]
+    assert pages == numbered('section-000', 'section-001', 'section-001', 'section-002', 'section-003')
+    assert [result.pages for result in results] == [1, 2, 1, 1]
+    assert [result.seconds is not None for result in results] == [False, True, True, True]
+
+
+def test_removed_sections():
+    with section_build() as run:
+        run(markdown())
+        results, runs, pages = run(markdown(Three=''))
+        files = sorted(os.listdir(run.build.build_dir))
+
+    # a different list of sections means compiling everything
+    assert runs == [['section-000', 'section-001', 'section-002']]
+    assert pages == numbered('section-000', 'section-001', 'section-002')
+    assert [result.title for result in results] == ['One', 'Two', 'Four']
+
+    # and the files of the last section are gone
+    assert 'section-003.tex' not in files
+    assert 'section-003.aux' not in files
+    assert 'section-002.tex' in files
+
+
+def test_recovery_after_failed_run():
+    with section_build() as run:
+        run(markdown())
+
+        with pytest.raises(subprocess.CalledProcessError):
+            run(markdown(Two='PAGE FAILME'))
+
+        # the section which failed is compiled again, even though it's back as it was
+        results, runs, pages = run(markdown())
+
+        assert runs == [['section-001']]
+        assert pages == numbered('section-000', 'section-001', 'section-002', 'section-003')
+
+        # and one which failed after changing its number of pages is put right too
+        with pytest.raises(subprocess.CalledProcessError):
+            run(markdown(Two='PAGE PAGE PAGE FAILME'))
+
+        results, runs, pages = run(markdown(Two='PAGE PAGE'))
+
+    assert runs == [['section-001'], ['section-002', 'section-003']]
+    assert pages == numbered('section-000', 'section-001', 'section-001', 'section-002', 'section-003')
+
+
+def test_recovery_after_failed_second_pass():
+    with section_build() as run:
+        run(markdown())
+
+        # the first pass rewrites the .aux file of the second section, then the second pass fails
+        with open(run.build.path('failing'), 'w') as failing_file:
+            failing_file.write('section-002')
+
+        with pytest.raises(subprocess.CalledProcessError):
+            run(markdown(Two='PAGE PAGE'))
+
+        os.remove(run.build.path('failing'))
+        results, runs, pages = run(markdown())
+
+    assert runs == [['section-001', 'section-002', 'section-003']]
+    assert pages == numbered('section-000', 'section-001', 'section-002', 'section-003')
+
+
+if __name__ == '__main__':
+    test_only_changed_sections_are_compiled()
+    test_page_count_change_recompiles_later_sections()
+    test_removed_sections()
+    test_recovery_after_failed_run()
+    test_recovery_after_failed_second_pass()
+    print("sections: ok")
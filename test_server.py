@@ -0,0 +1,216 @@
+"""
+Checks that the render service turns away requests beyond its limits with
+a 429, drops PDF jobs with a 503 when they wait too long or the server
+stops, reports its state at /health, and that a flood of LaTeX requests
+doesn't hold up PDF jobs.
+
+    python -m pytest test_server.py
+    python test_server.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from tempfile import TemporaryDirectory
+
+from unquietcode.tools.martek.server import RenderServer
+
+
+ENGINE = """#!{executable}
+import sys, time
+if sys.argv[1] == '--version':
+    print('stub engine')
+    sys.exit(0)
+time.sleep({seconds})
+name = sys.argv[-1][:-len('.tex')]
+open(name + '.pdf', 'w').write('%PDF-stub')
+"""
+
+
+@contextmanager
+def stub_engine(seconds=0):
+    """
+    A stand-in engine which takes the given time to compile.
+    """
+    with TemporaryDirectory() as tmp:
+        engine = os.path.join(tmp, 'stub-engine')
+
+        with open(engine, 'w') as engine_file:
+            engine_file.write(ENGINE.format(executable=sys.executable, seconds=seconds))
+
+        os.chmod(engine, 0o755)
+        yield engine
+
+
+async def send(writer, method, path, body=b''):
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+
+
+async def receive(reader, writer):
+    response = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+
+    head, _, content = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), content
+
+
+async def request(port, method, path, body=b''):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    await send(writer, method, path, body)
+
+    return await receive(reader, writer)
+
+
+async def flood(engine):
+    server = RenderServer(port=0, workers=1, queue_size=1, latex_queue_size=1, engine=engine, cache=False)
+    render = server.renderers.render
+
+    def slow_render(markdown):
+        time.sleep(0.5)
+        return render(markdown)
+
+    server.renderers.render = slow_render
+    await server.start()
+
+    try:
+        latex = [asyncio.ensure_future(request(server.port, 'POST', '/latex', b'# title\n\ntext')) for _ in range(5)]
+        await asyncio.sleep(0.1)
+
+        # the renders are all busy or waiting, but a PDF job still goes straight through
+        start = time.perf_counter()
+        status, content = await request(server.port, 'POST', '/pdf', b'# title')
+        pdf_seconds = time.perf_counter() - start
+
+        statuses = sorted(status for status, _ in await asyncio.gather(*latex))
+        metrics = server.metrics()
+    finally:
+        await server.stop()
+
+    return status, content, pdf_seconds, statuses, metrics
+
+
+def test_latex_backpressure():
+    with stub_engine() as engine:
+        status, content, pdf_seconds, statuses, metrics = asyncio.run(flood(engine))
+
+    assert statuses == [200, 200, 429, 429, 429]
+    assert metrics['latex'] == {'pending': 0, 'completed': 2, 'rejected': 3}
+
+    assert (status, content) == (200, b'%PDF-stub')
+    assert pdf_seconds < 0.5
+
+
+async def pdf_requests(server, count, body=b'# title'):
+    """
+    Send PDF requests one after another, so that they are queued in order,
+    and return the statuses of their responses.
+    """
+    await server.start()
+
+    try:
+        requests = []
+
+        for number in range(count):
+            requests.append(asyncio.ensure_future(request(server.port, 'POST', '/pdf', body + str(number).encode())))
+            await asyncio.sleep(0.05)
+
+        statuses = [status for status, _ in await asyncio.gather(*requests)]
+        metrics = server.metrics()
+    finally:
+        await server.stop()
+
+    return statuses, metrics
+
+
+def test_pdf_backpressure():
+    with stub_engine(0.5) as engine:
+        server = RenderServer(port=0, workers=1, queue_size=1, engine=engine, cache=False)
+        statuses, metrics = asyncio.run(pdf_requests(server, 4))
+
+    # one compiling and one waiting, the rest turned away
+    assert statuses == [200, 200, 429, 429]
+    assert (metrics['completed'], metrics['rejected'], metrics['expired']) == (2, 2, 0)
+
+
+def test_pdf_queue_timeout():
+    with stub_engine(0.5) as engine:
+        server = RenderServer(port=0, workers=1, queue_size=2, queue_timeout=0.2, engine=engine, cache=False)
+        statuses, metrics = asyncio.run(pdf_requests(server, 3))
+
+    # the later jobs wait for longer than the timeout behind the first
+    assert statuses == [200, 503, 503]
+    assert (metrics['completed'], metrics['rejected'], metrics['expired']) == (1, 0, 2)
+
+
+async def shut_down(server):
+    await server.start()
+
+    # one job compiling and one waiting, and a connection yet to send its request
+    requests = [asyncio.ensure_future(request(server.port, 'POST', '/pdf', body)) for body in (b'one', b'two')]
+    await asyncio.sleep(0.1)
+    reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+
+    stopping = asyncio.ensure_future(server.stop())
+    await asyncio.sleep(0.05)
+    await send(writer, 'POST', '/pdf', b'three')
+
+    statuses = [status for status, _ in await asyncio.gather(*requests, receive(reader, writer))]
+    await stopping
+
+    return statuses, server.metrics()
+
+
+def test_pdf_unavailable_on_shutdown():
+    with stub_engine(1) as engine:
+        server = RenderServer(port=0, workers=1, queue_size=1, engine=engine, cache=False)
+        statuses, metrics = asyncio.run(shut_down(server))
+
+    assert statuses == [503, 503, 503]
+    assert metrics['status'] == 'draining'
+
+
+async def health(server):
+    await server.start()
+
+    try:
+        await request(server.port, 'POST', '/pdf', b'# title')
+        status, content = await request(server.port, 'GET', '/health')
+        post_status, _ = await request(server.port, 'POST', '/health')
+    finally:
+        await server.stop()
+
+    return status, json.loads(content), post_status
+
+
+def test_health():
+    with stub_engine() as engine:
+        server = RenderServer(port=0, workers=2, queue_size=3, engine=engine, cache=False)
+        status, metrics, post_status = asyncio.run(health(server))
+
+    assert status == 200
+    assert post_status == 405
+    assert metrics == {
+        'status': 'ok',
+        'workers': 2,
+        'queue_size': 3,
+        'queued': 0,
+        'running': 0,
+        'completed': 1,
+        'failed': 0,
+        'rejected': 0,
+        'expired': 0,
+        'latex': {'pending': 0, 'completed': 0, 'rejected': 0},
+    }
+
+
+if __name__ == '__main__':
+    test_latex_backpressure()
+    test_pdf_backpressure()
+    test_pdf_queue_timeout()
+    test_pdf_unavailable_on_shutdown()
+    test_health()
+    print("server: ok")
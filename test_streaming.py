@@ -0,0 +1,132 @@
+"""
+Checks that streaming a document to a file writes exactly what rendering
+it in memory returns.
+
+    python -m pytest test_streaming.py
+    python test_streaming.py
+"""
+import io
+import os
+
+from unquietcode.tools.martek import LatexRenderer, parse_markdown, write_markdown
+from unquietcode.tools.martek.latex_renderer import TABLE_FLUSH_ROWS
+
+
+TABLE = """
+| Name | Count | Price |
+|:-----|:-----:|------:|
+| apples | 3 | $1.50 |
+| pears & plums | 10 | 50% off |
+"""
+
+CODE = """
+```python
+def escape(text):
+    return text.replace('%', '\\\\%')  # 100% {literal}
+```
+
+    indented code
+    with two lines
+"""
+
+LISTS = """
+* first item
+* [x] checked
+* [ ] unchecked
+    * nested item
+
+      with a second paragraph
+    * and another
+* last item
+
+1. one
+2. two
+"""
+
+IMAGES = """
+![a picture](picture.png)
+
+Text right after the picture.
+
+![](https://example.com/remote.jpg)
+"""
+
+PROSE = """
+Heading
+=======
+
+A paragraph with *emphasis*, **bold**, `code`, ~~struck~~ and a [link](https://example.com).
+It carries on over a second line.
+
+A second paragraph, right after the first.
+
+> A quote
+>
+> > nested inside another
+
+---
+
+## Subheading
+
+x
+"""
+
+SAMPLE = '\n'.join([PROSE, TABLE, CODE, LISTS, IMAGES])
+
+
+def rendered(markdown, **options):
+    with LatexRenderer(**options) as renderer:
+        return renderer.render(parse_markdown(markdown))
+
+
+def streamed(markdown, **options):
+    stream = io.StringIO()
+    write_markdown(markdown, stream, **options)
+    return stream.getvalue()
+
+
+def assert_identical(markdown, **options):
+    expected = rendered(markdown, **options)
+    assert streamed(markdown, **options) == expected
+    assert streamed(markdown.splitlines(keepends=True), **options) == expected
+
+
+def test_sample():
+    assert_identical(SAMPLE)
+
+
+def test_each_part():
+    for part in (PROSE, TABLE, CODE, LISTS, IMAGES):
+        assert_identical(part)
+
+
+def test_verbatim_code():
+    assert_identical(SAMPLE, code_backend='verbatim')
+
+
+def test_long_code_written_in_chunks():
+    fence = "```\n" + ''.join(f"line {idx} {{}} 100%\n" for idx in range(95)) + "```\n"
+    assert_identical(f"Before\n\n{fence}\nAfter\n", code_chunk_lines=10)
+    assert_identical(f"Before\n\n{fence}\nAfter\n", code_chunk_lines=10, code_backend='verbatim')
+
+
+def test_long_table_written_in_rows():
+    rows = ''.join(f"| row {idx} | {idx * 2} |\n" for idx in range(TABLE_FLUSH_ROWS * 2 + 5))
+    table = f"| a | b |\n|---|---|\n{rows}"
+    assert_identical(f"Before\n\n{table}\nAfter\n", table_backend='longtable')
+    assert_identical(f"Before\n\n{table}\nAfter\n")
+
+
+def test_sample_file():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test2.md'), 'r') as sample_file:
+        assert_identical(sample_file.read())
+
+
+if __name__ == '__main__':
+    test_sample()
+    test_each_part()
+    test_verbatim_code()
+    test_long_code_written_in_chunks()
+    test_long_table_written_in_rows()
+    test_sample_file()
+    print("streaming: ok")
@@ -1,2 +1,6 @@
 from .latex_renderer import LatexRenderer
-from .helpers import render_markdown
\ No newline at end of file
+from .cache import RenderCache, DiskRenderCache
+from .helpers import parse_markdown, render_markdown, write_documents, write_markdown
+from .pool import RendererPool
+from .server import RenderServer
+from .profiling import RenderProfile
\ No newline at end of file
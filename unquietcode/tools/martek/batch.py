@@ -0,0 +1,169 @@
+import argparse
+import glob
+import os
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional
+
+from .compiler import ENGINE
+from .helpers import parse_markdown
+from .latex_renderer import LatexRenderer
+from .scheduler import CompileScheduler
+
+
+@dataclass
+class BatchResult:
+    input_path: str
+    output_path: str
+    seconds: float
+    error: Optional[str] = None
+    log: Optional[str] = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def find_inputs(sources: Iterable[str]) -> List[str]:
+    """
+    Expand a list of sources into markdown file paths. A source can be a
+    directory (every .md file inside it), a glob pattern, a manifest file
+    prefixed with '@' (one path per line), or a plain file path.
+    """
+    inputs = []
+
+    for source in sources:
+        if source.startswith('@'):
+            manifest_path = source[1:]
+            base_dir = os.path.dirname(manifest_path)
+
+            with open(manifest_path, 'r') as manifest:
+                for line in manifest:
+                    if (line := line.strip()) and not line.startswith('#'):
+                        inputs.append(os.path.join(base_dir, line))
+
+        elif os.path.isdir(source):
+            inputs.extend(sorted(glob.glob(os.path.join(source, '*.md'))))
+
+        elif glob.has_magic(source):
+            inputs.extend(sorted(glob.glob(source, recursive=True)))
+
+        else:
+            inputs.append(source)
+
+    # drop duplicates while preserving the order
+    return list(dict.fromkeys(inputs))
+
+
+def output_path_for(input_path, output_dir=None):
+    base_dir, file_name = os.path.split(input_path)
+    pdf_file_name = os.path.splitext(file_name)[0] + ".pdf"
+
+    return os.path.join(output_dir or base_dir, pdf_file_name)
+
+
+def render_latex(input_path) -> str:
+    """
+    Render a markdown file to LaTeX, with images resolved relative to it.
+    """
+    with open(input_path, 'r') as markdown_file:
+        image_dir = os.path.dirname(os.path.abspath(input_path))
+
+        with LatexRenderer(image_dir=image_dir) as renderer:
+            return renderer.render(parse_markdown(markdown_file))
+
+
+def record_error(result, ex):
+    if isinstance(ex, subprocess.CalledProcessError):
+        result.error = f"{ex.cmd[0]} exited with status {ex.returncode}"
+
+        if ex.stdout:
+            result.log = ex.stdout.decode('utf-8', errors='replace')
+    else:
+        result.error = f"{type(ex).__name__}: {ex}"
+
+
+def render_batch(inputs: Iterable[str], output_dir=None, workers=None, cache=True, engine=ENGINE) -> Iterator[BatchResult]:
+    """
+    Render many documents, rendering the LaTeX of each one in turn while a
+    CompileScheduler runs the engine over those already rendered, with one
+    compile per core by default. Only a couple of documents per compile
+    are rendered ahead, so that a large batch is not held in memory.
+    Results are yielded as each document finishes (timed from the start
+    of its render, including any wait for the engine), and a failing
+    document does not stop the others.
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    workers = workers or os.cpu_count()
+    jobs = {}
+
+    def finish(futures):
+        for future in futures:
+            result, start = jobs.pop(future)
+
+            try:
+                result.log = future.result().log
+            except Exception as ex:
+                record_error(result, ex)
+
+            result.seconds = time.perf_counter() - start
+            yield result
+
+    with CompileScheduler(max_workers=workers, engine=engine, cache=cache) as scheduler:
+        for input_path in inputs:
+            result = BatchResult(input_path, output_path_for(input_path, output_dir), seconds=0)
+            start = time.perf_counter()
+
+            try:
+                tex = render_latex(input_path)
+            except Exception as ex:
+                record_error(result, ex)
+                result.seconds = time.perf_counter() - start
+                yield result
+                continue
+
+            jobs[scheduler.submit(tex, result.output_path)] = (result, start)
+
+            if len(jobs) >= 2 * workers:
+                yield from finish(wait(jobs, return_when=FIRST_COMPLETED).done)
+
+        while jobs:
+            yield from finish(wait(jobs, return_when=FIRST_COMPLETED).done)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="martek batch",
+        description="render many markdown files to PDF, compiling them in parallel",
+    )
+    parser.add_argument('sources', nargs='+', help="markdown files, directories, glob patterns, or @manifest files")
+    parser.add_argument('-o', '--output-dir', help="directory for the PDF files (default: next to each input)")
+    parser.add_argument('-j', '--jobs', type=int, help="number of documents compiled at once (default: one per core)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="print the TeX log of failed documents")
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help="always run the engine, ignoring cached PDFs")
+    options = parser.parse_args(args)
+
+    inputs = find_inputs(options.sources)
+
+    if not inputs:
+        print("no markdown files found")
+        return 2
+
+    failures = 0
+
+    for result in render_batch(inputs, output_dir=options.output_dir, workers=options.jobs, cache=options.cache):
+        if result.ok:
+            print(f"ok      {result.input_path} -> {result.output_path} ({result.seconds:.2f}s)")
+        else:
+            failures += 1
+            print(f"FAILED  {result.input_path}: {result.error} ({result.seconds:.2f}s)")
+
+            if options.verbose and result.log:
+                print(result.log)
+
+    print(f"{len(inputs) - failures} of {len(inputs)} documents rendered")
+    return 1 if failures else 0
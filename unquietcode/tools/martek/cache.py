@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+
+from mistletoe.block_token import BlockToken
+from mistletoe.span_token import SpanToken
+
+from .files import replace_with_copy
+
+
+# enough blocks for a long document (a few hundred pages) to be re-rendered from the cache
+DEFAULT_MAX_SIZE = 65536
+
+
+def block_key(token, salt=''):
+    """
+    Hash a parsed block, including all of its children, into a key which
+    identifies its rendered output.
+    """
+    digest = hashlib.sha1(salt.encode('utf-8'))
+    stack = [token]
+
+    while stack:
+        token = stack.pop()
+
+        if isinstance(token, (list, tuple)):
+            digest.update(f"[{len(token)}]".encode('utf-8'))
+            stack.extend(reversed(token))
+            continue
+
+        if not isinstance(token, (BlockToken, SpanToken)):
+            digest.update(f"{token!r},".encode('utf-8'))
+            continue
+
+        digest.update(f"<{type(token).__name__}".encode('utf-8'))
+
+        for name, value in sorted(vars(token).items()):
+            if name == 'parent':
+                continue
+
+            if isinstance(value, (BlockToken, SpanToken, list, tuple)):
+                digest.update(f" {name}:".encode('utf-8'))
+                stack.append(value)
+            else:
+                digest.update(f" {name}={value!r}".encode('utf-8'))
+
+        digest.update(b">")
+
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """
+    An in-memory cache of rendered top-level blocks, bounded in size
+    and evicting the least recently used blocks first.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            rendered = self.load(key)
+
+            if rendered is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return rendered
+
+    def put(self, key, rendered):
+        with self.lock:
+            self.store(key, rendered)
+            self.evict()
+
+    def load(self, key):
+        rendered = self.entries.get(key)
+
+        if rendered is not None:
+            self.entries.move_to_end(key)
+
+        return rendered
+
+    def store(self, key, rendered):
+        self.entries[key] = rendered
+        self.entries.move_to_end(key)
+
+    def evict(self):
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(size={len(self)}, hits={self.hits}, misses={self.misses})"
+
+
+class DiskRenderCache(RenderCache):
+    """
+    A render cache which keeps one file per block in a directory, so
+    that it can be shared across runs. Recency is kept in memory, seeded
+    from the modification times of the files when the cache is opened,
+    and saved by touching each file which is used.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        super().__init__(max_size=max_size)
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+        for entry in sorted(self.files(), key=lambda entry: entry.stat().st_mtime_ns):
+            self.entries[entry.name[:-len('.json')]] = None
+
+    def files(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json') and entry.is_file():
+                yield entry
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, key):
+        path = self.path(key)
+
+        try:
+            with open(path, 'r') as file:
+                rendered = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        os.utime(path)
+
+        # the file may have been written by another process sharing the directory
+        self.entries[key] = None
+        self.entries.move_to_end(key)
+        return rendered
+
+    def store(self, key, rendered):
+        path = self.path(key)
+
+        # write to a temporary file first so readers never see a partial entry
+        with NamedTemporaryFile('w', dir=self.directory, suffix='.tmp', delete=False) as file:
+            json.dump(rendered, file)
+
+        os.replace(file.name, path)
+        self.entries[key] = None
+        self.entries.move_to_end(key)
+
+    def evict(self):
+        while len(self.entries) > self.max_size:
+            key, _ = self.entries.popitem(last=False)
+
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+
+class PdfCache:
+    """
+    An on-disk cache of compiled PDF files, keyed by everything which goes
+    into producing them: the LaTeX source, the engine and its version, and
+    the contents of any images the document includes. The cache is bounded
+    in total size, evicting the least recently used files first.
+    """
+
+    INCLUDE_PATTERN = re.compile(r'\\includegraphics(?:\[[^\]]*\])?\{([^}]*)\}')
+    GRAPHICS_PATH_PATTERN = re.compile(r'\\graphicspath\{\s*((?:\{[^}]*\}\s*)+)\}')
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, tex_file_path, engine, engine_version, runs=1):
+        digest = hashlib.sha256(f"{engine}\n{engine_version}\n".encode('utf-8'))
+
+        # later runs can change the output (a table of contents, for one)
+        if runs != 1:
+            digest.update(f"runs={runs}\n".encode('utf-8'))
+        graphics_paths = [os.path.dirname(os.path.abspath(tex_file_path))]
+        images = []
+
+        with open(tex_file_path, 'rb') as tex_file:
+            for line in tex_file:
+                digest.update(line)
+
+                if b'\\graphicspath' in line:
+                    for match in self.GRAPHICS_PATH_PATTERN.finditer(line.decode('utf-8', errors='replace')):
+                        graphics_paths.extend(re.findall(r'\{([^}]*)\}', match.group(1)))
+
+                if b'\\includegraphics' in line:
+                    for match in self.INCLUDE_PATTERN.finditer(line.decode('utf-8', errors='replace')):
+                        images.append(match.group(1))
+
+        for image in images:
+            digest.update(f"\n{image}\n".encode('utf-8'))
+
+            if (image_path := self.find_image(image, graphics_paths)) is None:
+                continue
+
+            with open(image_path, 'rb') as image_file:
+                for chunk in iter(lambda: image_file.read(1024 * 1024), b''):
+                    digest.update(chunk)
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def find_image(image, graphics_paths):
+        candidates = [image] if os.path.isabs(image) else [os.path.join(_, image) for _ in graphics_paths]
+
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                return candidate
+
+        return None
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key):
+        """
+        Returns the path to the cached PDF, or None if there is not one.
+        """
+        path = self.path(key)
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return path
+
+    def put(self, key, pdf_path):
+        replace_with_copy(pdf_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = [_ for _ in os.scandir(self.directory) if _.name.endswith('.pdf') and _.is_file()]
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        total = 0
+
+        for entry in entries:
+            total += entry.stat().st_size
+
+            if total > self.max_bytes:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def __repr__(self):
+        return f"{type(self).__name__}(hits={self.hits}, misses={self.misses})"
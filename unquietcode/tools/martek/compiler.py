@@ -0,0 +1,276 @@
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+from functools import lru_cache
+from tempfile import TemporaryDirectory
+
+from .cache import PdfCache
+from .files import copy_contents, move_file, replace_with_copy
+from .helpers import write_documents, write_markdown
+
+
+ENGINE = 'xelatex'
+
+# PDF files are readable and writable by everyone
+PDF_MODE = 0o666
+
+# marks the end of the part of a preamble which can be precompiled, as
+# documented by mylatexformat (without a format it expands to \relax)
+DUMP_MARKER = '\\csname endofdump\\endcsname'
+
+# formats which could not be built, so as not to keep trying
+_failed_formats = set()
+
+_pdf_cache = None
+
+
+def cache_dir(*parts):
+    base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    directory = os.path.join(base_dir, 'martek', *parts)
+    os.makedirs(directory, exist_ok=True)
+
+    return directory
+
+
+@lru_cache()
+def engine_version(engine=ENGINE):
+    output = subprocess.check_output([engine, '--version'], stdin=subprocess.DEVNULL)
+    return output.decode('utf-8', errors='replace').strip().splitlines()[0]
+
+
+def read_dump(tex_file_path):
+    """
+    Read the part of a document's preamble which comes before the dump
+    marker, or None if the document does not have one.
+    """
+    lines = []
+
+    with open(tex_file_path, 'r') as tex_file:
+        for line in tex_file:
+            if line.rstrip('\n') == DUMP_MARKER:
+                return ''.join(lines)
+
+            if line.startswith('\\begin{document}'):
+                break
+
+            lines.append(line)
+
+    return None
+
+
+def precompiled_format(tex_file_path, engine=ENGINE):
+    """
+    Find (or else build) a format with the fixed part of the document's
+    preamble already loaded, using mylatexformat. Formats are cached by
+    that part of the preamble and the engine version, so a changed
+    preamble gets a new format, which replaces the old one. The packages
+    each document loads come after the marker, so they all share a format.
+    Returns the directory and name of the format, or None if it is not
+    available.
+    """
+    if (dump := read_dump(tex_file_path)) is None:
+        return None
+
+    try:
+        version = engine_version(engine)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    key = hashlib.sha1(f"{engine}\n{version}\n{dump}".encode('utf-8')).hexdigest()
+    prefix = f"martek-{os.path.basename(engine)}-"
+    name = prefix + key[:20]
+    directory = cache_dir('formats')
+
+    if os.path.exists(os.path.join(directory, f"{name}.fmt")):
+        return directory, name
+
+    if name in _failed_formats:
+        return None
+
+    try:
+        build_format(dump, name, directory, engine)
+    except (OSError, subprocess.CalledProcessError):
+        _failed_formats.add(name)
+        return None
+
+    # only the format for the current preamble and engine version is kept
+    for file_name in os.listdir(directory):
+        if file_name.startswith(prefix) and file_name.endswith('.fmt') and file_name != f"{name}.fmt":
+            try:
+                os.remove(os.path.join(directory, file_name))
+            except OSError:
+                pass
+
+    return directory, name
+
+
+def build_format(dump, name, directory, engine=ENGINE):
+
+    # build next to the cache so that the finished format can be moved in atomically
+    with TemporaryDirectory(dir=directory) as tmp:
+        with open(os.path.join(tmp, f"{name}.tex"), 'w') as tex_file:
+            tex_file.write(dump)
+            tex_file.write(f"{DUMP_MARKER}\n\\begin{{document}}\n\\end{{document}}\n")
+
+        subprocess.check_output(
+            [engine, '-ini', f'-jobname={name}', f'&{engine}', 'mylatexformat.ltx', f'{name}.tex'],
+            cwd=tmp,
+            stdin=subprocess.DEVNULL,
+        )
+
+        os.replace(os.path.join(tmp, f"{name}.fmt"), os.path.join(directory, f"{name}.fmt"))
+
+
+def engine_command(tex_file_path, engine=ENGINE, precompile=False):
+    """
+    The command which runs the TeX engine over a .tex file, along with
+    the directory to run it in and its environment (None to inherit it).
+    """
+    directory, file_name = os.path.split(os.path.abspath(tex_file_path))
+    command = [engine]
+    env = None
+
+    if precompile and (precompiled := precompiled_format(tex_file_path, engine)):
+        format_dir, format_name = precompiled
+        command.append(f'-fmt={format_name}')
+        env = dict(os.environ, TEXFORMATS=format_dir + os.pathsep)
+
+    command.append(file_name)
+    return command, directory, env
+
+
+def compile_latex(tex_file_path, engine=ENGINE, precompile=False, runs=1):
+    """
+    Run the TeX engine over a .tex file, in the directory containing it,
+    `runs` times over for documents with cross references to resolve.
+    Returns the output of the engine, raising CalledProcessError on failure.
+
+    If `precompile` is set then the fixed part of the preamble is loaded
+    from a cached format, rather than processing it again for every run.
+    This is off by default, as it has not yet been tried against a real
+    TeX installation.
+    """
+    command, directory, env = engine_command(tex_file_path, engine, precompile)
+
+    # with no input the engine stops at the first error instead of prompting
+    for _ in range(runs):
+        output = subprocess.check_output(
+            command,
+            cwd=directory,
+            env=env,
+            stdin=subprocess.DEVNULL,
+        )
+
+    return output
+
+
+def deliver_pdf(tmp_pdf_path, pdf_file_path, move=False):
+    """
+    Write the PDF content to the correct location, which can also be
+    an open binary file (such as standard out). The PDF is swapped in
+    atomically, being renamed into place if `move` is set, and copied
+    by the kernel otherwise.
+    """
+    if not hasattr(pdf_file_path, 'write'):
+        if move:
+            move_file(tmp_pdf_path, pdf_file_path, PDF_MODE)
+        else:
+            replace_with_copy(tmp_pdf_path, pdf_file_path, PDF_MODE)
+
+        return
+
+    pdf_file_path.flush()
+
+    with open(tmp_pdf_path, 'rb') as tmp_pdf_file:
+        try:
+            target_fd = pdf_file_path.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            shutil.copyfileobj(tmp_pdf_file, pdf_file_path)
+            pdf_file_path.flush()
+        else:
+            copy_contents(tmp_pdf_file.fileno(), target_fd)
+
+
+def default_pdf_cache():
+    global _pdf_cache
+
+    if _pdf_cache is None:
+        _pdf_cache = PdfCache(cache_dir('pdfs'))
+
+    return _pdf_cache
+
+
+def compile_pdf(tex_file_path, pdf_file_path, engine=ENGINE, precompile=False, cache=True, runs=1):
+    """
+    Compile a .tex file and deliver the PDF to its final location. When the
+    cache is enabled, a document which has been compiled before is copied
+    from the cache without running the engine, in which case None is
+    returned instead of the output of the engine.
+    """
+    pdf_cache = None
+    key = None
+
+    if cache is True:
+        cache = default_pdf_cache()
+
+    if cache:
+        try:
+            key = cache.key(tex_file_path, engine, engine_version(engine), runs)
+            pdf_cache = cache
+        except (OSError, subprocess.CalledProcessError):
+            pass
+
+    if pdf_cache is not None and (cached_pdf_path := pdf_cache.get(key)) is not None:
+        deliver_pdf(cached_pdf_path, pdf_file_path)
+        return None
+
+    result = compile_latex(tex_file_path, engine=engine, precompile=precompile, runs=runs)
+    tmp_pdf_path = os.path.splitext(tex_file_path)[0] + '.pdf'
+
+    if pdf_cache is not None:
+        pdf_cache.put(key, tmp_pdf_path)
+
+    deliver_pdf(tmp_pdf_path, pdf_file_path, move=True)
+    return result
+
+
+def render_pdf(markdown_data, pdf_file_path, image_dir=None, engine=ENGINE, precompile=False, cache=True, profile=None, image_dpi=None, table_backend='tabular', code_backend='listings'):
+    """
+    Render markdown (a string or an iterable of lines) to a PDF file,
+    working in a temporary directory of its own. Returns the output
+    of the TeX engine, or None if the PDF was found in the cache. When a
+    RenderProfile is given, rendering the LaTeX is recorded in it. With an
+    `image_dpi`, images are scaled down to that resolution on the page.
+    Tables which run over many pages need the 'longtable' backend, and
+    the 'verbatim' code backend is much faster to compile than listings.
+    """
+    with TemporaryDirectory() as tmp:
+
+        # render the markdown file to LaTeX, writing out the Tex file
+        tex_file_path = f"{tmp}/data.tex"
+
+        with open(tex_file_path, 'w') as tex_file:
+            write_markdown(markdown_data, tex_file, image_dir=image_dir, profile=profile, image_dpi=image_dpi, table_backend=table_backend, code_backend=code_backend)
+
+        # process the Tex file into a PDF
+        return compile_pdf(tex_file_path, pdf_file_path, engine=engine, precompile=precompile, cache=cache)
+
+
+def render_combined_pdf(documents, pdf_file_path, image_dir=None, engine=ENGINE, toc=False, bookmarks=True, precompile=False, cache=True, image_dpi=None, table_backend='tabular', code_backend='listings'):
+    """
+    Render many (title, markdown) documents into a single PDF with one
+    compile, each document starting on a new page. Returns the output of
+    the TeX engine, or None if the PDF was found in the cache.
+    """
+    with TemporaryDirectory() as tmp:
+        tex_file_path = f"{tmp}/data.tex"
+
+        with open(tex_file_path, 'w') as tex_file:
+            write_documents(documents, tex_file, toc=toc, bookmarks=bookmarks, image_dir=image_dir, image_dpi=image_dpi, table_backend=table_backend, code_backend=code_backend)
+
+        # the table of contents is written out by the first run and read back in by the second
+        runs = 2 if toc else 1
+
+        return compile_pdf(tex_file_path, pdf_file_path, engine=engine, precompile=precompile, cache=cache, runs=runs)
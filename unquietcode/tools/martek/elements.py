@@ -1,21 +1,150 @@
 from typing import List, Union, Callable
 
 
-Element = Union[str, 'Block', 'Span', Callable[['Element'], 'Element']]
+# text is kept as plain strings, rather than wrapped in an object each
+Element = Union[str, 'String', 'Block', 'Span', Callable[['Element'], 'Element']]
+
+
+# deeper blocks are not indented any further, so that output stays linear in the
+# nesting; the text of a code block is indented in full, since it is set as it is
+MAX_INDENT = 32
+
+
+def indentation(indent):
+    return '  '*min(indent, MAX_INDENT)
+
+
+def render_element(element, indent=0):
+    """
+    Render an element and everything inside it. Containers are walked with
+    an explicit stack rather than recursively, and blocks write into the
+    output of the block they are in, so deeply nested blocks are rendered
+    in linear time. Only spans, and blocks with an action, collect their
+    text on their own, to pass it to the action.
+    """
+    if type(element) is str:
+        return indentation(indent) + element
+    
+    if not isinstance(element, Container):
+        return element.render(indent=indent)
+    
+    output = []
+    stack = [Frame(element, indent, output)]
+    
+    while stack:
+        frame = stack[-1]
+        parts = frame.parts
+        block = frame.block
+        child_indent = frame.child_indent
+        padding = frame.padding
+        
+        for child in frame.children:
+            if block:
+                if frame.started:
+                    parts.append("\n")
+                
+                frame.started = True
+            
+            if type(child) is str:
+                parts.append(padding + child if padding else child)
+                continue
+            
+            # most spans only hold text, which can be joined without a frame of their own
+            if type(child) is Span:
+                try:
+                    rendered = ''.join(child.elements)
+                except TypeError:
+                    pass
+                else:
+                    if child.action is not None:
+                        rendered = child.action(rendered)
+                    
+                    parts.append(padding + rendered if padding else rendered)
+                    continue
+            
+            if not isinstance(child, Container):
+                parts.append(child.render(indent=child_indent))
+            elif not block and isinstance(child, Block):
+                raise Exception("spans cannot contain blocks")
+            else:
+                stack.append(Frame(child, child_indent, parts))
+                break
+        else:
+            stack.pop()
+            frame.close()
+    
+    return ''.join(output)
+
+
+class Frame:
+    """
+    A container which is being rendered, and where its text is going.
+    """
+    __slots__ = ('container', 'block', 'indent', 'child_indent', 'padding', 'children', 'parts', 'output', 'started')
+    
+    def __init__(self, container, indent, output):
+        self.container = container
+        self.block = isinstance(container, Block)
+        self.indent = indent
+        self.children = iter(container.elements)
+        self.output = output
+        self.started = False
+        
+        if not self.block:
+            self.child_indent = 0
+            self.padding = ''
+            self.parts = []
+            return
+        
+        # a deindented block holds code, which is not capped
+        if container.deindent is True:
+            self.child_indent = indent
+            self.padding = '  '*indent
+        else:
+            self.child_indent = indent + 1
+            self.padding = indentation(indent + 1)
+        
+        self.parts = [] if container.action is not None else output
+        
+        if container.prefix is not None:
+            self.parts.append(f"{indentation(indent)}{container.prefix}\n")
+    
+    
+    def close(self):
+        container = self.container
+        
+        if self.block and container.suffix is not None:
+            self.parts.append(f"\n{indentation(self.indent)}{container.suffix}")
+        
+        if self.parts is self.output:
+            return
+        
+        rendered = ''.join(self.parts)
+        
+        if container.action is not None:
+            rendered = container.action(rendered)
+        
+        if not self.block:
+            rendered = indentation(self.indent) + rendered
+        
+        self.output.append(rendered)
 
 
 class String:
+    __slots__ = ('value',)
+    
     def __init__(self, value):
         self.value = value
     
     def render(self, indent=0):
-        return ('  '*indent) + self.value
+        return indentation(indent) + self.value
     
     def __repr__(self):
         return self.value
 
 
 class Container:
+    __slots__ = ('action', 'elements')
     elements: List[Element]
     
     def __init__(self, action=None):
@@ -23,65 +152,32 @@ class Container:
         self.elements = []
 
     def push(self, element: Element):
-        if type(element) is str:
-            element = String(element)
-        
         self.elements.append(element)
 
 
 class Span(Container):
+    __slots__ = ()
     
     def push(self, element: Element):
         if type(element) is Block:
             raise Exception("spans cannot contain blocks")
 
-        Container.push(self, element)
+        self.elements.append(element)
     
     
     def render(self, indent=0):
-        indentation = '  '*indent
-        rendered = ""
-        
-        for idx, element in enumerate(self.elements):
-            if type(element) is Block:
-                raise Exception("spans cannot contain blocks")
-            
-            rendered += element.render()
-        
-        if self.action is not None:
-            rendered = self.action(rendered)
-            
-        return indentation + rendered
+        return render_element(self, indent)
 
 
 class Block(Container):
+    __slots__ = ('prefix', 'suffix', 'deindent')
     
     def __init__(self, prefix=None, suffix=None, action=None, deindent=None):
-        super().__init__()
+        super().__init__(action)
         self.prefix = prefix
         self.suffix = suffix
-        self.action = action
         self.deindent = deindent
 
     
     def render(self, indent=0):
-        indentation = '  '*indent
-        rendered = ""
-        
-        if self.prefix is not None:
-            rendered += f"{indentation}{self.prefix}\n"
-        
-        if self.deindent is True:
-            block_indent = indent
-        else:
-            block_indent = indent + 1
-        
-        rendered += f"\n".join([_.render(indent=block_indent) for _ in self.elements])
-
-        if self.suffix is not None:
-            rendered += f"\n{indentation}{self.suffix}"
-                       
-        if self.action is not None:
-            rendered = self.action(rendered)
-
-        return rendered
\ No newline at end of file
+        return render_element(self, indent)
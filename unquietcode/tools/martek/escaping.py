@@ -0,0 +1,55 @@
+import re
+
+
+# characters which need to be escaped (along with the backslash itself)
+SPECIAL_CHARACTERS = {
+    '#': '\\#',
+    '$': '\\$',
+    '%': '\\%',
+    '&': '\\&',
+    '_': '\\_',
+    '{': '\\{',
+    '}': '\\}',
+    '~': '\\textasciitilde{}',
+    '^': '\\textasciicircum{}',
+}
+
+# Either a lone special character, or else a run of backslashes along with
+# the special character they are escaping (if any). The pattern begins with
+# a character set so that the regex engine can skip quickly over plain text.
+ESCAPE_PATTERN = re.compile(r'[\\#$%&_{}~^](?:(?<=\\)\\*[#$%&_{}~^]?)?')
+
+BACKSLASH = '\\textbackslash{}'
+
+
+def _escape_match(match):
+    matched = match.group(0)
+
+    if matched[0] != '\\':
+        return SPECIAL_CHARACTERS[matched]
+
+    escaped = matched.lstrip('\\')
+    count = len(matched) - len(escaped)
+
+    # The leading backslash of a run is escaped and then every pair of
+    # backslashes becomes a \textbackslash{}, leaving a single trailing
+    # backslash to escape the next character when the count is even.
+    rendered = BACKSLASH * ((count + 1) // 2)
+
+    if count % 2 == 0:
+        rendered += '\\'
+
+    return rendered + escaped
+
+
+def escape_latex(text):
+    """
+    Escape text for LaTeX in a single pass. Characters which are already
+    escaped with a backslash are left alone.
+    """
+
+    # fast path for text which needs no escaping
+    if ESCAPE_PATTERN.search(text) is None:
+        return text
+
+    return ESCAPE_PATTERN.sub(_escape_match, text)
@@ -0,0 +1,87 @@
+import errno
+import os
+from tempfile import mkstemp
+
+
+# errors meaning that a kernel copy cannot be used for these files
+UNSUPPORTED = {errno.EBADF, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EXDEV}
+
+
+def copy_contents(source_fd, target_fd):
+    """
+    Copy everything from one file descriptor to another, inside the kernel
+    where possible (with copy_file_range or else sendfile), and through a
+    buffer otherwise.
+    """
+    size = os.fstat(source_fd).st_size
+    offset = 0
+
+    for kernel_copy in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, kernel_copy):
+            continue
+
+        while offset < size:
+            try:
+                if kernel_copy == 'copy_file_range':
+                    copied = os.copy_file_range(source_fd, target_fd, size - offset, offset)
+                else:
+                    copied = os.sendfile(target_fd, source_fd, offset, size - offset)
+            except OSError as ex:
+                if ex.errno in UNSUPPORTED:
+                    break
+
+                raise
+
+            if copied == 0:
+                break
+
+            offset += copied
+
+        if offset >= size:
+            return
+
+    while chunk := os.pread(source_fd, 1024 * 1024, offset):
+        os.write(target_fd, chunk)
+        offset += len(chunk)
+
+
+def replace_with_copy(source_path, target_path, mode=0o644):
+    """
+    Atomically replace the target with a copy of the source, by copying to
+    a temporary file beside the target and renaming it into place. Readers
+    of the target see either the old file or the new one, but never part of
+    a file.
+    """
+    directory, name = os.path.split(os.path.abspath(target_path))
+    fd, tmp_path = mkstemp(dir=directory, prefix=f".{name}.", suffix='.tmp')
+
+    try:
+        with open(source_path, 'rb') as source:
+            copy_contents(source.fileno(), fd)
+
+        # set the mode directly, rather than changing the process-wide umask
+        os.fchmod(fd, mode)
+    except BaseException:
+        os.close(fd)
+        os.remove(tmp_path)
+        raise
+
+    os.close(fd)
+    os.replace(tmp_path, target_path)
+
+
+def move_file(source_path, target_path, mode=0o644):
+    """
+    Atomically move the source to the target, renaming it when they are on
+    the same filesystem and falling back to a copy when they are not.
+    """
+    os.chmod(source_path, mode)
+
+    try:
+        os.replace(source_path, target_path)
+    except OSError as ex:
+        if ex.errno != errno.EXDEV:
+            raise
+
+        replace_with_copy(source_path, target_path, mode)
+        os.remove(source_path)
@@ -0,0 +1,280 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import requests
+
+
+API_URL = 'https://api.github.com'
+
+SCHEMA = """
+create table if not exists issues (
+    number integer primary key,
+    updated_at text not null,
+    content_hash text,
+    comments text
+);
+
+create table if not exists responses (
+    url text primary key,
+    etag text,
+    last_modified text
+);
+
+create table if not exists state (
+    key text primary key,
+    value text
+);
+"""
+
+
+def content_hash(issue, comments) -> str:
+    """
+    A hash of everything about an issue which shows up in its PDF, so that
+    changes which don't (labels, reactions, assignees) don't cause it to
+    be rendered again.
+    """
+    content = {
+        'title': issue['title'],
+        'body': issue['body'],
+        'user': issue['user']['login'],
+        'milestone': (issue.get('milestone') or {}).get('title'),
+        'comments': [
+            (comment['user']['login'], comment['created_at'], comment['body'])
+            for comment in comments
+        ],
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class IssueStore:
+    """
+    The state of an incremental sync, kept in a SQLite file: when each
+    issue was last updated, a hash of what was rendered for it, its
+    comments, and the validators of earlier API responses.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def get_state(self, key) -> Optional[str]:
+        with self.lock:
+            row = self.connection.execute("select value from state where key = ?", (key,)).fetchone()
+            return row[0] if row else None
+
+    def set_state(self, key, value):
+        with self.lock, self.connection:
+            self.connection.execute("insert or replace into state (key, value) values (?, ?)", (key, value))
+
+    def validators(self, url) -> Tuple[Optional[str], Optional[str]]:
+        with self.lock:
+            row = self.connection.execute("select etag, last_modified from responses where url = ?", (url,)).fetchone()
+            return row if row else (None, None)
+
+    def save_validators(self, url, etag, last_modified):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "insert or replace into responses (url, etag, last_modified) values (?, ?, ?)",
+                (url, etag, last_modified),
+            )
+
+    def issue(self, number):
+        """
+        The (updated_at, content_hash, comments) stored for an issue, or
+        None if it has never been synced.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "select updated_at, content_hash, comments from issues where number = ?", (number,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        updated_at, hash, comments = row
+        return updated_at, hash, json.loads(comments) if comments is not None else None
+
+    def save_issue(self, number, updated_at, hash=None, comments=None):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "insert or replace into issues (number, updated_at, content_hash, comments) values (?, ?, ?, ?)",
+                (number, updated_at, hash, json.dumps(comments) if comments is not None else None),
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+class IssueSync:
+    """
+    Fetches the open issues of a repository, along with their comments.
+
+    With a store, the sync is incremental: only issues updated since the
+    last sync are listed (using the `since` parameter), requests are made
+    conditional on the validators of earlier responses, and an issue is
+    only returned if what would be rendered for it has changed. Call
+    `rendered()` once an issue has been rendered, and `finish()` once
+    the whole sync is done.
+
+    Without a store every open issue is returned, every time.
+
+    The comments of the issues in a page are fetched by `workers` threads
+    at once, sharing the session's connection pool.
+    """
+
+    def __init__(self, repo, store: IssueStore = None, session: requests.Session = None, api_url=API_URL, workers=1):
+        self.repo = repo
+        self.store = store
+        self.session = session or requests.Session()
+        self.api_url = api_url.rstrip('/')
+        self.workers = workers
+        self.latest = None
+        self.lock = threading.Lock()
+
+        # validators are only saved once what they validate has been, so
+        # that an interrupted sync can't leave stale data looking current
+        self.listing_validators = []
+        self.comment_validators = {}
+
+        self.requests = 0
+        self.not_modified = 0
+        self.skipped = 0
+
+    def pages(self) -> Iterator[List[Tuple[dict, list, str]]]:
+        """
+        Yield the new or changed issues one page at a time, as a list of
+        (issue, comments, content hash) for each page.
+        """
+        url = f"{self.api_url}/repos/{self.repo}/issues"
+        params = {'per_page': '100', 'state': 'open', 'sort': 'updated', 'direction': 'asc'}
+        since = self.store.get_state(f"since:{self.repo}") if self.store else None
+
+        if since:
+            params['since'] = since
+
+        while url:
+            response = self.get(url, params=params)
+
+            # nothing has changed since the last sync
+            if response is None:
+                return
+
+            self.listing_validators.append(self.validators_of(response))
+
+            if self.workers > 1:
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='martek-sync') as executor:
+                    results = list(executor.map(self.changed, response.json()))
+            else:
+                results = [self.changed(issue) for issue in response.json()]
+
+            yield [result for result in results if result is not None]
+
+            # the next page's URL already carries the query
+            url = response.links.get('next', {}).get('url')
+            params = None
+
+    def changed(self, issue):
+        number = issue['number']
+        updated_at = issue['updated_at']
+        stored = self.store.issue(number) if self.store else None
+
+        with self.lock:
+            if self.latest is None or updated_at > self.latest:
+                self.latest = updated_at
+
+        # `since` is inclusive, so the last issue of one sync is listed again by the next
+        if stored is not None and stored[0] == updated_at and stored[1] is not None:
+            self.count('skipped')
+            return None
+
+        comments = self.comments(issue, stored[2] if stored else None)
+        hash = content_hash(issue, comments)
+
+        if stored is not None and stored[1] == hash:
+            self.count('skipped')
+            self.rendered(issue, comments, hash)
+            return None
+
+        return issue, comments, hash
+
+    def comments(self, issue, stored_comments=None):
+        if issue['comments'] == 0:
+            return []
+
+        # the stored comments are only good for a conditional request
+        validate = stored_comments is not None
+        response = self.get(issue['comments_url'], conditional=validate)
+
+        if response is None:
+            return stored_comments
+
+        self.comment_validators[issue['number']] = self.validators_of(response)
+        return response.json()
+
+    def get(self, url, params=None, conditional=True) -> Optional[requests.Response]:
+        """
+        Make a GET request, conditional on the validators stored from the
+        last response for the same URL. Returns None if the response has
+        not been modified since then.
+        """
+        request_url = requests.Request('GET', url, params=params).prepare().url
+        headers = {}
+
+        if self.store and conditional:
+            etag, last_modified = self.store.validators(request_url)
+
+            if etag:
+                headers['If-None-Match'] = etag
+
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response = self.session.get(request_url, headers=headers)
+        self.count('requests')
+
+        if response.status_code == 304:
+            self.count('not_modified')
+            return None
+
+        if response.status_code != 200:
+            raise Exception("HTTP status {0} on fetching {1}".format(response.status_code, url))
+
+        return response
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @staticmethod
+    def validators_of(response):
+        return response.request.url, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+    def rendered(self, issue, comments, hash):
+        """
+        Record that an issue has been rendered, so that it is skipped until
+        it changes again.
+        """
+        if self.store:
+            self.store.save_issue(issue['number'], issue['updated_at'], hash, comments)
+
+            if (validators := self.comment_validators.pop(issue['number'], None)) is not None:
+                self.store.save_validators(*validators)
+
+    def finish(self):
+        """
+        Record the time of the most recently updated issue, so that the
+        next sync starts from there.
+        """
+        if not self.store:
+            return
+
+        for validators in self.listing_validators:
+            self.store.save_validators(*validators)
+
+        if self.latest is not None:
+            self.store.set_state(f"since:{self.repo}", self.latest)
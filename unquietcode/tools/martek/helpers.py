@@ -1,8 +1,115 @@
-import mistletoe
+import re
+import sys
+import threading
+
+from mistletoe import Document
 
 from . import LatexRenderer
 
 
+# mistletoe keeps the document being parsed in a global, so only one
+# document can be parsed at a time
+_parse_lock = threading.Lock()
+
+# mistletoe parses nested blocks recursively, a few frames for each level, so
+# documents nested deeper than this are parsed on a thread with room for it
+DEEP_NESTING = 100
+STACK_PER_LEVEL = 8 * 1024
+MIN_STACK_SIZE = 16 * 1024 * 1024
+
+NESTING_PATTERN = re.compile(r'[ \t>]*')
+
+
+def nesting_depth(lines) -> int:
+    """
+    An estimate of how deeply the blocks of a document are nested, from
+    the quote markers and indentation at the start of each line.
+    """
+    depth = 0
+
+    for line in lines:
+        prefix = NESTING_PATTERN.match(line).group()
+        depth = max(depth, prefix.count('>') + len(prefix.expandtabs(4)) // 2)
+
+    return depth
+
+
+def parse_markdown(lines):
+    """
+    Parse markdown (a string or an iterable of lines) into a document.
+
+    The interpreter's recursion limit is never changed here, and it bounds
+    how deeply a document can be nested, since mistletoe takes a few frames
+    for each level: with the default limit of 1000, lists can be nested
+    about 150 levels deep and quotes about 300. Deeper documents raise a
+    ValueError. An application which has to parse them can raise the limit
+    with sys.setrecursionlimit() at startup.
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines(keepends=True)
+    else:
+        lines = list(lines)
+
+    depth = nesting_depth(lines)
+
+    with _parse_lock:
+        try:
+            if depth <= DEEP_NESTING:
+                return Document(lines)
+
+            return _parse_nested(lines, depth)
+        except RecursionError:
+            raise ValueError(
+                f"markdown nested too deeply to parse within the recursion limit of {sys.getrecursionlimit()}"
+            ) from None
+
+
+def _parse_nested(lines, depth):
+    """
+    Parse a deeply nested document on a thread of its own, with a stack
+    large enough for the recursion limit to be reached before it overflows.
+    The stack size of new threads is process-wide, so it is only changed for
+    as long as it takes to start the thread.
+    """
+    result = {}
+
+    def parse():
+        try:
+            result['document'] = Document(lines)
+        except BaseException as ex:
+            result['error'] = ex
+
+    stack_size = threading.stack_size(max(MIN_STACK_SIZE, depth * STACK_PER_LEVEL))
+
+    try:
+        thread = threading.Thread(target=parse, name='martek-parse')
+        thread.start()
+    finally:
+        threading.stack_size(stack_size)
+
+    thread.join()
+
+    if 'error' in result:
+        raise result['error']
+
+    return result['document']
+
+
 def render_markdown(text):
-    rendered = mistletoe.markdown(text, LatexRenderer)
-    return rendered
\ No newline at end of file
+    with LatexRenderer() as renderer:
+        return renderer.render(parse_markdown(text))
+
+
+def write_markdown(lines, stream, **options):
+    with LatexRenderer(stream=stream, **options) as renderer:
+        renderer.render(parse_markdown(lines))
+
+
+def write_documents(documents, stream, toc=False, bookmarks=True, **options):
+    """
+    Write many (title, markdown) documents to a stream as a single LaTeX
+    document, one after the other.
+    """
+    with LatexRenderer(stream=stream, **options) as renderer:
+        documents = [(title, parse_markdown(markdown)) for title, markdown in documents]
+        renderer.render_documents(documents, toc=toc, bookmarks=bookmarks)
\ No newline at end of file
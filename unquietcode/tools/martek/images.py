@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import mkstemp
+from typing import Dict, Iterable
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+IMAGE_PATTERN = re.compile(r'\!\[(.*?)\]\((.*?)\)')
+
+# responses worth trying again, rather than failing the image outright
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def find_image_urls(markdown: str):
+    return [match.group(2) for match in IMAGE_PATTERN.finditer(markdown)]
+
+
+def image_filename(url, images_directory):
+    """
+    The local path for an image, named after the MD5 sum of its URL and
+    keeping the URL's extension.
+    """
+    hashed_url = hashlib.md5(url.encode('utf-8')).hexdigest()
+    extension = os.path.splitext(url)[1]
+
+    if not extension:
+        raise Exception("No extension at the end of {0}".format(url))
+
+    return os.path.join(images_directory, hashed_url) + extension
+
+
+def replace_images(markdown: str, paths: Dict[str, str]) -> str:
+    """
+    Rewrite the images in a markdown string to refer to their local
+    copies, leaving any which were not downloaded as they are.
+    """
+    def replace(match):
+        caption, url = match.group(1), match.group(2)
+
+        if url not in paths:
+            return match.group(0)
+
+        return "![{0}]({1})".format(caption, paths[url])
+
+    return IMAGE_PATTERN.sub(replace, markdown)
+
+
+class ImageFetcher:
+    """
+    Downloads images into a directory, naming each one after the MD5 sum
+    of its URL. Images are fetched concurrently over a single pooled
+    session, with failed requests retried after a backoff.
+
+    An image which is already in the directory is not downloaded again,
+    unless `revalidate` is set, in which case the server is asked whether
+    it has changed using the ETag and Last-Modified headers saved with it.
+    """
+
+    def __init__(self, images_directory, workers=8, retries=3, backoff=0.5, timeout=30, revalidate=False, headers=None):
+        self.images_directory = images_directory
+        self.workers = workers
+        self.timeout = timeout
+        self.revalidate = revalidate
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=['GET'],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update(headers or {})
+
+        os.makedirs(images_directory, exist_ok=True)
+
+    def prefetch(self, urls: Iterable[str]):
+        """
+        Download every image in the list at once, returning the local paths
+        of those which succeeded and the errors of those which did not, as
+        two dictionaries keyed by URL.
+        """
+        urls = list(dict.fromkeys(urls))
+        paths: Dict[str, str] = {}
+        errors: Dict[str, Exception] = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='martek-images') as executor:
+            futures = {url: executor.submit(self.fetch, url) for url in urls}
+
+            for url, future in futures.items():
+                try:
+                    paths[url] = future.result()
+                except Exception as ex:
+                    errors[url] = ex
+
+        return paths, errors
+
+    def fetch(self, url) -> str:
+        """
+        Download a single image, returning its local path.
+        """
+        path = image_filename(url, self.images_directory)
+        metadata_path = path + '.json'
+        exists = os.path.exists(path)
+
+        if exists and not self.revalidate:
+            return path
+
+        headers = {}
+
+        if exists and os.path.exists(metadata_path):
+            with open(metadata_path, 'r') as metadata_file:
+                metadata = json.load(metadata_file)
+
+            if etag := metadata.get('etag'):
+                headers['If-None-Match'] = etag
+
+            if last_modified := metadata.get('last_modified'):
+                headers['If-Modified-Since'] = last_modified
+
+        with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+            if response.status_code == 304:
+                return path
+
+            response.raise_for_status()
+            self.write(path, response.iter_content(64 * 1024))
+
+            metadata = {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+
+        self.write(metadata_path, [json.dumps(metadata).encode('utf-8')])
+        return path
+
+    @staticmethod
+    def write(path, chunks):
+        # write beside the target and rename it into place, so that a failed
+        # download never leaves a partial image in the cache
+        directory, name = os.path.split(path)
+        fd, tmp_path = mkstemp(dir=directory, prefix=f".{name}.", suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                for chunk in chunks:
+                    tmp_file.write(chunk)
+
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+            raise
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, traceback):
+        self.close()
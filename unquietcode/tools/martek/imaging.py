@@ -0,0 +1,142 @@
+import hashlib
+import io
+import os
+import threading
+from tempfile import mkstemp
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# the text block of the article class (345pt by 550pt), which images are scaled to fit
+TEXT_WIDTH_INCHES = 345 / 72.27
+TEXT_HEIGHT_INCHES = 550 / 72.27
+
+CACHE_DIRECTORY = '.martek-images'
+
+# formats which are kept as they are, and formats which the engine can't include
+KEEP_FORMATS = {'JPEG': '.jpg', 'PNG': '.png'}
+VECTOR_EXTENSIONS = {'.pdf', '.eps', '.ps', '.svg'}
+
+
+class ImageOptimizer:
+    """
+    Makes copies of images which are no larger than they will appear on the
+    page at the given DPI, recompressed, so that the engine has less to read
+    and the PDF less to embed. Copies are named after a hash of the original
+    image and the settings, in a cache directory under the image directory.
+
+    Pillow is needed to do any of this. Without it, and for images which
+    can't be improved (vector images, remote images), the original is used.
+    """
+
+    def __init__(self, image_dir, dpi=150, jpeg_quality=85):
+        self.image_dir = image_dir
+        self.dpi = dpi
+        self.jpeg_quality = jpeg_quality
+        self.directory = os.path.join(image_dir, CACHE_DIRECTORY)
+        self.lock = threading.Lock()
+
+        self.images = 0
+        self.original_bytes = 0
+        self.optimized_bytes = 0
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def optimize(self, src):
+        """
+        Return the path of the optimized copy of an image, creating it if
+        needed, or None if the original should be used.
+        """
+        if Image is None or '://' in src:
+            return None
+
+        path = src if os.path.isabs(src) else os.path.join(self.image_dir, src)
+
+        if os.path.splitext(path)[1].lower() in VECTOR_EXTENSIONS or not os.path.isfile(path):
+            return None
+
+        with open(path, 'rb') as image_file:
+            data = image_file.read()
+
+        digest = hashlib.sha256(data)
+        digest.update(f"\n{self.dpi}:{self.jpeg_quality}".encode('utf-8'))
+        key = digest.hexdigest()
+
+        for extension in KEEP_FORMATS.values():
+            if os.path.exists(cached := os.path.join(self.directory, key + extension)):
+                self.count(len(data), os.path.getsize(cached))
+                return cached
+
+        try:
+            return self.create(data, path, key)
+        except (OSError, Image.DecompressionBombError):
+            return None
+
+    def create(self, data, path, key):
+        max_size = (round(self.dpi * TEXT_WIDTH_INCHES), round(self.dpi * TEXT_HEIGHT_INCHES))
+
+        with Image.open(io.BytesIO(data)) as image:
+            image_format = image.format
+            image.load()
+
+        if image.width > max_size[0] or image.height > max_size[1]:
+            image.thumbnail(max_size, Image.LANCZOS)
+
+        # anything the engine can't read well (GIF, BMP, WebP...) becomes a PNG
+        extension = KEEP_FORMATS.get(image_format, '.png')
+
+        if extension == '.jpg':
+            if image.mode not in ('RGB', 'L', 'CMYK'):
+                image = image.convert('RGB')
+
+            options = {'format': 'JPEG', 'quality': self.jpeg_quality, 'optimize': True, 'progressive': True}
+        else:
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P', '1'):
+                image = image.convert('RGBA')
+
+            options = {'format': 'PNG', 'optimize': True}
+
+        os.makedirs(self.directory, exist_ok=True)
+        target = os.path.join(self.directory, key + extension)
+        fd, tmp_path = mkstemp(dir=self.directory, prefix=f".{key}.", suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                image.save(tmp_file, **options)
+
+            # keep the original when it's already as small as it's going to get
+            original_extension = os.path.splitext(path)[1].lower().replace('.jpeg', '.jpg')
+
+            if os.path.getsize(tmp_path) >= len(data) and original_extension == extension:
+                with open(tmp_path, 'wb') as tmp_file:
+                    tmp_file.write(data)
+
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+            raise
+
+        self.count(len(data), os.path.getsize(target))
+        return target
+
+    def count(self, original_size, optimized_size):
+        with self.lock:
+            self.images += 1
+            self.original_bytes += original_size
+            self.optimized_bytes += optimized_size
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'images': self.images,
+                'original_bytes': self.original_bytes,
+                'optimized_bytes': self.optimized_bytes,
+            }
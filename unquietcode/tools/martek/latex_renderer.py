@@ -2,11 +2,16 @@ import os
 import re
 from contextlib import contextmanager
 from functools import reduce
+from types import GeneratorType
 from typing import List
 
 from mistletoe.base_renderer import BaseRenderer
 
-from .elements import Block, Span, Container
+from .cache import RenderCache, block_key
+from .elements import Block, Span, Container, render_element
+from .escaping import escape_latex
+from .imaging import ImageOptimizer
+from .profiling import RenderProfile
 
 # 'Document':       self.render_document,
 # 'Strong':         self.render_strong,
@@ -38,19 +43,9 @@ from .elements import Block, Span, Container
 PREAMBLE = """
 \\documentclass{article}
 
-%-PACKAGES-%
-
 \\usepackage{mdframed}
 \\usepackage{ulem}
 \\usepackage{xcolor}
-\\lstset{
-  basicstyle=\\ttfamily,
-  columns=fullflexible,
-  frame=single,
-  breaklines=true,
-  postbreak=\\mbox{\\textcolor{red}{$\\hookrightarrow$}\\space},
-  backgroundcolor=\colorgray!10
-}
 \\usepackage{etoolbox}
 \\usepackage{fancyvrb}
 \\usepackage{xunicode}
@@ -62,6 +57,11 @@ PREAMBLE = """
 \\usepackage{cprotect}
 \\usepackage{framed}
 
+% everything above can be precompiled into a format (fonts and the packages of each document are not)
+\\csname endofdump\\endcsname
+
+%-PACKAGES-%
+
 \\usepackage{xltxtra}
 \\setmainfont{FreeSerif}
 \\setmonofont{FreeMono}
@@ -93,16 +93,49 @@ PREAMBLE = """
 
 POSTAMBLE = "\\end{document}"
 
-PACKAGES = {}
+# ends a paragraph or block which is followed by text, leaving a blank line between
+PARAGRAPH_BREAK = "\\mbox{}\\\\"
 
-def packages(**packages):
-    for k, v in packages.items():
-        if k in PACKAGES:
-            PACKAGES[k].extend(v)
-        else:
-            PACKAGES[k] = v
+# top-level blocks which are set apart from a paragraph or block before them
+HEADINGS = {'Heading', 'SetextHeading'}
+FOLLOWS_PARAGRAPH = {'Paragraph', 'List'} | HEADINGS
+
+# how the rows of a table are laid out, and how often those of a long table are written out when streaming
+TABLE_BACKENDS = ('tabular', 'longtable')
+TABLE_FLUSH_ROWS = 1000
+
+# how code is typeset, and the number of lines (some forty pages) beyond which a code block is split
+CODE_BACKENDS = ('listings', 'verbatim')
+CODE_CHUNK_LINES = 2000
+
+# setup for optional packages, added to the preamble after they are loaded
+PACKAGE_SETUP = {
+    'listings': """
+\\lstset{
+  basicstyle=\\ttfamily,
+  columns=fullflexible,
+  frame=single,
+  breaklines=true,
+  postbreak=\\mbox{\\textcolor{red}{$\\hookrightarrow$}\\space},
+  backgroundcolor=\colorgray!10
+}
+"""[1:-1],
+}
+
+def merge_packages(packages, more_packages):
+    for package, options in more_packages.items():
+        package_options = packages.setdefault(package, [])
+        package_options.extend(_ for _ in options if _ not in package_options)
     
+    return packages
+
+def packages(**packages):
+    """
+    Declare the packages (and their options) which a render method needs.
+    Only the packages needed by a document are loaded in its preamble.
+    """
     def wrapper(fn):
+        fn.packages = packages
         return fn
     
     return wrapper
@@ -124,29 +157,150 @@ def italics(text):
 def strikethrough(text):
     return f"\\sout{{{text}}}"
 
+def section(text):
+    return f"{{\\section*{{{text}}}}}"
+
+def subsection(text):
+    return f"{{\\subsection*{{{underlined(text)}}}}}"
+
+def subsubsection(text):
+    return f"{{\\subsubsection*{{{text}}}}}"
+
+def inline_code(text):
+    return f"\\colorbox{{code-background}}{{\\texttt{{{text}}}}}"
+
+def table_row(text):
+    return text + ' \\\\'
+
+def coalesce(text):
+    if not text.strip():
+        return '---'
+    else:
+        return text
+
+def replace_checkboxes(text):
+    text = re.sub(r'^(\s*)\[x]', r'\1\\checkedbox{}', text)
+    text = re.sub(r'^(\s*)\[ ]', r'\1\\uncheckedbox{}', text)
+    return text
+
 def compose(*functions):
     return reduce(lambda f, g: lambda x: f(g(x)), functions, lambda x: x)
 
+# actions are shared by every span which uses them, rather than made for each one
+list_item = compose(coalesce, replace_checkboxes)
 
 class LatexRenderer(BaseRenderer):
 
-    def __init__(self, image_dir: str = None):
+    def __init__(
+        self,
+        image_dir: str = None,
+        stream=None,
+        cache: RenderCache = None,
+        profile: RenderProfile = None,
+        image_dpi: int = None,
+        table_backend: str = 'tabular',
+        code_backend: str = 'listings',
+        code_chunk_lines: int = CODE_CHUNK_LINES,
+    ):
         super().__init__()
-        self.stack: List[Container] = [Block()]
+        self.stream = stream
+        self.cache = cache
+        
+        if table_backend not in TABLE_BACKENDS:
+            raise ValueError(f"unknown table backend '{table_backend}', expected one of {', '.join(TABLE_BACKENDS)}")
+        
+        if table_backend == 'longtable':
+            self.render_map['Table'] = self.render_longtable
+        
+        if code_backend not in CODE_BACKENDS:
+            raise ValueError(f"unknown code backend '{code_backend}', expected one of {', '.join(CODE_BACKENDS)}")
+        
+        if code_backend == 'verbatim':
+            self.render_map['CodeFence'] = self.render_verbatim_code
+            self.render_map['BlockCode'] = self.render_verbatim_code
+        
+        self.code_chunk_lines = code_chunk_lines
+        
+        if profile is not None:
+            profile.instrument(self)
         
         if image_dir is not None and (image_dir := image_dir.strip()):
             self.image_dir = os.path.abspath(image_dir)
         else:
             self.image_dir = os.path.abspath(os.getcwd())
         
-        # replace render method with custom wrapper
-        old_render = self.render
+        # images can be swapped for copies scaled down to this resolution on the page
+        self.images = ImageOptimizer(self.image_dir, dpi=image_dpi) if image_dpi else None
         
-        def render(token):
-            result = old_render(token)
+        # options which change the output, and so must be part of its key in the cache
+        salt = []
+        
+        if image_dpi:
+            salt.append(f"image_dpi={image_dpi}")
+        
+        if table_backend != 'tabular':
+            salt.append(f"table_backend={table_backend}")
+        
+        if code_backend != 'listings':
+            salt.append(f"code_backend={code_backend}")
+        
+        if code_chunk_lines != CODE_CHUNK_LINES:
+            salt.append(f"code_chunk_lines={code_chunk_lines}")
+        
+        self.cache_salt = ','.join(salt)
+        
+        self.reset()
+    
+    
+    def reset(self):
+        """
+        Clear all of the state left over from rendering a document, so
+        that the renderer can be used again.
+        """
+        self.stack: List[Container] = [Block()]
+        self.blocks: List[Block] = [self.stack[0]]
+        self.paragraph = None
+        self.document_start = None
+        self.packages = {}
+        self.volatile = False
+        self.flush = None
+        self.flushed = 0
+    
+    
+    def render(self, token):
+        """
+        Render a token and everything inside it. A render method which has
+        tokens inside it yields them, and is resumed once they have been
+        rendered, so that nesting is handled with an explicit stack rather
+        than by recursion.
+        """
+        result = self.render_token(token)
+        
+        if type(result) is not GeneratorType:
             return result or ''
         
-        self.render = render
+        stack = [(result, iter(()))]
+        
+        while stack:
+            generator, children = stack[-1]
+            
+            for child in children:
+                result = self.render_token(child)
+                
+                if type(result) is GeneratorType:
+                    stack.append((result, iter(())))
+                    break
+            else:
+                try:
+                    stack[-1] = (generator, iter(next(generator)))
+                except StopIteration:
+                    stack.pop()
+        
+        return ''
+    
+    
+    def render_token(self, token):
+        return self.render_map[token.__class__.__name__](token)
 
 
     def push(self, *elements):
@@ -180,38 +334,177 @@ class LatexRenderer(BaseRenderer):
         if string is not None:
             block.prefix = string
         
-        # need to un-nest
-        for idx in reversed(range(len(self.stack))):
-            element = self.stack[idx]
-            
-            if type(element) is Block:
-                element.push(block)
-                break
-
+        # need to un-nest, since blocks can only be inside other blocks
+        self.blocks[-1].push(block)
+        self.blocks.append(block)
         self.stack.append(block)
         return block
     
     
     def end_block(self, string: str = None):
         block = self.pop()
+        self.blocks.pop()
         
         if string is not None:
             block.suffix = string
+    
+    
+    def start_paragraph(self):
+        """
+        Separate a paragraph or heading from the paragraph or top-level
+        block directly preceding it in the same block, with a blank line.
+        Blocks which are not top-level supply their own spacing, so
+        anything in between cancels the break.
+        """
+        paragraph, self.paragraph = self.paragraph, None
+        
+        if paragraph is None:
+            return
+        
+        container, index = paragraph
+        
+        if container is not self.stack[-1]:
+            return
+        
+        for element in container.elements[index + 1:]:
+            if type(element) is not str or element.strip():
+                return
+        
+        # the break goes before any newlines at the end of the element
+        element = container.elements[index]
+        text = element if type(element) is str else render_element(element)
+        end = len(text.rstrip('\n'))
+        container.elements[index] = text[:end] + PARAGRAPH_BREAK + text[end:]
+    
+    
+    def end_paragraph(self):
+        container = self.stack[-1]
+        
+        if type(container) is Block and container.elements:
+            self.paragraph = (container, len(container.elements) - 1)
+        
+        self.push('')
+    
+    
+    def end_top_block(self, start):
+        """
+        Mark the last element written by a top-level block as taking a
+        break if a paragraph follows it, when the block is followed by a
+        blank line (so not a heading, or a quote).
+        """
+        container = self.stack[-1]
+        elements = container.elements
+        index = len(elements) - 1
+        
+        while index >= start and elements[index] == '':
+            index -= 1
+        
+        self.paragraph = None
+        
+        if index < start:
+            return
+        
+        if index == len(elements) - 1:
+            element = elements[index]
+            end = element if type(element) is str else getattr(element, 'suffix', None)
+            
+            if not end or not end.endswith('\n'):
+                return
+        
+        self.paragraph = (container, index)
+
 
     ########################################################################
     
     def render_document(self, token):
+        self.reset()
+        self.packages = self.document_packages(token)
         
-        def newlines(text):
-            # replacement = uuid.uuid4().hex
-            # text = re.sub(r'^\\\\$', replacement, text, flags=re.MULTILINE)
-            text = re.sub(r'(\S+)\n{2,}(\s*[^\\]\S+)', r'\1\\mbox{}\\\\\n\n\2', text, flags=re.MULTILINE)
-            # text = re.sub(replacement, '', text, flags=re.MULTILINE)
-            return text
-
+        return self.render_body(token.children)
+    
+    
+    def render_documents(self, documents, toc=False, bookmarks=False):
+        """
+        Render many (title, document) pairs as one LaTeX document, each
+        starting on a new page, with the packages of every document merged
+        into a single preamble. Each document can be given a PDF bookmark,
+        and listed in a table of contents (which takes two runs of the
+        engine to fill in).
+        """
+        documents = list(documents)
+        self.reset()
+        
+        packages = {}
+        
+        for _, document in documents:
+            merge_packages(packages, self.document_packages(document))
+        
+        if toc or bookmarks:
+            merge_packages(packages, {'hyperref': [], 'bookmark': []})
+        
+        self.packages = dict(sorted(packages.items()))
+        return self.render_body(self.combined_blocks(documents, toc, bookmarks))
+    
+    
+    def render_sections(self, sections):
+        """
+        Render a document which has been split into sections (lists of
+        top-level blocks) to be compiled as separate files. Returns the
+        preamble, with the packages of every section, and the LaTeX of
+        each section.
+        """
+        sections = [list(blocks) for blocks in sections]
+        self.reset()
+        
+        packages = {}
+        
+        for blocks in sections:
+            for block in blocks:
+                merge_packages(packages, self.document_packages(block))
+        
+        self.packages = dict(sorted(packages.items()))
+        bodies = []
+        
+        for blocks in sections:
+            self.paragraph = None
+            section = self.start_block()
+            
+            for block in blocks:
+                self.render_block(block)
+            
+            self.end_block()
+            self.stack[0].elements.clear()
+            bodies.append(render_element(section, indent=-1))
+        
+        return self.preamble(), bodies
+    
+    
+    @staticmethod
+    def combined_blocks(documents, toc, bookmarks):
+        if toc:
+            yield "\\tableofcontents\n\\clearpage"
+        
+        for idx, (title, document) in enumerate(documents):
+            title = escape_latex(title)
+            
+            if idx > 0:
+                yield "\\clearpage"
+            
+            # table of contents entries are bookmarked by hyperref already
+            if toc:
+                yield f"\\phantomsection\\addcontentsline{{toc}}{{section}}{{{title}}}"
+            elif bookmarks:
+                yield f"\\pdfbookmark[0]{{{title}}}{{document.{idx + 1}}}"
+            
+            yield from document.children
+    
+    
+    def preamble(self):
         packages = '\n'.join([
-            f'\\usepackage{options or ""}{{{package}}}'
-            for package, options in PACKAGES.items()
+            f'\\usepackage[{",".join(options)}]{{{package}}}' if options else f'\\usepackage{{{package}}}'
+            for package, options in self.packages.items()
+        ] + [
+            PACKAGE_SETUP[package] for package in self.packages if package in PACKAGE_SETUP
         ])
         preamble = PREAMBLE.replace('%-PACKAGES-%', packages)
         
@@ -221,16 +514,145 @@ class LatexRenderer(BaseRenderer):
             ]))
         else:
             preamble = preamble.replace('%-RESOURCES-%', "")
+        
+        return preamble
+    
+    
+    def render_body(self, blocks):
+        """
+        Render the top-level blocks of a document (tokens, or strings of
+        LaTeX) between the preamble and the postamble.
+        """
+        preamble = self.preamble()
+        
+        if self.stream is not None:
+            return self.write_document(blocks, preamble)
 
-        self.start_block(action=newlines)
+        self.start_block()
         self.push(preamble, "\n")
-        self.render_inner(token)
+        self.paragraph = self.document_start = (self.stack[-1], 0)
+        
+        for block in blocks:
+            self.render_block(block)
+        
         self.push(POSTAMBLE)
         self.end_block()
 
         return self.stack[0].render(indent=-2)
+    
+    
+    def write_document(self, blocks, preamble):
+        """
+        Render the document directly to the output stream, writing each
+        top-level element as soon as it is complete rather than holding
+        on to the entire tree.
+        """
+        document = self.start_block()
+        written = False
+        
+        def flush():
+            nonlocal written
+            
+            # only whole top-level elements can be written out
+            if self.stack[-1] is not document:
+                return
+            
+            # part of the current block is about to be written, so it can't be cached
+            self.volatile = True
+            end = len(document.elements)
+            
+            # hold back the end of a block which may still need a break
+            if self.paragraph is not None and self.paragraph[0] is document:
+                end = self.paragraph[1]
+                self.paragraph = (document, 0)
+            
+            for element in document.elements[:end]:
+                if written:
+                    self.stream.write("\n")
+                
+                self.stream.write(render_element(element))
+                written = True
+            
+            del document.elements[:end]
+            self.flushed += end
+        
+        self.push(preamble, "\n")
+        self.paragraph = self.document_start = (document, 0)
+        self.flush = flush
+        
+        for block in blocks:
+            self.render_block(block)
+            flush()
+        
+        self.flush = None
+        self.paragraph = None
+        self.push(POSTAMBLE)
+        flush()
+        self.end_block()
+        
+        return ''
 
 
+    def document_packages(self, document):
+        """
+        Collect the packages declared by the render methods of every token
+        in the document, so the preamble only loads what the document uses.
+        """
+        packages = {}
+        stack = [document]
+        
+        while stack:
+            token = stack.pop()
+            render_function = self.render_map.get(type(token).__name__)
+            merge_packages(packages, getattr(render_function, 'packages', {}))
+            
+            stack.extend(getattr(token, 'children', None) or ())
+            
+            if (header := getattr(token, 'header', None)) is not None:
+                stack.append(header)
+        
+        return dict(sorted(packages.items()))
+    
+    
+    def render_block(self, token):
+        """
+        Render a top-level block, reusing its output from the cache
+        when the same block has been rendered before. A string is taken
+        to be LaTeX, and is added as it is.
+        """
+        if type(token) is str:
+            self.paragraph = None
+            self.push(token)
+            return
+        
+        name = type(token).__name__
+        container = self.stack[-1]
+        start = len(container.elements)
+        flushed = self.flushed
+        
+        # the first block of a document is set apart from the top of the page, whatever it is
+        if name in FOLLOWS_PARAGRAPH or self.paragraph is self.document_start:
+            self.start_paragraph()
+        
+        if self.cache is None:
+            self.render(token)
+        
+        elif (rendered := self.cache.get(key := block_key(token, self.cache_salt))) is not None:
+            self.push(*rendered)
+        
+        else:
+            self.volatile = False
+            self.render(token)
+            
+            # output which depends on more than the tokens can't be reused
+            if not self.volatile:
+                rendered = [render_element(_) for _ in container.elements[start:]]
+                self.cache.put(key, rendered)
+        
+        # the start of a block which has been partly written out has moved
+        self.end_top_block(max(0, start - (self.flushed - flushed)))
+    
+    
     def render_to_plain(self, token):
         if hasattr(token, 'children'):
             inner = [self.render_to_plain(child) for child in token.children]
@@ -240,42 +662,31 @@ class LatexRenderer(BaseRenderer):
     
     
     def render_raw_text(self, token):
-        rtn = self.render_to_plain(token)
-
-        rtn = re.sub(r'((?<!\\)[#$%&_{}\\])', r'\\\1', rtn)
-        rtn = re.sub(r'((?<!\\)~)', r'\\textasciitilde{}', rtn)
-        rtn = re.sub(r'((?<!\\)\^)', r'\\textasciicircum{}', rtn)
-        rtn = re.sub(r'(\\\\)', r'\\textbackslash{}', rtn)
-
-        self.push(rtn)
+        self.push(escape_latex(token.content))
     
     # inline styles
     
     def render_strong(self, token):
         with self.span(bold):
-            self.render_inner(token)
+            yield token.children
 
 
     def render_emphasis(self, token):
         with self.span(italics):
-            self.render_inner(token)
+            yield token.children
 
 
     def render_strikethrough(self, token):
         with self.span(strikethrough):
-            self.render_inner(token)
+            yield token.children
     
 
     def render_inline_code(self, token):
-        def colorbox(text):
-            return f"\\colorbox{{code-background}}{{\\texttt{{{text}}}}}"
-        
-        with self.span(colorbox):
-            self.render_inner(token)
+        with self.span(inline_code):
+            yield token.children
 
 
     def render_line_break(self, token):
-        print("NEWLINE")
         if token.soft:
             self.push('\\\\')
         # else:
@@ -290,33 +701,44 @@ class LatexRenderer(BaseRenderer):
             return f'\\href{{{token.target}}}{{{text}}}'
         
         with self.span(href):
-            self.render_inner(token)
+            yield token.children
     
     
+    @packages(hyperref=[])
     def render_auto_link(self, token):
         self.push(f'\\url{{{token.target}}}')
 
     
     @packages(graphicx=[])
     def render_image(self, token):
-        self.push(f'\\includegraphics[width=\\textwidth,height=\\textheight,keepaspectratio]{{{token.src}}}', '')
+        src = token.src
+        
+        if self.images is not None:
+            src = self.images.optimize(src) or src
+            
+            # the optimized copy is named after the contents of the image
+            self.volatile = True
+        
+        self.push(f'\\includegraphics[width=\\textwidth,height=\\textheight,keepaspectratio]{{{src}}}', '')
 
 
     def render_heading(self, token):
         if token.level == 1:
-            heading = lambda text: f"{{\\section*{{{text}}}}}"
+            heading = section
 
         elif token.level == 2:
-            heading = lambda text: f"{{\\subsection*{{{underlined(text)}}}}}"
+            heading = subsection
         
         elif token.level >= 3:
-            heading = lambda text: f"{{\\subsubsection*{{{text}}}}}"
+            heading = subsubsection
        
         else:
-            heading = lambda text: f"{underlined(text)}"
+            heading = underlined
 
+        self.start_paragraph()
+        
         with self.span(heading):
-            self.render_inner(token)
+            yield token.children
         
     
     @staticmethod
@@ -339,62 +761,79 @@ class LatexRenderer(BaseRenderer):
     
     
     def render_paragraph(self, token):
-        self.render_inner(token)
-        self.push('')
+        self.start_paragraph()
+        yield token.children
+        self.end_paragraph()
 
     
     def render_quote(self, token):
         self.start_block('\\begin{leftbar}{\\color{gray}')
-        self.render_inner(token)
+        yield token.children
         self.end_block('}\\end{leftbar}')
     
     
-    @packages(listings=[])
     def render_list(self, token):
         tag = 'enumerate' if token.start is not None else 'itemize'
         
         self.push('')
         self.start_block(f"\\begin{{{tag}}}")
-        self.render_inner(token)
+        yield token.children
         self.end_block(f"\\end{{{tag}}}")
         self.push('')
     
         
     def render_list_item(self, token):
-        
-        def coalesce(text):
-            if not text.strip():
-                return '---'
-            else:
-                return text
-       
-        def replace_checkboxes(text):
-            text = re.sub(r'^(\s*)\[x]', r'\1\\checkedbox{}', text)
-            text = re.sub(r'^(\s*)\[ ]', r'\1\\uncheckedbox{}', text)
-            return text
-       
         with self.span():
             self.push("\\item ")
             
-            with self.span(compose(coalesce, replace_checkboxes)):
-                self.render_inner(token)
+            with self.span(list_item):
+                yield token.children
 
       
     @packages(listings=[])
     def render_block_code(self, token):
-        self.start_block("\\begin{lstlisting}[backgroundcolor = \\color{gray!10}]", deindent=True)
-        self.render_inner(token)
-        self.end_block("\\end{lstlisting}\n")
-
+        for chunk in self.code_chunks(token):
+            self.start_block("\\begin{lstlisting}[backgroundcolor = \\color{gray!10}]", deindent=True)
+            self.push(escape_latex(chunk))
+            self.end_block("\\end{lstlisting}\n")
+    
+    
+    def render_verbatim_code(self, token):
+        """
+        Code typeset by fancyvrb, which reads each line as it is rather
+        than tokenizing every character as listings does, and so is much
+        faster to compile (though long lines are not broken).
+        """
+        for chunk in self.code_chunks(token):
+            self.start_block("\\begin{Verbatim}[frame=single]", deindent=True)
+            self.push(chunk[:-1] if chunk.endswith('\n') else chunk)
+            self.end_block("\\end{Verbatim}\n")
+    
+    
+    def code_chunks(self, token):
+        """
+        Split the code of a very long code block (a log dump, say) into
+        chunks, each typeset as an environment of its own so that TeX never
+        holds all of it at once. Ordinary code blocks are left whole. When
+        streaming, each chunk is written out before the next one is rendered.
+        """
+        self.paragraph = None
+        code = self.render_to_plain(token)
+        lines = code.splitlines(keepends=True)
+        
+        if len(lines) <= self.code_chunk_lines:
+            yield code
+            return
+        
+        for start in range(0, len(lines), self.code_chunk_lines):
+            if start > 0 and self.flush is not None:
+                self.flush()
+            
+            yield ''.join(lines[start:start + self.code_chunk_lines])
 
-    def render_table(self, token):
-        def render_align(column_align):
-            if column_align != [None]:
-                cols = [get_align(col) for col in token.column_align]
-                return '{{{}}}'.format(' '.join(cols))
-            else:
-                return ''
 
+    @staticmethod
+    def table_align(token):
         def get_align(col):
             if col is None:
                 return 'l'
@@ -402,24 +841,56 @@ class LatexRenderer(BaseRenderer):
                 return 'c'
             elif col == 1:
                 return 'r'
-            raise RuntimeError('Unrecognized align option: ' + col)
-
-        template = ('\\begin{{tabular}}{align}\n'
-                    '{inner}'
-                    '\\end{{tabular}}\n')
+            raise RuntimeError('Unrecognized align option: ' + str(col))
+        
+        return '{{{}}}'.format(' '.join(get_align(col) for col in token.column_align))
+    
+    
+    def render_table(self, token):
+        self.paragraph = None
+        self.start_block(f"\\begin{{tabular}}{self.table_align(token)}")
+        
+        if hasattr(token, 'header'):
+            yield token.header,
+            self.push('\\hline')
+        
+        yield token.children
+        self.end_block("\\end{tabular}\n")
+    
+    
+    @packages(longtable=[])
+    def render_longtable(self, token):
+        """
+        A table which can break across pages, repeating its header at the
+        top of each one. The rows are added to the enclosing block rather
+        than to a block of their own, so that when the document is being
+        streamed they are written out as they are rendered.
+        """
+        self.paragraph = None
+        self.push(f"\\begin{{longtable}}{self.table_align(token)}")
+        
         if hasattr(token, 'header'):
-            head_template = '{inner}\\hline\n'
-            head_inner = self.render_table_row(token.header)
-            head_rendered = head_template.format(inner=head_inner)
-        else: head_rendered = ''
-        inner = self.render_inner(token)
-        align = render_align(token.column_align)
-        self.push(template.format(inner=head_rendered+inner, align=align))
+            yield token.header,
+            self.push('\\hline', '\\endhead')
+        
+        for idx, row in enumerate(token.children, 1):
+            yield row,
+            
+            if self.flush is not None and idx % TABLE_FLUSH_ROWS == 0:
+                self.flush()
+        
+        self.push("\\end{longtable}\n")
 
 
     def render_table_row(self, token):
-        cells = [self.render(child) for child in token.children]
-        return ' & '.join(cells) + ' \\\\\n'
+        with self.span(table_row):
+            for idx, child in enumerate(token.children):
+                if idx > 0:
+                    self.push(' & ')
+                
+                yield child,
+
 
     def render_table_cell(self, token):
-        return self.render_inner(token)
+        with self.span():
+            yield token.children
@@ -0,0 +1,69 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+from .helpers import parse_markdown
+from .latex_renderer import LatexRenderer
+
+
+class RendererPool:
+    """
+    A pool of reusable renderers, so that a multithreaded service can
+    render many documents at once without constructing a renderer for
+    every request. Each renderer is used by only one thread at a time,
+    and is reset before it goes back into the pool. At most `size`
+    renderers are created (4 by default); once they are all in use,
+    further threads wait for one to be returned.
+    """
+
+    def __init__(self, size=4, **options):
+        self.size = size
+        self.options = options
+        self.renderers = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def renderer(self):
+        renderer = self.acquire()
+
+        try:
+            yield renderer
+        finally:
+            renderer.stream = None
+            renderer.reset()
+            self.renderers.put(renderer)
+
+    def acquire(self) -> LatexRenderer:
+        try:
+            return self.renderers.get_nowait()
+        except queue.Empty:
+            pass
+
+        # create renderers as needed, up to the size of the pool
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                return LatexRenderer(**self.options)
+
+        return self.renderers.get()
+
+    def render(self, markdown) -> str:
+        """
+        Render markdown (a string or an iterable of lines) to LaTeX.
+        """
+        document = parse_markdown(markdown)
+
+        with self.renderer() as renderer:
+            return renderer.render(document)
+
+    def write(self, markdown, stream):
+        """
+        Render markdown (a string or an iterable of lines) to LaTeX,
+        writing it directly to a text stream.
+        """
+        document = parse_markdown(markdown)
+
+        with self.renderer() as renderer:
+            renderer.stream = stream
+            renderer.render(document)
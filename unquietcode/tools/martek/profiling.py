@@ -0,0 +1,194 @@
+import time
+from collections import defaultdict
+from functools import wraps
+from types import GeneratorType
+
+from .elements import String
+
+
+class TokenStats:
+    __slots__ = ('calls', 'cumulative', 'self', 'actions', 'bytes', 'self_bytes')
+
+    def __init__(self):
+        self.calls = 0
+        self.cumulative = 0
+        self.self = 0
+        self.actions = 0
+        self.bytes = 0
+        self.self_bytes = 0
+
+
+class Frame:
+    __slots__ = ('name', 'start', 'pushed', 'children', 'child_bytes')
+
+    def __init__(self, name, start, pushed):
+        self.name = name
+        self.start = start
+        self.pushed = pushed
+        self.children = 0
+        self.child_bytes = 0
+
+
+class RenderProfile:
+    """
+    Records, for each type of token, how many were rendered, the time spent
+    in their render methods (cumulative and self), the time spent in the
+    actions they attached to their output, and the bytes of LaTeX they
+    produced (not counting indentation or text added by those actions).
+
+    A profile is opt-in: it is given to a renderer when it is created, and
+    wraps that renderer's dispatch in place. A renderer without a profile
+    runs exactly the same code as before, so there is no cost when it is
+    disabled. A profile should be used by one renderer at a time.
+    """
+
+    def __init__(self):
+        self.stats = defaultdict(TokenStats)
+        self.frames = []
+        self.active = defaultdict(int)
+        self.pushed = 0
+
+    def instrument(self, renderer):
+        render_token = renderer.render_token
+        push = renderer.push
+        start_span = renderer.start_span
+        start_block = renderer.start_block
+        end_block = renderer.end_block
+
+        @wraps(render_token)
+        def profiled_render_token(token):
+            name = type(token).__name__
+            frame = Frame(name, time.perf_counter_ns(), self.pushed)
+            self.frames.append(frame)
+            self.active[name] += 1
+
+            try:
+                result = render_token(token)
+            except BaseException:
+                self.leave(frame)
+                raise
+
+            # the token stays open until the tokens inside it have been rendered
+            if type(result) is GeneratorType:
+                return self.profiled_generator(frame, result)
+
+            self.leave(frame, result)
+            return result
+
+        @wraps(push)
+        def profiled_push(*elements):
+            for element in elements:
+                if type(element) is str:
+                    self.pushed += len(element)
+                elif type(element) is String:
+                    self.pushed += len(element.value)
+
+            push(*elements)
+
+        @wraps(start_span)
+        def profiled_start_span(action=None):
+            return start_span(action=self.timed_action(action))
+
+        @wraps(start_block)
+        def profiled_start_block(string=None, action=None, deindent=None):
+            if string is not None:
+                self.pushed += len(string)
+
+            return start_block(string, action=self.timed_action(action), deindent=deindent)
+
+        @wraps(end_block)
+        def profiled_end_block(string=None):
+            if string is not None:
+                self.pushed += len(string)
+
+            end_block(string)
+
+        renderer.render_token = profiled_render_token
+        renderer.push = profiled_push
+        renderer.start_span = profiled_start_span
+        renderer.start_block = profiled_start_block
+        renderer.end_block = profiled_end_block
+
+    def profiled_generator(self, frame, generator):
+        try:
+            yield from generator
+        finally:
+            self.leave(frame)
+
+    def leave(self, frame, result=None):
+        name = frame.name
+        self.active[name] -= 1
+        self.frames.pop()
+        self.record(frame, time.perf_counter_ns() - frame.start)
+
+        # a token may return its output rather than pushing it
+        if self.pushed == frame.pushed and type(result) is str:
+            self.stats[name].bytes += len(result)
+            self.stats[name].self_bytes += max(0, len(result) - frame.child_bytes)
+
+            if self.frames:
+                self.frames[-1].child_bytes += len(result)
+
+    def record(self, frame, elapsed):
+        stats = self.stats[frame.name]
+        produced = self.pushed - frame.pushed
+
+        stats.calls += 1
+        stats.self += elapsed - frame.children
+        stats.self_bytes += max(0, produced - frame.child_bytes)
+
+        # only the outermost of nested tokens of the same type counts towards the cumulative totals
+        if self.active[frame.name] == 0:
+            stats.cumulative += elapsed
+            stats.bytes += produced
+
+        if self.frames:
+            self.frames[-1].children += elapsed
+            self.frames[-1].child_bytes += produced
+
+    def timed_action(self, action):
+        """
+        Wrap an action so that the time spent applying it, which happens
+        when the element tree is rendered rather than when the token is,
+        is still counted towards the token which attached it.
+        """
+        if action is None or not self.frames:
+            return action
+
+        stats = self.stats[self.frames[-1].name]
+
+        def timed(text):
+            start = time.perf_counter_ns()
+            result = action(text)
+            elapsed = time.perf_counter_ns() - start
+            stats.actions += elapsed
+
+            # don't count it again as self time of whichever token is rendering the tree
+            if self.frames:
+                self.frames[-1].children += elapsed
+
+            return result
+
+        return timed
+
+    def report(self):
+        """
+        The recorded statistics as a JSON-compatible dictionary, with the
+        token types ordered by their self time.
+        """
+        tokens = sorted(self.stats.items(), key=lambda item: item[1].self + item[1].actions, reverse=True)
+
+        return {
+            'tokens': {
+                name: {
+                    'calls': stats.calls,
+                    'cumulative_seconds': stats.cumulative / 1e9,
+                    'self_seconds': stats.self / 1e9,
+                    'action_seconds': stats.actions / 1e9,
+                    'output_bytes': stats.bytes,
+                    'self_output_bytes': stats.self_bytes,
+                }
+                for name, stats in tokens
+            },
+            'total_seconds': sum(stats.self + stats.actions for stats in self.stats.values()) / 1e9,
+        }
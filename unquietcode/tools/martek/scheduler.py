@@ -0,0 +1,143 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from tempfile import TemporaryDirectory
+from typing import Iterable, Iterator, Optional, Tuple
+
+from .compiler import ENGINE, compile_pdf
+
+
+@dataclass
+class CompileResult:
+    pdf_file_path: str
+    log: Optional[str]
+    seconds: float
+
+    @property
+    def cached(self):
+        return self.log is None
+
+
+class CompileScheduler:
+    """
+    Runs TeX compile jobs from a queue, with at most `max_workers` engine
+    processes running at once. Every job is compiled in a working directory
+    of its own, and each submission returns a future for its result.
+    """
+
+    def __init__(self, max_workers=2, engine=ENGINE, precompile=False, cache=True):
+        self.max_workers = max_workers
+        self.engine = engine
+        self.precompile = precompile
+        self.cache = cache
+
+        # the engine runs in a subprocess, so threads are enough to drive it
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='martek-compile')
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, tex: str, pdf_file_path: str) -> Future:
+        """
+        Queue a LaTeX document to be compiled into the given PDF file.
+        """
+        with self.lock:
+            self.queued += 1
+
+        future = self.executor.submit(self.compile, tex, pdf_file_path)
+
+        with self.lock:
+            self.pending.add(future)
+
+        future.add_done_callback(self.done)
+
+        return future
+
+    def map(self, jobs: Iterable[Tuple[str, str]], ordered=True) -> Iterator[CompileResult]:
+        """
+        Compile many (tex, pdf_file_path) jobs, yielding the results either
+        in the order they were given or else as soon as each one finishes.
+        """
+        futures = [self.submit(tex, pdf_file_path) for tex, pdf_file_path in jobs]
+
+        if not ordered:
+            futures = as_completed(futures)
+
+        for future in futures:
+            yield future.result()
+
+    def compile(self, tex, pdf_file_path) -> CompileResult:
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+
+        start = time.perf_counter()
+        succeeded = False
+
+        try:
+            with TemporaryDirectory() as tmp:
+                tex_file_path = f"{tmp}/data.tex"
+
+                with open(tex_file_path, 'w') as tex_file:
+                    tex_file.write(tex)
+
+                log = compile_pdf(
+                    tex_file_path,
+                    pdf_file_path,
+                    engine=self.engine,
+                    precompile=self.precompile,
+                    cache=self.cache,
+                )
+
+            succeeded = True
+        finally:
+            with self.lock:
+                self.running -= 1
+
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+        seconds = time.perf_counter() - start
+        log = log.decode('utf-8', errors='replace') if log is not None else None
+
+        return CompileResult(pdf_file_path, log, seconds)
+
+    def done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+            if future.cancelled():
+                self.queued -= 1
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'max_workers': self.max_workers,
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        # shutdown(cancel_futures=...) needs Python 3.9, so jobs which have not started are cancelled here
+        if cancel_pending:
+            with self.lock:
+                pending = list(self.pending)
+
+            for future in pending:
+                future.cancel()
+
+        self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, traceback):
+        self.shutdown()
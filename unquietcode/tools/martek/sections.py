@@ -0,0 +1,375 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+try:
+    from pypdf import PdfWriter
+except ImportError:
+    PdfWriter = None
+
+from .compiler import ENGINE, compile_latex, deliver_pdf, engine_command
+from .helpers import parse_markdown
+from .latex_renderer import LatexRenderer, POSTAMBLE
+
+
+MAIN_NAME = 'main'
+DOCUMENT_NAME = 'document.pdf'
+STATE_NAME = 'martek-build.json'
+
+# written to the terminal as each section starts, so that the output of the engine can be timed
+SECTION_MARKER = 'martek-section:'
+SECTION_PATTERN = re.compile(r'martek-section:(section-\d+)')
+
+PAGE_PATTERN = re.compile(r'\\setcounter\{page\}\{(-?\d+)\}')
+IMAGE_PATTERN = re.compile(r'\\includegraphics(?:\[[^\]]*\])?\{([^}]*)\}')
+
+SECTION_FILE_PATTERN = re.compile(r'section-\d+\.(tex|aux)')
+
+HEADINGS = {'Heading', 'SetextHeading'}
+
+
+@dataclass
+class SectionResult:
+    name: str
+    title: str
+    pages: int
+    # None when the pages were reused from the last build
+    seconds: Optional[float] = None
+
+
+def split_sections(blocks):
+    """
+    Split the top-level blocks of a document into sections, each starting
+    at a top-level heading. Anything before the first heading is a section
+    of its own.
+    """
+    sections = []
+
+    for block in blocks:
+        if not sections or (type(block).__name__ in HEADINGS and block.level == 1):
+            sections.append([])
+
+        sections[-1].append(block)
+
+    return sections
+
+
+def section_title(renderer, blocks):
+    first = blocks[0]
+
+    if type(first).__name__ in HEADINGS and first.level == 1:
+        return renderer.render_to_plain(first).strip()
+
+    return '(preface)'
+
+
+def image_stamps(body, image_dir):
+    """
+    The size and modification time of every image a section includes, since
+    a changed image changes the section without changing its LaTeX.
+    """
+    stamps = []
+
+    for src in IMAGE_PATTERN.findall(body):
+        path = src if os.path.isabs(src) else os.path.join(image_dir, src)
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stamps.append(f"{src}:missing")
+        else:
+            stamps.append(f"{src}:{stat.st_size}:{stat.st_mtime_ns}")
+
+    return '\n'.join(stamps)
+
+
+def sha1(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def read_page_end(aux_file_path):
+    """
+    The page counter at the end of an included file, as saved in its .aux
+    file, which is the number of the page the next section starts on.
+    """
+    with open(aux_file_path, 'r', errors='replace') as aux_file:
+        pages = PAGE_PATTERN.findall(aux_file.read())
+
+    if not pages:
+        raise Exception(f"no page count in {aux_file_path}")
+
+    return int(pages[-1])
+
+
+def run_timed(tex_file_path, engine=ENGINE, precompile=False):
+    """
+    Run the engine over a .tex file, timing each section from the moment
+    it is reported on the terminal until the next one is. Returns the
+    output of the engine and the seconds taken by each section, raising
+    CalledProcessError on failure.
+    """
+    command, directory, env = engine_command(tex_file_path, engine, precompile)
+    process = subprocess.Popen(command, cwd=directory, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+
+    output = bytearray()
+    timings = {}
+    current = None
+    started = time.perf_counter()
+
+    with process:
+        while chunk := os.read(process.stdout.fileno(), 64 * 1024):
+            now = time.perf_counter()
+            scanned = max(0, len(output) - len(SECTION_MARKER) - 16)
+            output.extend(chunk)
+
+            for match in SECTION_PATTERN.finditer(output[scanned:].decode('utf-8', errors='replace')):
+                if match.group(1) == current:
+                    continue
+
+                if current is not None:
+                    timings[current] = now - started
+
+                current, started = match.group(1), now
+
+        process.wait()
+
+    if current is not None:
+        timings[current] = time.perf_counter() - started
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, output=bytes(output))
+
+    return bytes(output), timings
+
+
+def merge_pages(parts, pdf_file_path, engine=ENGINE):
+    """
+    Write the given (PDF file, first page, last page) ranges, in order,
+    into a single PDF. Uses pypdf when it is installed, and otherwise
+    has the engine put the pages together with pdfpages.
+    """
+    if PdfWriter is not None:
+        writer = PdfWriter()
+
+        for path, first, last in parts:
+            writer.append(path, pages=(first - 1, last))
+
+        with open(pdf_file_path, 'wb') as pdf_file:
+            writer.write(pdf_file)
+
+        return
+
+    directory = os.path.dirname(pdf_file_path)
+    tex_file_path = os.path.join(directory, 'merge.tex')
+
+    with open(tex_file_path, 'w') as tex_file:
+        tex_file.write("\\documentclass{article}\n\\usepackage{pdfpages}\n\\begin{document}\n")
+
+        for path, first, last in parts:
+            tex_file.write(f"\\includepdf[pages={{{first}-{last}}}]{{{os.path.relpath(path, directory)}}}\n")
+
+        tex_file.write(POSTAMBLE + "\n")
+
+    compile_latex(tex_file_path, engine=engine, precompile=False)
+    os.replace(os.path.join(directory, 'merge.pdf'), pdf_file_path)
+
+
+class SectionBuild:
+    """
+    Compiles a document split into sections, one .tex file for each
+    top-level heading, which the main file pulls in with \\include. The
+    files are kept in a build directory along with the last PDF and the
+    state of the last build, so that the next build only compiles the
+    sections which have changed (using \\includeonly) and takes the
+    pages of the others from the last PDF.
+
+    A section which changes its number of pages moves every section after
+    it, so those are compiled again as well. Anything which changes the
+    preamble or the list of sections means compiling everything.
+
+    \\include starts a new page, so every top-level heading starts on a
+    page of its own, unlike in a document compiled whole.
+    """
+
+    def __init__(self, build_dir, engine=ENGINE, precompile=False):
+        self.build_dir = os.path.abspath(build_dir)
+        self.engine = engine
+        self.precompile = precompile
+
+        os.makedirs(self.build_dir, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.build_dir, name)
+
+    def load_state(self):
+        try:
+            with open(self.path(STATE_NAME), 'r') as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return None
+
+    def save_state(self, state):
+        tmp_path = self.path(STATE_NAME + '.tmp')
+
+        with open(tmp_path, 'w') as state_file:
+            json.dump(state, state_file, indent=2)
+
+        os.replace(tmp_path, self.path(STATE_NAME))
+
+    def render(self, markdown_data, **options):
+        """
+        Render markdown to a preamble and a list of (name, title, body,
+        hash) sections.
+        """
+        with LatexRenderer(**options) as renderer:
+            document = parse_markdown(markdown_data)
+            sections = split_sections(document.children)
+            titles = [section_title(renderer, blocks) for blocks in sections]
+            preamble, bodies = renderer.render_sections(sections)
+            image_dir = renderer.image_dir
+
+        names = [f"section-{idx:03d}" for idx in range(len(sections))]
+        sections = [
+            (name, title, body, sha1(body + image_stamps(body, image_dir)))
+            for name, title, body in zip(names, titles, bodies)
+        ]
+
+        return preamble, sections
+
+    def build(self, markdown_data, pdf_file_path, **options):
+        """
+        Render markdown to a PDF, compiling only what has changed since the
+        last build. Returns a SectionResult for each section.
+        """
+        preamble, sections = self.render(markdown_data, **options)
+        names = [name for name, _, _, _ in sections]
+        main_hash = sha1(f"{self.engine}\n{preamble}\n{','.join(names)}")
+
+        state = self.load_state()
+        document_path = self.path(DOCUMENT_NAME)
+
+        if state is None or state['main'] != main_hash or not os.path.exists(document_path):
+            state = {'main': main_hash, 'sections': {}}
+
+        old = state['sections']
+
+        for name, _, body, _ in sections:
+            with open(self.path(f"{name}.tex"), 'w') as section_file:
+                section_file.write(f"\\message{{{SECTION_MARKER}{name}}}\n{body}\n")
+
+        included = [name for name, _, _, hash in sections if old.get(name, {}).get('hash') != hash]
+        ends = {name: old[name]['end'] for name in names if name in old}
+        timings = {}
+        sources = {}
+        passes = []
+        compiled = set()
+
+        while included:
+            pass_path = self.path(f"pass-{len(passes) + 1}.pdf")
+            passes.append(pass_path)
+
+            try:
+                timings.update(self.compile(preamble, names, included))
+            except BaseException:
+                # a failed run can leave the .aux files of the sections it got to half written,
+                # and an earlier pass has rewritten those of the sections it compiled, so all of
+                # them are compiled again next time (their pages in the last PDF are unchanged)
+                for name in compiled.union(included):
+                    if name in old:
+                        old[name] = {'end': old[name]['end']}
+
+                self.save_state(state)
+                raise
+
+            compiled.update(included)
+            os.replace(self.path(f"{MAIN_NAME}.pdf"), pass_path)
+
+            page = start = 1
+            moved = None
+
+            # the pages of the included sections follow one another in the new PDF
+            for idx, name in enumerate(names):
+                if name in included:
+                    end = read_page_end(self.path(f"{name}.aux"))
+                    sources[name] = (pass_path, page, page + end - start - 1)
+                    page += end - start
+
+                    if moved is None and ends.get(name) != end:
+                        moved = idx
+
+                    ends[name] = end
+
+                start = ends[name]
+
+            # sections which were not compiled after one which moved have the wrong page numbers,
+            # and so does everything after them, so a second pass compiles them all
+            stale = [name for name in names[moved + 1:] if name not in included] if moved is not None else []
+            included = names[names.index(stale[0]):] if stale else []
+
+        results = []
+        parts = []
+        start = 1
+
+        for name, title, _, hash in sections:
+            end = ends[name]
+
+            if end > start:
+                parts.append(sources.get(name, (document_path, start, end - 1)))
+
+            seconds = timings.get(name) if name in sources else None
+            results.append(SectionResult(name, title, end - start, seconds))
+            start = end
+
+        # the files of sections which have since been removed
+        for file_name in os.listdir(self.build_dir):
+            if SECTION_FILE_PATTERN.fullmatch(file_name) and os.path.splitext(file_name)[0] not in names:
+                os.remove(self.path(file_name))
+
+        state['sections'] = {name: {'hash': hash, 'end': ends[name]} for name, _, _, hash in sections}
+
+        if passes:
+            tmp_path = document_path + '.tmp'
+
+            # a single pass over every section is the whole document already
+            if len(passes) == 1 and len(sources) == len(names):
+                os.replace(passes[0], tmp_path)
+            else:
+                merge_pages(parts, tmp_path, engine=self.engine)
+
+            os.replace(tmp_path, document_path)
+
+            for pass_path in passes:
+                if os.path.exists(pass_path):
+                    os.remove(pass_path)
+
+        self.save_state(state)
+        deliver_pdf(document_path, pdf_file_path)
+
+        return results
+
+    def compile(self, preamble, names, included):
+        main = preamble.replace('\\begin{document}', f"\\includeonly{{{','.join(included)}}}\n\\begin{{document}}", 1)
+        includes = '\n'.join(f"\\include{{{name}}}" for name in names)
+        tex_file_path = self.path(f"{MAIN_NAME}.tex")
+
+        with open(tex_file_path, 'w') as tex_file:
+            tex_file.write(f"{main}\n{includes}\n{POSTAMBLE}\n")
+
+        _, timings = run_timed(tex_file_path, engine=self.engine, precompile=self.precompile)
+        return timings
+
+
+def render_sectioned_pdf(markdown_data, pdf_file_path, build_dir, image_dir=None, engine=ENGINE, precompile=False, **options):
+    """
+    Render markdown to a PDF with one .tex file for each top-level section,
+    kept in `build_dir` so that the next render only compiles the sections
+    which have changed. Returns a SectionResult for each section, with the
+    time taken to typeset it, or None if its pages were reused.
+    """
+    build = SectionBuild(build_dir, engine=engine, precompile=precompile)
+    return build.build(markdown_data, pdf_file_path, image_dir=image_dir, **options)
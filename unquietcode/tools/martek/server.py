@@ -0,0 +1,346 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from .compiler import ENGINE, render_pdf
+from .pool import RendererPool
+
+
+class HttpError(Exception):
+
+    def __init__(self, status: HTTPStatus, message=None, headers=None):
+        super().__init__(message or status.phrase)
+        self.status = status
+        self.message = message or status.phrase
+        self.headers = headers or {}
+
+
+class RenderServer:
+    """
+    A small HTTP service which renders markdown sent to it.
+
+        POST /latex     markdown in, LaTeX out
+        POST /pdf       markdown in, PDF out
+        GET  /health    status and metrics, as JSON
+
+    PDF jobs wait in a bounded queue for one of a fixed number of compile
+    workers. When every worker is busy and the queue is full, new jobs are
+    turned away with a 429, and jobs which wait in the queue for too long
+    are dropped with a 503, as are those left when the server stops.
+
+    LaTeX jobs are rendered on threads of their own, so that they can't
+    hold up the compiles, and are admitted in the same way: up to one per
+    worker rendering and `latex_queue_size` waiting, with a 429 beyond.
+    """
+
+    def __init__(
+        self,
+        host='127.0.0.1',
+        port=8000,
+        workers=2,
+        queue_size=16,
+        queue_timeout=60.0,
+        latex_queue_size=None,
+        max_body_size=16 * 1024 * 1024,
+        engine=ENGINE,
+        cache=True,
+    ):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.latex_queue_size = queue_size if latex_queue_size is None else latex_queue_size
+        self.max_body_size = max_body_size
+        self.engine = engine
+        self.cache = cache
+
+        self.renderers = RendererPool(size=workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='martek-serve')
+        self.latex_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='martek-latex')
+        self.queue = None
+        self.server = None
+        self.tasks = []
+        self.jobs = set()
+        self.draining = False
+
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expired = 0
+
+        self.latex_pending = 0
+        self.latex_completed = 0
+        self.latex_rejected = 0
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self.compile_worker()) for _ in range(self.workers)]
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+
+        # the port may have been chosen by the system
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.start()
+
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        self.draining = True
+        self.server.close()
+
+        for task in self.tasks:
+            task.cancel()
+
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        # jobs still waiting, or whose compile was cut short, are turned
+        # away rather than left hanging
+        for future in self.jobs:
+            if not future.done():
+                future.set_exception(HttpError(HTTPStatus.SERVICE_UNAVAILABLE))
+
+        # only once no connection is waiting on a job, since this waits for
+        # the open connections to close on newer versions of Python
+        await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+        self.latex_executor.shutdown(wait=False)
+
+    def metrics(self):
+        return {
+            'status': 'draining' if self.draining else 'ok',
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'queued': self.pending - self.running,
+            'running': self.running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'expired': self.expired,
+            'latex': {
+                'pending': self.latex_pending,
+                'completed': self.latex_completed,
+                'rejected': self.latex_rejected,
+            },
+        }
+
+    ########################################################################
+
+    async def compile_worker(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            markdown, queued_at, future = await self.queue.get()
+
+            try:
+                if future.cancelled():
+                    continue
+
+                if loop.time() - queued_at > self.queue_timeout:
+                    self.expired += 1
+                    future.set_exception(HttpError(HTTPStatus.SERVICE_UNAVAILABLE, headers={'Retry-After': '5'}))
+                    continue
+
+                self.running += 1
+
+                try:
+                    pdf = await loop.run_in_executor(self.executor, self.compile, markdown)
+                except Exception as ex:
+                    self.failed += 1
+
+                    if not future.cancelled():
+                        future.set_exception(ex)
+                else:
+                    self.completed += 1
+
+                    if not future.cancelled():
+                        future.set_result(pdf)
+                finally:
+                    self.running -= 1
+            finally:
+                self.queue.task_done()
+
+    def compile(self, markdown):
+        pdf_file = io.BytesIO()
+        render_pdf(markdown, pdf_file, engine=self.engine, cache=self.cache)
+
+        return pdf_file.getvalue()
+
+    async def render_pdf(self, markdown):
+        if self.draining:
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        # count admitted jobs rather than the queue length, since a worker
+        # may not have taken its job off the queue yet
+        if self.pending >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise HttpError(HTTPStatus.TOO_MANY_REQUESTS, headers={'Retry-After': '1'})
+
+        self.pending += 1
+        self.jobs.add(future)
+        self.queue.put_nowait((markdown, loop.time(), future))
+
+        try:
+            return await future
+        except subprocess.CalledProcessError as ex:
+            log = ex.stdout.decode('utf-8', errors='replace') if ex.stdout else ''
+            raise HttpError(HTTPStatus.UNPROCESSABLE_ENTITY, f"{ex.cmd[0]} exited with status {ex.returncode}\n{log}")
+        finally:
+            self.pending -= 1
+            self.jobs.discard(future)
+
+    async def render_latex(self, markdown):
+        if self.draining:
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE)
+
+        if self.latex_pending >= self.workers + self.latex_queue_size:
+            self.latex_rejected += 1
+            raise HttpError(HTTPStatus.TOO_MANY_REQUESTS, headers={'Retry-After': '1'})
+
+        loop = asyncio.get_running_loop()
+        self.latex_pending += 1
+
+        try:
+            latex = await loop.run_in_executor(self.latex_executor, self.renderers.render, markdown)
+        finally:
+            self.latex_pending -= 1
+
+        self.latex_completed += 1
+        return latex
+
+    ########################################################################
+
+    async def handle_connection(self, reader, writer):
+        try:
+            try:
+                method, path, body = await self.read_request(reader)
+                content_type, content = await self.route(method, path, body)
+                await self.respond(writer, HTTPStatus.OK, content_type, content)
+
+            except HttpError as ex:
+                await self.respond(writer, ex.status, 'text/plain; charset=utf-8', ex.message.encode('utf-8'), ex.headers)
+
+            except Exception as ex:
+                message = f"{type(ex).__name__}: {ex}".encode('utf-8')
+                await self.respond(writer, HTTPStatus.INTERNAL_SERVER_ERROR, 'text/plain; charset=utf-8', message)
+
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def route(self, method, path, body):
+        path = path.split('?', 1)[0]
+
+        if path == '/health':
+            if method != 'GET':
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED)
+
+            return 'application/json', json.dumps(self.metrics()).encode('utf-8')
+
+        if path in ('/pdf', '/latex'):
+            if method != 'POST':
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED)
+
+            try:
+                markdown = body.decode('utf-8')
+            except UnicodeDecodeError:
+                raise HttpError(HTTPStatus.BAD_REQUEST, "markdown must be UTF-8")
+
+            if path == '/pdf':
+                return 'application/pdf', await self.render_pdf(markdown)
+            else:
+                return 'application/x-tex; charset=utf-8', (await self.render_latex(markdown)).encode('utf-8')
+
+        raise HttpError(HTTPStatus.NOT_FOUND)
+
+    async def read_request(self, reader):
+        try:
+            request_line = await reader.readline()
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST)
+
+        headers = {}
+
+        while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST)
+
+        if length > self.max_body_size:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), path, body
+
+    @staticmethod
+    async def respond(writer, status: HTTPStatus, content_type, content: bytes, headers=None):
+        lines = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(content)}",
+            "Connection: close",
+        ]
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        writer.write(content)
+        await writer.drain()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="martek serve",
+        description="serve markdown rendering over HTTP",
+    )
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8000, help="port to listen on (default: 8000)")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help="concurrent compiles (default: one per core)")
+    parser.add_argument('--queue', type=int, default=16, help="compile jobs which can wait for a worker (default: 16)")
+    parser.add_argument('--latex-queue', type=int, default=None, help="LaTeX renders which can wait for a thread (default: same as --queue)")
+    parser.add_argument('--queue-timeout', type=float, default=60.0, help="seconds a job can wait before being dropped (default: 60)")
+    parser.add_argument('--engine', default=ENGINE, help=f"TeX engine to run (default: {ENGINE})")
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help="always run the engine, ignoring cached PDFs")
+    options = parser.parse_args(args)
+
+    server = RenderServer(
+        host=options.host,
+        port=options.port,
+        workers=options.workers,
+        queue_size=options.queue,
+        queue_timeout=options.queue_timeout,
+        latex_queue_size=options.latex_queue,
+        engine=options.engine,
+        cache=options.cache,
+    )
+
+    print(f"serving on http://{options.host}:{options.port}")
+
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+    return 0